@@ -0,0 +1,220 @@
+"""
+File: benchmarks/broker.py
+Email: e.roderick@uqconnect.edu.au
+Description: A minimal in-process MQTT 3.1.1 broker, so benchmarks and load
+    tests can run without mosquitto. Supports connecting, QoS 0/1 publishing,
+    subscriptions with wildcards, and keep-alive pings. Messages are always
+    forwarded to subscribers with QoS 0. Not intended for production use.
+"""
+
+import socket
+import socketserver
+import struct
+import threading
+
+# Constants
+CONNECT = 0x10
+CONNACK = 0x20
+PUBLISH = 0x30
+PUBACK = 0x40
+SUBSCRIBE = 0x80
+SUBACK = 0x90
+UNSUBSCRIBE = 0xA0
+UNSUBACK = 0xB0
+PINGREQ = 0xC0
+PINGRESP = 0xD0
+DISCONNECT = 0xE0
+
+
+# Functions
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    """ Check if a topic matches a subscription filter with `+` and `#`
+        wildcards.
+    """
+    filter_levels = topic_filter.split('/')
+    topic_levels = topic.split('/')
+
+    for i, level in enumerate(filter_levels):
+        if level == '#':
+            return True
+        if i >= len(topic_levels):
+            return False
+        if level not in ('+', topic_levels[i]):
+            return False
+
+    return len(filter_levels) == len(topic_levels)
+
+
+def _encode_length(length: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        out.append(byte | 0x80 if length else byte)
+        if not length:
+            return bytes(out)
+
+
+def _packet(header: int, body: bytes = b'') -> bytes:
+    return bytes([header]) + _encode_length(len(body)) + body
+
+
+def _publish_packet(topic: str, payload: bytes) -> bytes:
+    topic = topic.encode()
+    return _packet(PUBLISH, struct.pack('!H', len(topic)) + topic + payload)
+
+
+# Classes
+class _Session(socketserver.BaseRequestHandler):
+    """ Handles a single client connection. """
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._stream = self.request.makefile('rb')
+        self._send_lock = threading.Lock()
+        self.filters = set()
+        self.server.broker.add(self)
+
+    def send(self, data: bytes):
+        """ Send a packet to the client, whole, from any thread. """
+        with self._send_lock:
+            self.request.sendall(data)
+
+    def _read_packet(self):
+        header = self._stream.read(1)
+        if not header:
+            return None, None
+
+        length, shift = 0, 0
+        while True:
+            byte = self._stream.read(1)[0]
+            length |= (byte & 0x7F) << shift
+            shift += 7
+            if not byte & 0x80:
+                break
+
+        return header[0], self._stream.read(length)
+
+    def handle(self):
+        broker = self.server.broker
+        try:
+            while True:
+                header, body = self._read_packet()
+                if header is None:
+                    break
+
+                kind = header & 0xF0
+                if kind == CONNECT:
+                    self.send(_packet(CONNACK, b'\x00\x00'))
+
+                elif kind == PUBLISH:
+                    qos = (header >> 1) & 0x03
+                    (topic_len,) = struct.unpack_from('!H', body)
+                    topic = body[2:2 + topic_len].decode()
+                    offset = 2 + topic_len
+                    if qos:
+                        packet_id = body[offset:offset + 2]
+                        offset += 2
+                        self.send(_packet(PUBACK, packet_id))
+                    broker.route(topic, body[offset:])
+
+                elif kind == SUBSCRIBE:
+                    packet_id, offset, granted = body[:2], 2, bytearray()
+                    while offset < len(body):
+                        (filter_len,) = struct.unpack_from('!H', body, offset)
+                        offset += 2
+                        self.filters.add(
+                            body[offset:offset + filter_len].decode()
+                        )
+                        offset += filter_len + 1 # Skip requested QoS
+                        granted.append(0)
+                    self.send(_packet(SUBACK, packet_id + bytes(granted)))
+
+                elif kind == UNSUBSCRIBE:
+                    packet_id, offset = body[:2], 2
+                    while offset < len(body):
+                        (filter_len,) = struct.unpack_from('!H', body, offset)
+                        offset += 2
+                        self.filters.discard(
+                            body[offset:offset + filter_len].decode()
+                        )
+                        offset += filter_len
+                    self.send(_packet(UNSUBACK, packet_id))
+
+                elif kind == PINGREQ:
+                    self.send(_packet(PINGRESP))
+
+                elif kind == DISCONNECT:
+                    break
+        except (OSError, IndexError):
+            pass
+
+    def finish(self):
+        self.server.broker.remove(self)
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, broker, address):
+        self.broker = broker
+        super().__init__(address, _Session)
+
+
+class StandInBroker():
+    """ An MQTT broker running on background threads. Use as a context manager
+        or call `start` and `stop`.
+    """
+    def __init__(self, host: str = "127.0.0.1", port: int = 0) -> None:
+        """ Construct a broker. A port of 0 picks a free port. """
+        self._server = _Server(self, (host, port))
+        self._sessions = set()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            daemon=True
+        )
+
+    @property
+    def address(self) -> tuple[str, int]:
+        """ (tuple[str, int]) The host and port the broker listens on. """
+        return self._server.server_address
+
+    def add(self, session: _Session) -> None:
+        """ Start routing messages to a connected client. """
+        with self._lock:
+            self._sessions.add(session)
+
+    def remove(self, session: _Session) -> None:
+        """ Stop routing messages to a disconnected client. """
+        with self._lock:
+            self._sessions.discard(session)
+
+    def route(self, topic: str, payload: bytes) -> None:
+        """ Forward a published message to every matching subscriber. """
+        packet = None
+        with self._lock:
+            sessions = list(self._sessions)
+
+        for session in sessions:
+            if any(topic_matches(f, topic) for f in session.filters):
+                packet = packet or _publish_packet(topic, payload)
+                try:
+                    session.send(packet)
+                except OSError:
+                    pass
+
+    def start(self) -> 'StandInBroker':
+        """ Start accepting clients on a background thread. """
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """ Stop accepting clients and close the listening socket. """
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> 'StandInBroker':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
@@ -0,0 +1,65 @@
+"""
+File: benchmarks/db_connections.py
+Email: e.roderick@uqconnect.edu.au
+Description: Compare device status messages/sec through the dispatcher's
+    `handle_listener_dev` when opening a connection per message, against the
+    pooled writer connection.
+
+    Run from the `py` directory with `python -m benchmarks.db_connections`.
+"""
+
+import os
+import sqlite3 as sql
+import sys
+import tempfile
+from unittest import mock
+
+# Point the database at a scratch file before any project module reads it
+_tmp = tempfile.mkdtemp(prefix="shems-bench-")
+os.environ['SHEMS_DB_PATH'] = os.path.join(_tmp, "pooled.sqlite3")
+
+# pylint: disable=wrong-import-position
+from benchmarks.timing import rate, report
+from database import _dev_access
+from dispatch.actions import handle_listener_dev
+import database.access as db
+
+MESSAGES = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+LEGACY_DB_PATH = os.path.join(_tmp, "legacy.sqlite3")
+
+
+def _legacy_get_cursor() -> tuple[sql.Connection, sql.Cursor]:
+    """ The original access pattern: a new connection for every call. """
+    con = sql.connect(LEGACY_DB_PATH)
+    return con, con.cursor()
+
+
+def _message(i: int) -> list[str]:
+    return [f"bench-dev-{i % 50}", "192.168.0.2", "Bench device", str(i), "0.5"]
+
+
+def main():
+    """ Time announcements with a connection per message, then with the
+        pooled writer, and report both.
+    """
+    _dev_access.create_database()
+    with mock.patch.object(_dev_access, 'SHEMS_DB_PATH', LEGACY_DB_PATH):
+        _dev_access.create_database()
+
+    with mock.patch.object(db, 'get_cursor', _legacy_get_cursor):
+        counter = iter(range(MESSAGES))
+        legacy = rate(lambda: handle_listener_dev(_message(next(counter))),
+                      MESSAGES)
+
+    counter = iter(range(MESSAGES))
+    pooled = rate(lambda: handle_listener_dev(_message(next(counter))),
+                  MESSAGES)
+    db.close_connections()
+
+    report("handle_listener_dev (connect per msg)", legacy, "msg/s")
+    report("handle_listener_dev (pooled writer)", pooled, "msg/s")
+    report("speedup", pooled / legacy, "x")
+
+
+if __name__ == "__main__":
+    main()
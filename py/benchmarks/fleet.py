@@ -0,0 +1,453 @@
+"""
+File: benchmarks/fleet.py
+Email: e.roderick@uqconnect.edu.au
+Description: A load generator that simulates a fleet of SHEMS devices, built on
+    the message formats of dummy_client. Virtual devices are spread over a
+    number of MQTT connections, and publish status updates and alarms at the
+    configured rates. DER Controls are POSTed to the hub's notify endpoint,
+    and the time until each is relayed back on `shem/ntfy/#` is recorded.
+
+    Run from the `py` directory with `python -m benchmarks.fleet [options]`.
+    Without --url, a hub is run in-process against a stand-in broker. As the
+    hub then shares the interpreter with the fleet, use --url and --broker
+    against a real deployment to size a hub.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Callable, Iterator
+
+import paho.mqtt.client as mqtt
+from lxml import etree as ET
+
+from benchmarks.broker import StandInBroker
+from benchmarks.timing import percentile, report
+from dummy_client import alarm_message, device_message
+from dummy_client import MQTT_TOPIC_ALARM, MQTT_TOPIC_DEVICE, MQTT_TOPIC_NOTIFY
+from relay.payload import encode_alarm, encode_device
+
+# Constants
+DISTRIBUTIONS = ('uniform', 'poisson', 'burst')
+CONNECT_TIMEOUT = 10
+REGISTER_TIMEOUT = 30
+HEADERS = {'content-type': 'application/sep+xml'}
+
+DEVICES_PATH = "/shem/dev/"
+NOTIFY_PATH = "/shem/ntfy/"
+
+# The probe number is sent as the control value, so each relayed value can be
+# matched to the request that caused it
+PROBE_CODE = "opModFixedW"
+CONTROL_TEMPLATE = (
+    '<DERControl href="/derp/0/derc/{probe}" replyTo="/rsp" '
+    'responsesRequired="0">'
+    '<mRID>{mrid}</mRID>'
+    '<description>Fleet probe</description>'
+    '<creationTime>{now}</creationTime>'
+    '<interval><duration>{duration}</duration><start>{now}</start></interval>'
+    '<EventStatus><currentStatus>0</currentStatus><dateTime>{now}</dateTime>'
+    '<potentiallySuperceded>false</potentiallySuperceded></EventStatus>'
+    '<DERControlBase><' + PROBE_CODE + '>{probe}</' + PROBE_CODE + '>'
+    '</DERControlBase>'
+    '</DERControl>'
+)
+
+
+# Classes
+class LatencyProbe():
+    """ Matches relayed control values to the time their control was sent. """
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._sent = {}
+        self.latencies = []
+
+    def sent(self, probe: int) -> None:
+        """ Notes the time the control carrying a probe value was sent. """
+        with self._lock:
+            self._sent[probe] = time.perf_counter()
+
+    def received(self, probe: int) -> None:
+        """ Records the latency of a relayed probe value, if it was sent. """
+        now = time.perf_counter()
+        with self._lock:
+            start = self._sent.pop(probe, None)
+            if start is not None:
+                self.latencies.append((now - start) * 1000)
+
+    def outstanding(self) -> int:
+        """ (int) The number of sent controls that have not been relayed. """
+        with self._lock:
+            return len(self._sent)
+
+
+class VirtualFleet():
+    """ A set of virtual devices sharing a pool of MQTT connections. Every
+        connection subscribes to relayed controls, and reports probe values
+        to a LatencyProbe.
+    """
+    def __init__(
+        self,
+        devices: int,
+        connections: int,
+        address: tuple[str, int],
+        probe: LatencyProbe,
+        binary: bool = False,
+    ) -> None:
+        self.devices = [f"fleet-dev-{i}" for i in range(devices)]
+        self._address = address
+        self._probe = probe
+        self._binary = binary
+        self._subscribed = threading.Semaphore(0)
+        self._clients = []
+
+        for i in range(max(1, min(connections, devices))):
+            client = mqtt.Client(f"fleet_{os.getpid()}_{i}")
+            client.on_connect = self._on_connect
+            client.on_subscribe = lambda *_: self._subscribed.release()
+            client.on_message = self._on_message
+            self._clients.append(client)
+
+    def _on_connect(self, client: mqtt.Client, _userdata, _flags, _ret_val):
+        client.subscribe(MQTT_TOPIC_NOTIFY + '#')
+
+    def _on_message(self, _client: mqtt.Client, _userdata, msg):
+        if msg.topic != MQTT_TOPIC_NOTIFY + PROBE_CODE:
+            return
+
+        try:
+            self._probe.received(int(msg.payload))
+        except ValueError:
+            pass
+
+    def start(self) -> None:
+        """ Connect every client, waiting until they have all subscribed.
+
+        Raises:
+            TimeoutError: If the clients do not subscribe in time.
+        """
+        for client in self._clients:
+            client.connect(*self._address)
+            client.loop_start()
+
+        deadline = time.monotonic() + CONNECT_TIMEOUT
+        for _ in self._clients:
+            # pylint: disable-next=consider-using-with
+            if not self._subscribed.acquire(
+                timeout=max(0, deadline - time.monotonic())
+            ):
+                raise TimeoutError("Fleet clients did not subscribe in time")
+
+    def stop(self) -> None:
+        """ Disconnect every client. """
+        for client in self._clients:
+            client.disconnect()
+            client.loop_stop()
+
+    def _client(self, index: int) -> mqtt.Client:
+        return self._clients[index % len(self._clients)]
+
+    def publish_status(self, event: int) -> None:
+        """ Publish a status message from the device of an event. """
+        index = event % len(self.devices)
+        ip = f"10.{index >> 16 & 255}.{index >> 8 & 255}.{index & 255}"
+        if self._binary:
+            payload = encode_device(self.devices[index], ip, "Fleet device",
+                                    time.time(), 0.5)
+        else:
+            payload = device_message(self.devices[index], ip, "Fleet device",
+                                     0.5)
+        self._client(index).publish(MQTT_TOPIC_DEVICE, payload)
+
+    def publish_alarm(self, event: int) -> None:
+        """ Publish an alarm from the device of an event. """
+        index = event % len(self.devices)
+        if self._binary:
+            payload = encode_alarm(self.devices[index], "opChargeStatus",
+                                   time.time(), 0.25, 0.25)
+        else:
+            payload = alarm_message(self.devices[index], "opChargeStatus",
+                                    0.25, 0.25)
+        self._client(index).publish(MQTT_TOPIC_ALARM, payload)
+
+
+# Functions
+def run_stream( # pylint: disable=too-many-arguments
+    send: Callable[[int], None],
+    rate: float,
+    distribution: str,
+    *,
+    burst: int,
+    until: float,
+    rng: random.Random,
+) -> int:
+    """ Call `send` with an increasing event number at an average of `rate`
+        calls per second, until the monotonic time `until`. If sending falls
+        behind, events are sent back to back until it catches up.
+
+    Params:
+        send: Sends a single event.
+        rate: The average number of events per second.
+        distribution: 'uniform' for evenly spaced events, 'poisson' for
+            exponentially distributed gaps, or 'burst' for groups of `burst`
+            events sent together.
+        burst: The number of events in each burst.
+        until: The time to stop sending at.
+        rng: The source of random gaps.
+
+    Returns:
+        The number of events sent.
+    """
+    if rate <= 0:
+        return 0
+
+    size = burst if distribution == 'burst' else 1
+    count = 0
+    due = time.monotonic()
+    while due < until:
+        delay = due - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+        for _ in range(size):
+            send(count)
+            count += 1
+
+        if distribution == 'poisson':
+            due += rng.expovariate(rate)
+        else:
+            due += size / rate
+
+    return count
+
+
+def _remote_hub(url: str):
+    """ Get request functions for a hub at a base URL. Both return the
+        response status and body.
+    """
+    def request(path: str, body: bytes = None) -> tuple[int, bytes]:
+        req = urllib.request.Request(
+            url.rstrip('/') + path,
+            data=body,
+            headers=HEADERS if body is not None else {}
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=10) as res:
+                return res.status, res.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    return request, request
+
+
+@contextlib.contextmanager
+def _local_hub(broker: tuple[str, int]) -> Iterator[tuple[Callable, Callable]]:
+    """ Run a hub in-process with a scratch database, connected to the given
+        broker. Yields request functions like `_remote_hub`.
+    """
+    tmp = tempfile.mkdtemp(prefix="shems-fleet-")
+    os.makedirs(os.path.join(tmp, "data"))
+    os.environ.update(
+        SHEMS_DB_PATH=os.path.join(tmp, "fleet.sqlite3"),
+        SHEMS_DATA_PATH=os.path.join(tmp, "data"),
+        MQTT_ADDR=broker[0],
+        MQTT_PORT=str(broker[1]),
+    )
+
+    # Project modules read the environment on import, so only import the
+    # server once it has been set
+    # pylint: disable=import-outside-toplevel
+    from fastapi.testclient import TestClient
+    from server.server import shems_server
+
+    with TestClient(shems_server) as client:
+        def get(path: str) -> tuple[int, bytes]:
+            res = client.get(path)
+            return res.status_code, res.content
+
+        def post(path: str, body: bytes) -> tuple[int, bytes]:
+            res = client.post(path, content=body, headers=HEADERS)
+            return res.status_code, res.content
+
+        yield get, post
+
+
+def wait_registered(get: Callable, devices: int) -> float:
+    """ Wait until the hub lists at least `devices` devices.
+
+    Returns:
+        The seconds waited.
+
+    Raises:
+        TimeoutError: If the devices are not listed in time.
+    """
+    start = time.monotonic()
+    while time.monotonic() - start < REGISTER_TIMEOUT:
+        status, body = get(DEVICES_PATH + "?l=0")
+        if status == 200 and int(ET.fromstring(body).get('all')) >= devices:
+            return time.monotonic() - start
+        time.sleep(0.1)
+
+    raise TimeoutError("Fleet devices were not registered in time")
+
+
+def run_fleet(args: argparse.Namespace, get: Callable, post: Callable) -> dict:
+    """ Register the fleet with the hub, then generate load for the configured
+        duration.
+
+    Returns:
+        The load generated and the control latencies observed.
+    """
+    rng = random.Random(args.seed)
+    probe = LatencyProbe()
+    fleet = VirtualFleet(args.devices, args.connections, args.broker, probe,
+                         args.payload == 'binary')
+    fleet.start()
+
+    # Make every device known, so controls can target any of them
+    for i in range(args.devices):
+        fleet.publish_status(i)
+    registered = wait_registered(get, args.devices)
+
+    failed_posts = []
+    def send_control(event: int) -> None:
+        body = CONTROL_TEMPLATE.format(
+            probe=event,
+            mrid=rng.choice(fleet.devices),
+            now=int(time.time()),
+            duration=args.control_duration,
+        ).encode()
+        probe.sent(event)
+        status, _ = post(NOTIFY_PATH, body)
+        if status != 200:
+            failed_posts.append(status)
+
+    # Streams of (send, events per second, events per burst)
+    streams = {
+        'status': (fleet.publish_status, args.status_rate * args.devices,
+                   args.devices),
+        'alarm': (fleet.publish_alarm, args.alarm_rate * args.devices,
+                  args.devices),
+        'control': (send_control, args.control_rate, 1),
+    }
+    seeds = {name: rng.random() for name in streams}
+    counts = {}
+
+    def stream(name, send, rate, burst):
+        counts[name] = run_stream(send, rate, args.distribution, burst=burst,
+                                  until=until, rng=random.Random(seeds[name]))
+
+    start = time.monotonic()
+    until = start + args.duration
+    threads = [
+        threading.Thread(target=stream, args=(name, *values))
+        for name, values in streams.items()
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    # Allow the last controls to be relayed
+    deadline = time.monotonic() + args.drain
+    while probe.outstanding() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    fleet.stop()
+
+    latencies = sorted(probe.latencies)
+    latency = {}
+    if latencies:
+        for point in (0.5, 0.9, 0.99):
+            latency[f"p{int(point * 100)}"] = percentile(latencies, point)
+        latency['max'] = latencies[-1]
+
+    return {
+        'config': {
+            key: value for key, value in vars(args).items()
+            if key not in ('output', 'url', 'broker')
+        },
+        'registered_s': registered,
+        'elapsed_s': elapsed,
+        'status_per_s': counts['status'] / elapsed,
+        'alarm_per_s': counts['alarm'] / elapsed,
+        'controls_sent': counts['control'],
+        'controls_failed': len(failed_posts),
+        'controls_relayed': len(latencies),
+        'controls_lost': probe.outstanding(),
+        'latency_ms': latency,
+    }
+
+
+def _address(value: str) -> tuple[str, int]:
+    host, _, port = value.rpartition(':')
+    return host or "localhost", int(port)
+
+
+def main():
+    """ Generate load against a running hub, or one run in-process, and
+        report the message rates and control latencies.
+    """
+    parser = argparse.ArgumentParser(description="SHEMS fleet load generator")
+    parser.add_argument("--devices", type=int, default=1000)
+    parser.add_argument("--connections", type=int, default=10,
+                        help="MQTT connections the devices are spread over.")
+    parser.add_argument("--duration", type=float, default=30,
+                        help="Seconds to generate load for.")
+    parser.add_argument("--status-rate", type=float, default=0.1,
+                        help="Status messages per device per second.")
+    parser.add_argument("--alarm-rate", type=float, default=0.01,
+                        help="Alarms per device per second.")
+    parser.add_argument("--control-rate", type=float, default=2,
+                        help="Controls POSTed to the hub per second.")
+    parser.add_argument("--control-duration", type=int, default=60,
+                        help="Seconds each control stays in effect.")
+    parser.add_argument("--distribution", choices=DISTRIBUTIONS,
+                        default='poisson')
+    parser.add_argument("--drain", type=float, default=5,
+                        help="Seconds to wait for outstanding controls.")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--payload", choices=('csv', 'binary'), default='csv',
+                        help="The telemetry payload layout devices send.")
+    parser.add_argument("--url", help="Base URL of a running hub. "
+                        "Runs a hub in-process if not given.")
+    parser.add_argument("--broker", type=_address, default=None,
+                        help="host:port of the hub's MQTT broker.")
+    parser.add_argument("-o", "--output", help="A file to write JSON to.")
+    args = parser.parse_args()
+
+    with contextlib.ExitStack() as stack:
+        if args.url:
+            args.broker = args.broker or ("localhost", 1883)
+            get, post = _remote_hub(args.url)
+        else:
+            broker = stack.enter_context(StandInBroker())
+            args.broker = broker.address
+            get, post = stack.enter_context(_local_hub(broker.address))
+
+        results = run_fleet(args, get, post)
+
+    report("devices registered in", results['registered_s'], "s")
+    report("status messages", results['status_per_s'], "msg/s")
+    report("alarms", results['alarm_per_s'], "msg/s")
+    report("controls sent", results['controls_sent'], "")
+    report("controls failed", results['controls_failed'], "")
+    report("controls relayed", results['controls_relayed'], "")
+    report("controls lost", results['controls_lost'], "")
+    for stat, value in results['latency_ms'].items():
+        report(f"control latency {stat}", value, "ms")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
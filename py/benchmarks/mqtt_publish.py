@@ -0,0 +1,67 @@
+"""
+File: benchmarks/mqtt_publish.py
+Email: e.roderick@uqconnect.edu.au
+Description: Compare relaying multi-code controls with a connection per
+    message (`paho.mqtt.publish.single`) against the persistent publisher.
+
+    Run from the `py` directory with
+    `python -m benchmarks.mqtt_publish [controls] [codes] [host:port]`.
+    Without an address, an in-process stand-in broker is used.
+"""
+
+import sys
+import time
+
+from paho.mqtt import publish
+
+from benchmarks.broker import StandInBroker
+from benchmarks.timing import rate, report
+from relay.remote import MqttPublisher, topic_from_control
+
+CONTROLS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+CODES = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+
+def _control_values(codes: int) -> list[tuple[str, str]]:
+    return [(topic_from_control(f"opModCode{i}"), str(i)) for i in range(codes)]
+
+
+def run(hostname: str, port: int) -> None:
+    """ Publish the same controls with a connection per value, then with the
+        shared publisher, and report both rates.
+    """
+    values = _control_values(CODES)
+
+    def single_per_value():
+        for topic, value in values:
+            publish.single(topic, value, qos=1, hostname=hostname, port=port,
+                           client_id="bench_single")
+
+    publisher = MqttPublisher("bench_publisher", hostname, port)
+    publisher.start()
+    while not publisher.is_connected():
+        time.sleep(0.01)
+    try:
+        single = rate(single_per_value, CONTROLS)
+        pooled = rate(lambda: publisher.publish_many(values, 5), CONTROLS)
+    finally:
+        publisher.stop()
+
+    report(f"publish.single x{CODES} codes", single, "controls/s")
+    report(f"MqttPublisher.publish_many x{CODES} codes", pooled, "controls/s")
+    report("speedup", pooled / single, "x")
+
+
+def main():
+    """ Run against the broker given on the command line, or a stand-in. """
+    if len(sys.argv) > 3:
+        hostname, port = sys.argv[3].split(':')
+        run(hostname, int(port))
+        return
+
+    with StandInBroker() as broker:
+        run(*broker.address)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+File: benchmarks/parse_control.py
+Email: e.roderick@uqconnect.edu.au
+Description: Compare parses/sec of DERControl and DefaultDERControl payloads
+    between the original XPath parser, which rebuilt the XML tree, and the
+    single-pass parser that keeps the received tree.
+
+    Run from the `py` directory with `python -m benchmarks.parse_control [n]`.
+"""
+
+import sys
+
+from lxml import etree as ET
+
+from benchmarks.timing import rate, report
+from shems.der_control import Control, ControlValue, CurveControlValue
+from shems.der_control import DefaultControl, EventStatus, Interval
+from shems.der_control import parse_control
+
+# The legacy parser is kept as it was, for comparison
+# pylint: disable=duplicate-code
+
+CONTROL = b"""<DERControl href="/derp/0/derc/1" replyTo="/rsp" responsesRequired="1">
+  <mRID>B5A0C0A1E2F34A5B8C7D6E5F4A3B2C1D</mRID>
+  <description>Evening export limit</description>
+  <creationTime>1700000000</creationTime>
+  <interval>
+    <duration>3600</duration>
+    <start>1700003600</start>
+  </interval>
+  <EventStatus>
+    <currentStatus>0</currentStatus>
+    <dateTime>1700000000</dateTime>
+    <potentiallySuperceded>false</potentiallySuperceded>
+  </EventStatus>
+  <DERControlBase>
+    <opModConnect>1</opModConnect>
+    <opModEnergize>1</opModEnergize>
+    <opModFixedW>5000</opModFixedW>
+    <opModMaxLimW>7000</opModMaxLimW>
+    <opModVoltVar href="/dc/1"/>
+  </DERControlBase>
+</DERControl>"""
+
+DEFAULT_CONTROL = b"""<DefaultDERControl href="/derp/0/dderc" replyTo="/rsp" responsesRequired="0">
+  <mRID>C6B1D1B2F3A45B6C9D8E7F6A5B4C3D2E</mRID>
+  <description>Site defaults</description>
+  <DERControlBase>
+    <opModConnect>1</opModConnect>
+    <opModFixedW>3000</opModFixedW>
+  </DERControlBase>
+</DefaultDERControl>"""
+
+
+# Functions
+def _legacy_parse_control(ctrl_root: ET.Element):
+    """ The original parser: a new XPath evaluation per value, and a new XML
+        tree built by the control's constructor.
+    """
+    attrs = ctrl_root.attrib
+    mrid = ctrl_root.xpath('mRID')[0].text
+    description = ctrl_root.xpath('description')[0].text
+
+    controls, curve_controls = [], []
+    for child in ctrl_root.xpath('DERControlBase')[0]:
+        if child.attrib:
+            curve_controls.append(
+                CurveControlValue(child.tag, child.attrib['href'])
+            )
+        else:
+            controls.append(ControlValue(child.tag, child.text))
+
+    if ctrl_root.tag == 'DefaultDERControl':
+        return DefaultControl(attrs['href'], attrs['replyTo'],
+                              attrs['responsesRequired'], mrid, description,
+                              (controls, curve_controls))
+
+    creation_time = ctrl_root.xpath('creationTime')[0].text
+    interval_root = ctrl_root.xpath('interval')[0]
+    interval = Interval(int(interval_root.xpath('duration')[0].text),
+                        int(interval_root.xpath('start')[0].text))
+    status_root = ctrl_root.xpath('EventStatus')[0]
+    status = EventStatus(
+        int(status_root.xpath('currentStatus')[0].text),
+        int(status_root.xpath('dateTime')[0].text),
+        status_root.xpath('potentiallySuperceded')[0].text == 'true'
+    )
+
+    return Control(attrs['href'], attrs['replyTo'], attrs['responsesRequired'],
+                   mrid, description, creation_time, interval, status,
+                   (controls, curve_controls))
+
+
+def main():
+    """ Time the xpath and single pass parsers on each control type, and
+        report the parses per second of both.
+    """
+    parses = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    for name, payload in (("DERControl", CONTROL),
+                          ("DefaultDERControl", DEFAULT_CONTROL)):
+        root = ET.fromstring(payload)
+        assert (_legacy_parse_control(root).get_values()
+                == parse_control(root).get_values())
+
+        legacy = rate(
+            lambda p=payload: _legacy_parse_control(ET.fromstring(p)), parses
+        )
+        single = rate(lambda p=payload: parse_control(ET.fromstring(p)),
+                      parses)
+
+        report(f"{name} (xpath, rebuilt tree)", legacy, "parses/s")
+        report(f"{name} (single pass)", single, "parses/s")
+        report("speedup", single / legacy, "x")
+
+
+if __name__ == "__main__":
+    main()
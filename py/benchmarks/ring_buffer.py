@@ -0,0 +1,104 @@
+"""
+File: benchmarks/ring_buffer.py
+Email: e.roderick@uqconnect.edu.au
+Description: Compare items/sec of the original queue.Queue based RingBuffer
+    with the single lock RingBuffer, for single threaded fill and drain, a
+    full overlapping buffer, and a producer thread feeding a consumer thread.
+
+    Run from the `py` directory with `python -m benchmarks.ring_buffer [n]`.
+"""
+
+import queue
+import sys
+import threading
+import time
+
+from benchmarks.timing import rate, report
+from common.ring_buffer import NotifyBufferFinish, RingBuffer
+
+# Constants
+CAPACITY = 50
+BATCH_SIZE = 50
+
+
+# Classes
+class LegacyRingBuffer(queue.Queue):
+    """ The original RingBuffer, which took the queue's mutex up to three
+        times to replace the oldest item of a full buffer.
+    """
+    def __init__(self, capacity: int = 10, overlap: bool = True) -> None:
+        super().__init__(maxsize=capacity)
+        self._overlap = overlap
+
+    def put(self, item, block=True, timeout=None):
+        if self._overlap and self.full():
+            self.get()
+        super().put(item, block, timeout)
+
+
+# Functions
+def _fill_and_drain(buffer) -> None:
+    for i in range(CAPACITY):
+        buffer.put(i)
+    for _ in range(CAPACITY):
+        buffer.get()
+
+
+def _transfer(buffer, count: int, bulk: bool) -> float:
+    """ Pass `count` items from a producer thread to this thread, returning
+        the items per second.
+    """
+    def produce():
+        for i in range(count):
+            buffer.put(i)
+        buffer.put(NotifyBufferFinish())
+
+    producer = threading.Thread(target=produce)
+    start = time.perf_counter()
+    producer.start()
+
+    received = 0
+    while True:
+        items = buffer.get_many(BATCH_SIZE) if bulk else [buffer.get()]
+        received += len(items)
+        if isinstance(items[-1], NotifyBufferFinish):
+            break
+    elapsed = time.perf_counter() - start
+    producer.join()
+
+    assert received == count + 1
+    return count / elapsed
+
+
+def main():
+    """ Compare the legacy and single lock buffers, filling, overwriting and
+        handing items between threads, and report the items moved per second.
+    """
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    cycles = max(1, count // CAPACITY)
+
+    for name, cls in (("legacy", LegacyRingBuffer), ("single lock", RingBuffer)):
+        report(f"put+get, no overlap ({name})",
+               rate(_fill_and_drain, cycles, cls(CAPACITY, overlap=False))
+               * CAPACITY, "items/s")
+
+    for name, cls in (("legacy", LegacyRingBuffer), ("single lock", RingBuffer)):
+        buffer = cls(CAPACITY, overlap=True)
+        for i in range(CAPACITY):
+            buffer.put(i)
+        report(f"put, overlap and full ({name})", rate(buffer.put, count, 0),
+               "items/s")
+
+    report("thread transfer get (legacy)",
+           _transfer(LegacyRingBuffer(CAPACITY, overlap=False), count, False),
+           "items/s")
+    report("thread transfer get (single lock)",
+           _transfer(RingBuffer(CAPACITY, overlap=False), count, False),
+           "items/s")
+    report(f"thread transfer get_many({BATCH_SIZE}) (single lock)",
+           _transfer(RingBuffer(CAPACITY, overlap=False), count, True),
+           "items/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,422 @@
+"""
+File: benchmarks/suite.py
+Email: e.roderick@uqconnect.edu.au
+Description: Offline benchmark suite for the parsing, rendering, dispatch and
+    database hot paths, run against synthetic data. Results are printed and
+    written as JSON, so that runs can be compared between commits.
+
+    Run from the `py` directory with
+    `python -m benchmarks.suite [-o results.json] [-c base.json] [--quick]`.
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# Point the database at a scratch file before any project module reads it
+_tmp = tempfile.mkdtemp(prefix="shems-bench-")
+os.environ['SHEMS_DB_PATH'] = os.path.join(_tmp, "suite.sqlite3")
+
+# pylint: disable=wrong-import-position
+# The device list benchmarks time the response internals behind the cache
+# pylint: disable=protected-access
+from lxml import etree as ET
+
+from benchmarks.parse_control import CONTROL, DEFAULT_CONTROL
+from benchmarks.timing import latency, rate, report
+from common.env_vars import DISPATCH_BATCH_SIZE
+from common.ring_buffer import RingBuffer
+from common.thread_control import ThreadCloser
+from database import _dev_access
+from database.alarms import alarm_summaries, recent_alarms, store_alarm
+from database.constants import Tables
+from database.readings import query_readings, store_readings
+from database.status import record_status, status_history
+from dispatch.actions import buffer_dispatch, DispatchAction
+from dispatch.dispatch import dispatcher_t
+from relay.payload import decode_device, decode_readings, encode_device
+from relay.payload import encode_readings
+from server import response
+from server.request import ListParams
+from shems.der_control import parse_control
+from shems.der_device import Device, DeviceList, stream_device_list
+import database.access as db
+
+# Constants
+LIST_SIZES = (10, 1000, 10000)
+SEEDED_DEVICES = 1000
+BUFFER_CAPACITY = 50
+DEVICE_HREF = "http://192.0.2.1/shem/dev/"
+
+
+# Classes
+class Results():
+    """ Collects benchmark results, printing each as it is recorded. """
+    def __init__(self) -> None:
+        self.values = {}
+
+    def record(self, name: str, value: float, unit: str) -> None:
+        """ Prints and stores a result under the given name. """
+        report(name, value, unit)
+        self.values[name] = {'value': value, 'unit': unit}
+
+    def record_latency(self, name: str, times: dict[str, float]) -> None:
+        """ Records the median and 95th percentile latencies, in microseconds.
+        """
+        for stat in ('p50', 'p95'):
+            self.record(f"{name} {stat}", times[stat] * 1000, "us")
+
+
+# Functions
+def _device_message(i: int) -> list[str]:
+    return [f"bench-dev-{i % SEEDED_DEVICES}", "192.168.0.2", "Bench device",
+            str(1700000000 + i), "0.5"]
+
+
+def _alarm_message(i: int) -> list[str]:
+    return [f"bench-dev-{i % SEEDED_DEVICES}", "opModFixedW",
+            str(1700000000 + i), "1", "0.5"]
+
+
+def bench_parse_control(results: Results, count: int) -> None:
+    """ Parse each control type from its received bytes. """
+    for name, payload in (("DERControl", CONTROL),
+                          ("DefaultDERControl", DEFAULT_CONTROL)):
+        results.record(
+            f"parse_control {name}",
+            rate(lambda p=payload: parse_control(ET.fromstring(p)), count),
+            "parses/s"
+        )
+
+
+def bench_payload(results: Results, count: int) -> None:
+    """ Decode a device announcement in the text and binary layouts. """
+    payloads = (
+        ("csv", b"bench-dev-1,192.168.0.2,Bench device,1700000000.5,0.5"),
+        ("binary", encode_device("bench-dev-1", "192.168.0.2", "Bench device",
+                                 1700000000.5, 0.5)),
+    )
+    for name, payload in payloads:
+        view = memoryview(payload)
+        results.record(
+            f"decode_device {name}",
+            rate(decode_device, count, view),
+            "msg/s"
+        )
+
+
+def bench_device_list(results: Results, scale: float) -> None:
+    """ Render device lists of each size, whole and streamed. """
+    for size in LIST_SIZES:
+        devices = [
+            Device(f"{DEVICE_HREF}id/dev-{i}/", f"Device {i}",
+                   1700000000 + i, 1, 0.5)
+            for i in range(size)
+        ]
+        repeat = max(3, int(20000 * scale) // size)
+
+        results.record(
+            f"DeviceList.to_bytes {size}",
+            rate(lambda d=devices: DeviceList(DEVICE_HREF, d).to_bytes(),
+                 repeat),
+            "lists/s"
+        )
+        results.record(
+            f"stream_device_list {size}",
+            rate(lambda d=devices, n=size: b''.join(
+                stream_device_list(DEVICE_HREF, n, n, iter(d))
+            ), repeat),
+            "lists/s"
+        )
+
+
+def bench_ring_buffer(results: Results, count: int) -> None:
+    """ Move items through a buffer one at a time and in bulk, then overwrite
+        the oldest items of a full overlapping buffer.
+    """
+    cycles = max(1, count // BUFFER_CAPACITY)
+
+    buffer = RingBuffer(BUFFER_CAPACITY, overlap=False)
+    def fill_and_drain():
+        for i in range(BUFFER_CAPACITY):
+            buffer.put(i)
+        for _ in range(BUFFER_CAPACITY):
+            buffer.get()
+
+    results.record(
+        "RingBuffer put+get (no overlap)",
+        rate(fill_and_drain, cycles) * BUFFER_CAPACITY,
+        "items/s"
+    )
+
+    def fill_and_drain_bulk():
+        buffer.put_many(range(BUFFER_CAPACITY))
+        buffer.get_many(BUFFER_CAPACITY)
+
+    results.record(
+        "RingBuffer put_many+get_many (no overlap)",
+        rate(fill_and_drain_bulk, cycles) * BUFFER_CAPACITY,
+        "items/s"
+    )
+
+    # A full overlapping buffer evicts its oldest item on every put
+    buffer = RingBuffer(BUFFER_CAPACITY, overlap=True)
+    for i in range(BUFFER_CAPACITY):
+        buffer.put(i)
+    results.record(
+        "RingBuffer put (overlap, full)",
+        rate(buffer.put, count, 0),
+        "items/s"
+    )
+
+
+def bench_dispatcher(results: Results, count: int) -> None:
+    """ Dispatch device announcements, then alarms, of the seeded devices. """
+    for action, message in ((DispatchAction.LISTEN_RECV_DEV, _device_message),
+                            (DispatchAction.LISTEN_RECV_ALARM, _alarm_message)):
+        buffer = RingBuffer(0, overlap=False)
+        closer = ThreadCloser()
+        closer.set_active()
+        thread = threading.Thread(target=dispatcher_t, args=(buffer, closer))
+
+        start = time.perf_counter()
+        thread.start()
+        for i in range(count):
+            buffer_dispatch(buffer, action, message(i))
+        buffer.notify_finish()
+        thread.join()
+        elapsed = time.perf_counter() - start
+
+        results.record(
+            f"dispatcher_t {action.name} (batch {DISPATCH_BATCH_SIZE})",
+            count / elapsed,
+            "msg/s"
+        )
+
+
+def bench_read_device(results: Results, count: int) -> None:
+    """ Time the device responses, and the device list with and without its
+        cache.
+    """
+    def read_list_uncached():
+        response._device_list_cache.clear()
+        params = ListParams()
+        return b''.join(response._stream_device_list(
+            params, db.table_version(Tables.DEVICES),
+            *response._read_device_page(params)
+        ))
+
+    indexes = iter(range(count))
+    results.record_latency(
+        f"handle_read_device index ({SEEDED_DEVICES} devices)",
+        latency(lambda: response.handle_read_device(
+            next(indexes) % SEEDED_DEVICES, {}
+        ), count)
+    )
+    results.record_latency(
+        f"handle_read_device_id ({SEEDED_DEVICES} devices)",
+        latency(lambda: response.handle_read_device_id("bench-dev-7", {}),
+                count)
+    )
+    results.record_latency(
+        f"device list uncached ({SEEDED_DEVICES} devices)",
+        latency(read_list_uncached, max(10, count // 20))
+    )
+    results.record_latency(
+        f"device list cached ({SEEDED_DEVICES} devices)",
+        latency(lambda: response.handle_read_device_list(ListParams(), {}),
+                count)
+    )
+
+
+def bench_readings(results: Results, count: int) -> None:
+    """ Store a day of 1 Hz samples for one device, in batches of a minute,
+        then time range queries over each tier.
+    """
+    start = 1700000000.0
+    batches = [
+        decode_readings(memoryview(encode_readings(
+            "bench-dev-1", "W", start + i * 60, 1.0,
+            [float(i * 60 + j) for j in range(60)]
+        )))
+        for i in range(min(1440, count))
+    ]
+
+    begin = time.perf_counter()
+    with db.transaction():
+        for batch in batches:
+            store_readings(*batch)
+    results.record(
+        "store_readings (60 samples)",
+        len(batches) / (time.perf_counter() - begin),
+        "batches/s"
+    )
+
+    end = start + len(batches) * 60
+    with db.get_reader() as con:
+        for name, tier, span in (("raw, 1 hour", 0, 3600),
+                                 ("1m, 1 day", 60, 86400),
+                                 ("15m, 1 day", 900, 86400)):
+            results.record_latency(
+                f"query_readings {name}",
+                latency(query_readings, max(10, count // 20), con,
+                        "bench-dev-1", "W", end - span, end, tier)
+            )
+
+
+def bench_alarms(results: Results, count: int) -> None:
+    """ Store alarms spread over the seeded devices, then time the recent
+        alarm and summary queries, of every device and of one.
+    """
+    start = 1800000000.0
+    begin = time.perf_counter()
+    with db.transaction():
+        for i in range(count):
+            store_alarm(f"bench-dev-{i % SEEDED_DEVICES}", "opModFixedW",
+                        start + i, 1.0)
+    results.record(
+        "store_alarm",
+        count / (time.perf_counter() - begin),
+        "alarms/s"
+    )
+
+    repeat = max(10, count // 20)
+    with db.get_reader() as con:
+        results.record_latency(
+            "recent_alarms (100, every device)",
+            latency(recent_alarms, repeat, con, start)
+        )
+        results.record_latency(
+            "recent_alarms (100, one device)",
+            latency(recent_alarms, repeat, con, start, "bench-dev-7")
+        )
+        results.record_latency(
+            f"alarm_summaries ({SEEDED_DEVICES} devices)",
+            latency(alarm_summaries, repeat, con)
+        )
+        results.record_latency(
+            "alarm_summaries (one device)",
+            latency(alarm_summaries, repeat, con, "bench-dev-7")
+        )
+
+
+def bench_status_history(results: Results, count: int) -> None:
+    """ Record a status a minute for one device, wrapping its history ring
+        if there are more than it holds, then time range queries over it.
+    """
+    start = 1800000000.0
+    begin = time.perf_counter()
+    with db.transaction():
+        for i in range(count):
+            record_status("bench-dev-1", start + i * 60, 1, 0.5)
+    results.record(
+        "record_status",
+        count / (time.perf_counter() - begin),
+        "statuses/s"
+    )
+
+    end = start + count * 60
+    with db.get_reader() as con:
+        for name, span in (("1 hour", 3600), ("1 day", 86400)):
+            results.record_latency(
+                f"status_history {name}",
+                latency(status_history, max(10, count // 20), con,
+                        "bench-dev-1", end - span, end)
+            )
+
+
+def _seed_database() -> None:
+    with contextlib.redirect_stdout(io.StringIO()):
+        _dev_access.create_database()
+
+    buffer = RingBuffer(0, overlap=False)
+    closer = ThreadCloser()
+    closer.set_active()
+    for i in range(SEEDED_DEVICES):
+        buffer_dispatch(buffer, DispatchAction.LISTEN_RECV_DEV,
+                        _device_message(i))
+    buffer.notify_finish()
+    dispatcher_t(buffer, closer)
+
+
+def _metadata() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'commit': commit,
+        'time': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'dispatch_batch_size': DISPATCH_BATCH_SIZE,
+    }
+
+
+def compare(values: dict, base_path: str) -> None:
+    """ Print the change in each result from a previous run's JSON file. """
+    with open(base_path, encoding="utf-8") as f:
+        base = json.load(f)
+
+    print(f"\nCompared with {base['meta'].get('commit')} ({base_path})")
+    for name, result in values.items():
+        if name not in base['results']:
+            continue
+
+        old = base['results'][name]['value']
+        change = (result['value'] - old) / old * 100 if old else 0.0
+        print(f"{name:<48} {change:>+8.1f}% ({result['unit']})")
+
+
+def main():
+    """ Run every benchmark, then write and optionally compare the results.
+    """
+    parser = argparse.ArgumentParser(description="SHEMS benchmark suite")
+    parser.add_argument("-o", "--output", default="benchmark-results.json",
+                        help="The file to write JSON results to.")
+    parser.add_argument("-c", "--compare",
+                        help="A previous results file to compare against.")
+    parser.add_argument("--quick", action="store_true",
+                        help="Run a tenth of the iterations.")
+    args = parser.parse_args()
+    scale = 0.1 if args.quick else 1.0
+
+    results = Results()
+    _seed_database()
+
+    bench_parse_control(results, int(20000 * scale))
+    bench_payload(results, int(200000 * scale))
+    bench_device_list(results, scale)
+    bench_ring_buffer(results, int(200000 * scale))
+    bench_dispatcher(results, int(5000 * scale))
+    bench_read_device(results, int(2000 * scale))
+    bench_readings(results, int(1440 * scale))
+    bench_alarms(results, int(5000 * scale))
+    bench_status_history(results, int(2000 * scale))
+    db.close_connections()
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump({'meta': _metadata(), 'results': results.values}, f,
+                  indent=2)
+    print(f"\nWrote {len(results.values)} results to {args.output}",
+          file=sys.stderr)
+
+    if args.compare:
+        compare(results.values, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+File: benchmarks/timing.py
+Email: e.roderick@uqconnect.edu.au
+Description: Shared timing helpers for the offline benchmarks.
+"""
+
+import statistics
+import time
+from typing import Callable
+
+
+def rate(func: Callable, count: int, *args) -> float:
+    """ Call `func(*args)` `count` times and return the calls per second. """
+    start = time.perf_counter()
+    for _ in range(count):
+        func(*args)
+    elapsed = time.perf_counter() - start
+
+    return count / elapsed if elapsed else float('inf')
+
+
+def latency(func: Callable, count: int, *args) -> dict[str, float]:
+    """ Call `func(*args)` `count` times and return the mean, median and 95th
+        percentile call time in milliseconds.
+    """
+    times = []
+    for _ in range(count):
+        start = time.perf_counter()
+        func(*args)
+        times.append((time.perf_counter() - start) * 1000)
+
+    times.sort()
+    return {
+        'mean': statistics.fmean(times),
+        'p50': percentile(times, 0.5),
+        'p95': percentile(times, 0.95),
+    }
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """ Get a percentile of sorted values, given as a fraction from 0 to 1. """
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def report(name: str, value: float, unit: str = "ops/s") -> None:
+    """ Print a single benchmark result line. """
+    print(f"{name:<48} {value:>14,.1f} {unit}")
@@ -13,10 +13,57 @@ SHEMS_DB_PATH= os.getenv('SHEMS_DB_PATH', 'shems.sqlite3')
 SHEMS_DATA_PATH = os.getenv('SHEMS_DATA_PATH', 'data')
 SHEMS_LOG_PATH = os.getenv('SHEMS_LOG_PATH', 'shems.log')
 
+SHEMS_HOST_REFRESH = float(os.getenv('SHEMS_HOST_REFRESH', '300'))
+SHEMS_MAX_BODY = int(os.getenv('SHEMS_MAX_BODY', '16384'))
+SHEMS_XSD_VALIDATE = os.getenv('SHEMS_XSD_VALIDATE', 'False') == 'True'
+SHEMS_PROFILE_TOKEN = os.getenv('SHEMS_PROFILE_TOKEN', '')
+SHEMS_PROFILE_MAX = float(os.getenv('SHEMS_PROFILE_MAX', '60'))
+SHEMS_HANDLER_RING = int(os.getenv('SHEMS_HANDLER_RING', '256'))
+SHEMS_READING_TIERS = os.getenv(
+    'SHEMS_READING_TIERS',
+    '60:604800,900:31536000'
+)
+SHEMS_READING_RAW_RETENTION = float(
+    os.getenv('SHEMS_READING_RAW_RETENTION', '86400')
+)
+SHEMS_READING_PRUNE = float(os.getenv('SHEMS_READING_PRUNE', '3600'))
+SHEMS_ALARM_RETENTION = float(os.getenv('SHEMS_ALARM_RETENTION', '7776000'))
+SHEMS_ALARM_PRUNE = float(os.getenv('SHEMS_ALARM_PRUNE', '3600'))
+SHEMS_ALARM_PRUNE_CHUNK = int(os.getenv('SHEMS_ALARM_PRUNE_CHUNK', '500'))
+SHEMS_STATUS_HISTORY = max(1, int(os.getenv('SHEMS_STATUS_HISTORY', '1440')))
+SHEMS_STATE_FLUSH = float(os.getenv('SHEMS_STATE_FLUSH', '60'))
+SHEMS_CONTROL_SWEEP = float(os.getenv('SHEMS_CONTROL_SWEEP', '60'))
+SHEMS_CONTROL_SWEEP_BATCH = int(os.getenv('SHEMS_CONTROL_SWEEP_BATCH', '100'))
+
+SHEMS_DB_READERS = int(os.getenv('SHEMS_DB_READERS', '2'))
+SHEMS_DB_MMAP_SIZE = int(os.getenv('SHEMS_DB_MMAP_SIZE', '33554432'))
+SHEMS_DB_CACHE_SIZE = int(os.getenv('SHEMS_DB_CACHE_SIZE', '-4096'))
+SHEMS_DB_BUSY_TIMEOUT = int(os.getenv('SHEMS_DB_BUSY_TIMEOUT', '5000'))
+SHEMS_DB_READER_TIMEOUT = float(os.getenv('SHEMS_DB_READER_TIMEOUT', '5'))
+
 MQTT_ADDR = os.getenv('MQTT_ADDR', 'localhost')
 MQTT_PORT = int(os.getenv('MQTT_PORT', '1883'))
+MQTT_PUBLISH_QOS = int(os.getenv('MQTT_PUBLISH_QOS', '1'))
+MQTT_PUBLISH_TIMEOUT = float(os.getenv('MQTT_PUBLISH_TIMEOUT', '5'))
+MQTT_MAX_INFLIGHT = int(os.getenv('MQTT_MAX_INFLIGHT', '20'))
+MQTT_MAX_QUEUED = int(os.getenv('MQTT_MAX_QUEUED', '1000'))
 
+DISPATCH_ASYNC = os.getenv('DISPATCH_ASYNC', 'False') == 'True'
 DISPATCH_CYCLE = os.getenv('DISPATCH_CYCLE', 'False') == 'True'
 DISPATCH_SIZE = int(os.getenv('DISPATCH_SIZE', '50'))
 DISPATCH_TIMEOUT = float(os.getenv('DISPATCH_TIMEOUT', '5'))
+DISPATCH_BATCH_SIZE = int(os.getenv('DISPATCH_BATCH_SIZE', '1'))
+DISPATCH_BATCH_WAIT = float(os.getenv('DISPATCH_BATCH_WAIT', '20'))
+DISPATCH_WORKERS = int(os.getenv('DISPATCH_WORKERS', '1'))
+DISPATCH_BARRIER_WARN = float(os.getenv('DISPATCH_BARRIER_WARN', '30'))
+DISPATCH_PRIORITY = os.getenv('DISPATCH_PRIORITY', 'strict')
+DISPATCH_LANE_WEIGHTS = os.getenv('DISPATCH_LANE_WEIGHTS', '8,1')
+DISPATCH_CONTROL_SIZE = int(os.getenv('DISPATCH_CONTROL_SIZE', '0'))
+DISPATCH_TELEMETRY_SIZE = int(
+    os.getenv('DISPATCH_TELEMETRY_SIZE', str(DISPATCH_SIZE))
+)
+DISPATCH_TELEMETRY_OVERFLOW = os.getenv(
+    'DISPATCH_TELEMETRY_OVERFLOW',
+    'drop_oldest'
+)
 
@@ -0,0 +1,247 @@
+"""
+File: common/metrics.py
+Email: e.roderick@uqconnect.edu.au
+Description: Lightweight process metrics, rendered in the Prometheus text
+    exposition format. Updating a metric is a dictionary update under a lock,
+    so metrics are cheap enough to keep on permanently.
+"""
+
+import bisect
+import threading
+from typing import Callable, Iterator
+
+# Constants
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Latency buckets in seconds, from sub-millisecond handlers to slow commits
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+    0.25, 0.5, 1.0, 2.5, 5.0,
+)
+
+
+# Functions
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(str(value))}"'
+             for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Classes
+class Metric():
+    """ A named metric, with a value per combination of label values. """
+    kind = 'untyped'
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: tuple[str, ...] = (),
+    ) -> None:
+        """ Construct a metric and register it with the shared registry.
+
+        Params:
+            name: The metric name, including the `shems_` prefix.
+            description: The help text for the metric.
+            labels: The names of the labels that values are recorded against.
+        """
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values = {}
+        self._function = None
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def set_function(self, function: Callable[[], float | dict]) -> None:
+        """ Read the metric's value from a function when collected, rather
+            than recording it. For a labelled metric, the function gives a
+            dictionary of values keyed by tuples of label values.
+        """
+        self._function = function
+
+    def _samples(self) -> Iterator[tuple[str, float]]:
+        if self._function is not None and not self.labels:
+            yield self.name, self._function()
+            return
+
+        if self._function is not None:
+            values = list(self._function().items())
+        else:
+            with self._lock:
+                values = list(self._values.items())
+        for label_values, value in values:
+            yield self.name + _labels(self.labels, label_values), value
+
+    def collect(self) -> Iterator[str]:
+        """ Yield the lines of this metric in the text exposition format. """
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for sample, value in self._samples():
+            yield f"{sample} {_number(value)}"
+
+
+class Counter(Metric):
+    """ A count that only increases. """
+    kind = 'counter'
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        """ Add to the count for the given label values. """
+        with self._lock:
+            self._values[label_values] = \
+                self._values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    """ A value that can go up and down. """
+    kind = 'gauge'
+
+    def set(self, value: float, *label_values) -> None:
+        """ Set the value for the given label values. """
+        with self._lock:
+            self._values[label_values] = value
+
+
+class Histogram(Metric):
+    """ Counts of observed values, in cumulative buckets. """
+    kind = 'histogram'
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> None:
+        """ Construct a histogram. See `Metric` for the other parameters.
+
+        Params:
+            buckets: The ascending upper bounds of the buckets.
+        """
+        self.buckets = tuple(buckets) + (float('inf'),)
+        super().__init__(name, description, labels)
+
+    def observe(self, value: float, *label_values) -> None:
+        """ Count a value in its bucket for the given label values. """
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(label_values)
+            if counts is None:
+                # Bucket counts (not yet cumulative), then the sum
+                counts = self._values[label_values] = \
+                    [0] * len(self.buckets) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def collect(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.description}"
+        yield f"# TYPE {self.name} {self.kind}"
+        with self._lock:
+            values = [(k, list(v)) for k, v in self._values.items()]
+
+        for label_values, counts in values:
+            total = 0
+            for bound, count in zip(self.buckets, counts):
+                total += count
+                labels = _labels(self.labels, label_values,
+                                 f'le="{_number(bound)}"')
+                yield f"{self.name}_bucket{labels} {total}"
+
+            labels = _labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {_number(counts[-1])}"
+            yield f"{self.name}_count{labels} {total}"
+
+
+class Registry():
+    """ The set of metrics to render. """
+    def __init__(self) -> None:
+        self._metrics = []
+
+    def register(self, metric: Metric) -> None:
+        """ Add a metric to those rendered. """
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        """ Render every registered metric in the text exposition format. """
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+# Shared registry
+REGISTRY = Registry()
+
+# Metrics
+DISPATCH_QUEUE_DEPTH = Gauge(
+    "shems_dispatch_queue_depth",
+    "Items waiting in the dispatch buffer."
+)
+DISPATCH_QUEUE_HIGH_WATER = Gauge(
+    "shems_dispatch_queue_high_water",
+    "The most items held by the dispatch buffer since startup."
+)
+DISPATCH_OVERWRITTEN = Counter(
+    "shems_dispatch_overwritten_total",
+    "Items discarded from a full overlapping dispatch buffer."
+)
+DISPATCH_ENQUEUED = Counter(
+    "shems_dispatch_enqueued_total",
+    "Actions placed on the dispatch buffer.",
+    ("action",)
+)
+DISPATCH_DROPPED = Counter(
+    "shems_dispatch_dropped_total",
+    "Actions that could not be placed on the dispatch buffer.",
+    ("action", "reason")
+)
+DISPATCH_DEQUEUED = Counter(
+    "shems_dispatch_dequeued_total",
+    "Actions taken from the dispatch buffer and handled.",
+    ("action",)
+)
+DISPATCH_ERRORS = Counter(
+    "shems_dispatch_errors_total",
+    "Action handlers that raised an error.",
+    ("action",)
+)
+DISPATCH_HANDLER_SECONDS = Histogram(
+    "shems_dispatch_handler_seconds",
+    "Time taken by action handlers.",
+    ("action",)
+)
+DISPATCH_LANE_DEPTH = Gauge(
+    "shems_dispatch_lane_depth",
+    "Items waiting in each lane of the dispatch buffer.",
+    ("lane",)
+)
+SCHEDULER_PENDING = Gauge(
+    "shems_scheduler_pending",
+    "Actions waiting in the scheduler until they are due."
+)
+LISTENER_MESSAGES = Counter(
+    "shems_listener_messages_total",
+    "MQTT messages received by the listener.",
+    ("topic",)
+)
+LISTENER_INVALID = Counter(
+    "shems_listener_invalid_total",
+    "MQTT messages dropped by the listener as malformed.",
+    ("topic",)
+)
+DB_COMMIT_SECONDS = Histogram(
+    "shems_db_commit_seconds",
+    "Time taken to commit writer transactions."
+)
@@ -0,0 +1,153 @@
+"""
+File: common/profiler.py
+Email: e.roderick@uqconnect.edu.au
+Description: Opt-in profiling helpers. A statistical sampler periodically
+    records the stack of each selected thread, producing collapsed stacks for
+    flame graph tools, and a timing ring keeps the recent wall and CPU times
+    of named operations.
+"""
+
+import collections
+import os
+import sys
+import threading
+import time
+from typing import Collection, Optional
+
+# Constants
+SAMPLE_INTERVAL = 0.005 # Seconds between stack samples
+SLOWEST_KEPT = 5 # Slowest entries to report per operation
+
+
+# Classes
+class StackSampler():
+    """ Samples the stacks of running threads. Only one sampling run can be
+        made at a time.
+    """
+    def __init__(self, interval: float = SAMPLE_INTERVAL) -> None:
+        """ Construct a stack sampler.
+
+        Params:
+            interval: The seconds to wait between samples.
+        """
+        self._interval = interval
+        self._running = threading.Lock()
+
+    def sample(
+        self,
+        duration: float,
+        thread_ids: Optional[Collection[int]] = None,
+    ) -> Optional[collections.Counter]:
+        """ Sample thread stacks for a duration, blocking until done.
+
+        Params:
+            duration: The seconds to sample for.
+            thread_ids: The threads to sample. All threads other than the
+                sampling thread if None.
+
+        Returns:
+            The number of times each collapsed stack was seen, or None if
+            another sampling run is in progress.
+        """
+        # Released below, a with block cannot give up when the lock is held
+        # pylint: disable-next=consider-using-with
+        if not self._running.acquire(blocking=False):
+            return None
+
+        try:
+            counts = collections.Counter()
+            own = threading.get_ident()
+            names = {}
+            end = time.monotonic() + duration
+            while time.monotonic() < end:
+                # The only way to read another thread's stack
+                # pylint: disable-next=protected-access
+                for ident, frame in sys._current_frames().items():
+                    if ident == own:
+                        continue
+                    if thread_ids is not None and ident not in thread_ids:
+                        continue
+
+                    if ident not in names:
+                        names = {t.ident: t.name for t in threading.enumerate()}
+                    counts[_collapse(names.get(ident, str(ident)), frame)] += 1
+                time.sleep(self._interval)
+
+            return counts
+        finally:
+            self._running.release()
+
+
+class TimingRing():
+    """ The most recent wall and CPU times of a set of named operations. Each
+        operation keeps a fixed number of entries, discarding the oldest.
+    """
+    def __init__(self, size: int = 256) -> None:
+        """ Construct a timing ring.
+
+        Params:
+            size: The number of entries to keep per operation.
+        """
+        self._size = size
+        self._rings = {}
+
+    def record(self, name: str, wall: float, cpu: float) -> None:
+        """ Record the wall and CPU seconds taken by an operation. """
+        ring = self._rings.get(name)
+        if ring is None:
+            ring = self._rings.setdefault(
+                name,
+                collections.deque(maxlen=self._size)
+            )
+        ring.append((time.time(), wall, cpu))
+
+    def summary(self) -> dict[str, dict]:
+        """ Summarise the recorded entries of each operation.
+
+        Returns:
+            Per operation, the number of entries kept, the mean and max wall
+            and CPU seconds, and the slowest entries as (timestamp, wall, cpu).
+        """
+        result = {}
+        for name, ring in list(self._rings.items()):
+            entries = list(ring)
+            if not entries:
+                continue
+
+            walls = [wall for _, wall, _ in entries]
+            cpus = [cpu for _, _, cpu in entries]
+            result[name] = {
+                'entries': len(entries),
+                'wall_mean': sum(walls) / len(walls),
+                'wall_max': max(walls),
+                'cpu_mean': sum(cpus) / len(cpus),
+                'cpu_max': max(cpus),
+                'slowest': sorted(entries, key=lambda e: e[1],
+                                  reverse=True)[:SLOWEST_KEPT],
+            }
+
+        return result
+
+
+# Functions
+def _collapse(thread_name: str, frame) -> str:
+    """ Format a stack as `thread;outer (file);...;inner (file)`. """
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(
+            f"{code.co_name} ({os.path.basename(code.co_filename)})"
+        )
+        frame = frame.f_back
+
+    stack.append(thread_name)
+    return ';'.join(reversed(stack))
+
+
+def render_collapsed(counts: collections.Counter) -> str:
+    """ Render stack counts in the collapsed format read by flamegraph.pl and
+        speedscope, with the most common stacks first.
+    """
+    return ''.join(
+        f"{stack} {count}\n" for stack, count in counts.most_common()
+    )
@@ -4,7 +4,13 @@ Source: DECO3801 Coursework
         github.com/tj-heat/signed-explorations/blob/main/src/util/ring_buffer.py
 """
 
+import asyncio
+import collections
 import queue
+import threading
+import time
+from enum import Enum
+from typing import Any, Callable, NamedTuple
 
 class Closed(Exception):
     """ Exception raised by RingBuffer.put/get when RingBuffer closed. """
@@ -15,8 +21,10 @@ class NotifyBufferFinish():
     operations.
     """
 
-class RingBuffer(queue.Queue):
+class RingBuffer(): # pylint: disable=too-many-instance-attributes
     """ A FIFO Queue implementation that allows for cyclic value replacement.
+    All operations take a single lock once, so replacing the oldest value in
+    a full buffer is atomic with placing the new one.
     """
     def __init__(self, capacity: int = 10, overlap: bool = True) -> None:
         """ Construct a RingBuffer instance.
@@ -28,14 +36,53 @@ class RingBuffer(queue.Queue):
                 acts as a FIFO Queue. When true, acts as a ring buffer. Defaults
                 to True.
         """
-        super().__init__(maxsize=capacity)
+        self.maxsize = capacity
         self._overlap = overlap
         self._closed = False
+        self._items = collections.deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self.high_water = 0 # The most items held at once
+        self.overwritten = 0 # The number of items replaced due to overlap
 
     def _close(self):
         """ Close the buffer so no more values can be placed/removed. """
         self._closed = True
 
+    def _is_full(self) -> bool:
+        # Must be called with the lock held
+        return 0 < self.maxsize <= len(self._items)
+
+    def _wait(self, condition, ready, block, timeout, error) -> None:
+        """ Wait on a condition, with the lock held, until ready() is true.
+        Raises error if not ready in time, or the buffer closes while waiting.
+        """
+        if not block:
+            raise error
+        if timeout is not None and timeout < 0:
+            raise ValueError("'timeout' must be a non-negative number")
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not ready():
+            if self._closed:
+                raise Closed("The RingBuffer is closed")
+            if deadline is None:
+                condition.wait()
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise error
+            condition.wait(remaining)
+
+    def _append(self, item) -> None:
+        # Must be called with the lock held, once there is a free slot
+        if self._overlap and self._is_full():
+            self._items.popleft()
+            self.overwritten += 1
+        self._items.append(item)
+        self.high_water = max(self.high_water, len(self._items))
+
     def put(self, item, block=True, timeout=None):
         """ Put an item onto the ring buffer.
 
@@ -53,13 +100,38 @@ class RingBuffer(queue.Queue):
         is immediately available, else raise the Full exception ('timeout'
         is ignored in that case).
         """
-        if self._closed:
-            raise Closed("The RingBuffer is closed. Cannot Put item")
+        with self._lock:
+            if self._closed:
+                raise Closed("The RingBuffer is closed. Cannot Put item")
+            if not self._overlap and self._is_full():
+                self._wait(self._not_full, lambda: not self._is_full(), block,
+                           timeout, queue.Full)
+
+            self._append(item)
+            self._not_empty.notify()
 
-        if self._overlap and self.full():
-            self.get()
+    def put_many(self, items, block=True, timeout=None):
+        """ Put several items onto the ring buffer in order, taking the lock
+        once while there is room for them.
+
+        Follows the same semantics as `put` for each item. If a free slot is
+        not available in time, raises the Full exception, leaving the items
+        before it on the buffer. 'timeout' bounds the whole call.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            if self._closed:
+                raise Closed("The RingBuffer is closed. Cannot Put item")
 
-        super().put(item, block, timeout)
+            for item in items:
+                if not self._overlap and self._is_full():
+                    self._not_empty.notify_all()
+                    remaining = (None if deadline is None
+                                 else max(0, deadline - time.monotonic()))
+                    self._wait(self._not_full, lambda: not self._is_full(),
+                               block, remaining, queue.Full)
+                self._append(item)
+            self._not_empty.notify_all()
 
     def get(self, block=True, timeout=None):
         """ Remove and return an item from the queue.
@@ -74,11 +146,59 @@ class RingBuffer(queue.Queue):
         available, else raise the Empty exception ('timeout' is ignored
         in that case).
         """
-        if self._closed:
-            raise Closed("The RingBuffer is closed. Cannot Put item")
-        return super().get(block, timeout)
+        with self._lock:
+            if self._closed:
+                raise Closed("The RingBuffer is closed. Cannot Get item")
+            if not self._items:
+                self._wait(self._not_empty, lambda: self._items, block,
+                           timeout, queue.Empty)
+
+            item = self._items.popleft()
+            self._not_full.notify()
+            return item
+
+    def get_many(self, max_items: int, block=True, timeout=None) -> list:
+        """ Remove and return up to 'max_items' items from the queue, taking
+        the lock once.
+
+        Waits for at least one item with the same semantics as `get`, then
+        returns the items immediately available. A NotifyBufferFinish sentinel
+        is always the last item returned, so that consumers can acknowledge it
+        before anything placed after it.
+        """
+        with self._lock:
+            if self._closed:
+                raise Closed("The RingBuffer is closed. Cannot Get item")
+            if not self._items:
+                self._wait(self._not_empty, lambda: self._items, block,
+                           timeout, queue.Empty)
+
+            items = []
+            while self._items and len(items) < max_items:
+                item = self._items.popleft()
+                items.append(item)
+                if isinstance(item, NotifyBufferFinish):
+                    break
+            self._not_full.notify(len(items))
+            return items
+
+    def qsize(self) -> int:
+        """ (int) The number of items held. """
+        with self._lock:
+            return len(self._items)
+
+    def empty(self) -> bool:
+        """ (bool) True if no items are held. """
+        with self._lock:
+            return not self._items
+
+    def full(self) -> bool:
+        """ (bool) True if no more items can be placed without overwriting. """
+        with self._lock:
+            return self._is_full()
 
     def capacity(self):
+        """ (int) The most items held at once, or 0 for no limit. """
         return self.maxsize
 
     def notify_finish(self):
@@ -87,6 +207,406 @@ class RingBuffer(queue.Queue):
         """
         self.put(NotifyBufferFinish())
 
+    def confirm_sentinel(self, sentinel: NotifyBufferFinish) -> None:
+        """ Used to acknowledge that a sentinel has been received. Will
+        propagate the sentinel to other consumers, unless the buffer is empty.
+        If the buffer is empty, the buffer will be closed, waking any consumers
+        or producers still waiting on it.
+        """
+        with self._lock:
+            if self._items:
+                self._append(sentinel)
+                self._not_empty.notify()
+                return
+
+            self._close()
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+
+
+class Overflow(Enum):
+    """ What a LaneBuffer lane does with a new item when it is full. """
+    BLOCK = "block" # Wait for a free slot, as a FIFO Queue
+    DROP_OLDEST = "drop_oldest" # Replace the oldest item, as a ring buffer
+    DROP_NEWEST = "drop_newest" # Refuse the new item with the Full exception
+
+
+class Lane(NamedTuple):
+    """ The configuration of a single LaneBuffer lane. """
+    capacity: int # The most items the lane holds. <= 0 means infinite.
+    overflow: Overflow = Overflow.BLOCK
+    weight: int = 1 # Items taken per turn when lanes are weighted
+
+
+class LaneBuffer(): # pylint: disable=too-many-instance-attributes
+    """ A set of prioritised FIFO lanes behind a single lock, presenting the
+    same interface as RingBuffer. Each item is placed on the lane chosen for
+    it, and consumers take from the lanes in priority order, so a burst on a
+    low priority lane cannot delay or displace items on a higher one.
+
+    Lanes are either strict, where an item is only taken from a lane when
+    every higher priority lane is empty, or weighted, where each lane with
+    items is given up to its weight of items in turn, highest priority first.
+    """
+    def __init__(
+        self,
+        lanes: list[Lane],
+        lane_of: Callable[[Any], int],
+        weighted: bool = False,
+    ) -> None:
+        """ Construct a LaneBuffer instance.
+
+        Params:
+            lanes: The lanes, in priority order from highest to lowest.
+            lane_of: Gives the index of the lane for an item.
+            weighted: Share consumption between lanes by weight, rather than
+                strictly by priority.
+        """
+        self._lanes = lanes
+        self._lane_of = lane_of
+        self._weighted = weighted
+        self._closed = False
+        self._finishing = None # A NotifyBufferFinish to give once drained
+        self._items = [collections.deque() for _ in lanes]
+        self._credits = [lane.weight for lane in lanes]
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = [threading.Condition(self._lock) for _ in lanes]
+        self.high_water = 0 # The most items held at once
+        self.overwritten = 0 # The number of items replaced due to overflow
+
+    def _close(self):
+        """ Close the buffer so no more values can be placed/removed. """
+        self._closed = True
+
+    def _size(self) -> int:
+        # Must be called with the lock held
+        return sum(len(items) for items in self._items)
+
+    def _lane_full(self, index: int) -> bool:
+        # Must be called with the lock held
+        return 0 < self._lanes[index].capacity <= len(self._items[index])
+
+    def _put(self, item, block, deadline) -> None:
+        """ Place an item on its lane, with the lock held. """
+        index = self._lane_of(item)
+        lane, items = self._lanes[index], self._items[index]
+
+        if self._lane_full(index):
+            if lane.overflow is Overflow.DROP_OLDEST:
+                items.popleft()
+                self.overwritten += 1
+            elif lane.overflow is Overflow.DROP_NEWEST or not block:
+                raise queue.Full
+            else:
+                self._wait_for_slot(index, deadline)
+
+        items.append(item)
+        self.high_water = max(self.high_water, self._size())
+
+    def _wait_for_slot(self, index: int, deadline) -> None:
+        while self._lane_full(index):
+            if self._closed:
+                raise Closed("The LaneBuffer is closed. Cannot Put item")
+            if deadline is None:
+                self._not_full[index].wait()
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise queue.Full
+            self._not_full[index].wait(remaining)
+
+    def _wait_for_item(self, block, timeout) -> None:
+        if not block:
+            raise queue.Empty
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self._finishing and not any(self._items):
+            if self._closed:
+                raise Closed("The LaneBuffer is closed. Cannot Get item")
+            if deadline is None:
+                self._not_empty.wait()
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise queue.Empty
+            self._not_empty.wait(remaining)
+
+    def _select(self) -> int:
+        """ The index of the lane to take the next item from, with the lock
+        held and at least one lane holding items.
+        """
+        for _ in range(2):
+            for index, items in enumerate(self._items):
+                if not items:
+                    continue
+                if not self._weighted:
+                    return index
+                if self._credits[index] > 0:
+                    self._credits[index] -= 1
+                    return index
+
+            # Every lane with items has had its turn, so start a new round
+            self._credits = [lane.weight for lane in self._lanes]
+
+        raise RuntimeError("No lane holds an item")
+
+    def _take(self):
+        """ Remove the next item by priority, with the lock held. Gives the
+        finish sentinel once every lane is empty.
+        """
+        if not any(self._items):
+            sentinel, self._finishing = self._finishing, None
+            return sentinel
+
+        index = self._select()
+        self._not_full[index].notify()
+        return self._items[index].popleft()
+
+    def put(self, item, block=True, timeout=None):
+        """ Put an item onto its lane, following the lane's overflow policy
+        when it is full. Otherwise the same semantics as RingBuffer.put.
+        """
+        with self._lock:
+            if self._closed:
+                raise Closed("The LaneBuffer is closed. Cannot Put item")
+            deadline = None if timeout is None else time.monotonic() + timeout
+            self._put(item, block, deadline)
+            self._not_empty.notify()
+
+    def put_many(self, items, block=True, timeout=None):
+        """ Put several items onto their lanes in order, with the same
+        semantics as RingBuffer.put_many.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            if self._closed:
+                raise Closed("The LaneBuffer is closed. Cannot Put item")
+            try:
+                for item in items:
+                    self._put(item, block, deadline)
+            finally:
+                self._not_empty.notify_all()
+
+    def get(self, block=True, timeout=None):
+        """ Remove and return the next item by priority, with the same
+        semantics as RingBuffer.get.
+        """
+        with self._lock:
+            if self._closed:
+                raise Closed("The LaneBuffer is closed. Cannot Get item")
+            if not any(self._items) and not self._finishing:
+                self._wait_for_item(block, timeout)
+            return self._take()
+
+    def get_many(self, max_items: int, block=True, timeout=None) -> list:
+        """ Remove and return up to 'max_items' items by priority, with the
+        same semantics as RingBuffer.get_many.
+        """
+        with self._lock:
+            if self._closed:
+                raise Closed("The LaneBuffer is closed. Cannot Get item")
+            if not any(self._items) and not self._finishing:
+                self._wait_for_item(block, timeout)
+
+            items = []
+            while len(items) < max_items:
+                item = self._take()
+                if item is None:
+                    break
+                items.append(item)
+                if isinstance(item, NotifyBufferFinish):
+                    break
+            return items
+
+    def qsize(self) -> int:
+        """ (int) The number of items held by every lane. """
+        with self._lock:
+            return self._size()
+
+    def lane_sizes(self) -> list[int]:
+        """ (list[int]) The number of items held by each lane. """
+        with self._lock:
+            return [len(items) for items in self._items]
+
+    def empty(self) -> bool:
+        """ (bool) True if every lane is empty. """
+        with self._lock:
+            return not any(self._items)
+
+    def full(self) -> bool:
+        """ (bool) True if every lane is full. """
+        with self._lock:
+            return all(self._lane_full(i) for i in range(len(self._lanes)))
+
+    def capacity(self):
+        """ (int) The most items held by every lane at once, or 0 if any lane
+            is unbounded.
+        """
+        capacities = [lane.capacity for lane in self._lanes]
+        return 0 if min(capacities) <= 0 else sum(capacities)
+
+    def notify_finish(self):
+        """ Begin the process of notifying all consumers that the buffer should
+        close. Consumers are given the sentinel once every lane is empty.
+        """
+        with self._lock:
+            if self._closed:
+                raise Closed("The LaneBuffer is closed. Cannot Put item")
+            self._finishing = NotifyBufferFinish()
+            self._not_empty.notify()
+
+    def confirm_sentinel(self, sentinel: NotifyBufferFinish) -> None:
+        """ Used to acknowledge that a sentinel has been received. Will
+        propagate the sentinel to other consumers, unless the buffer is empty.
+        If the buffer is empty, the buffer will be closed, waking any consumers
+        or producers still waiting on it.
+        """
+        with self._lock:
+            if any(self._items):
+                self._finishing = sentinel
+                self._not_empty.notify()
+                return
+
+            self._close()
+            self._not_empty.notify_all()
+            for condition in self._not_full:
+                condition.notify_all()
+
+
+class AsyncRingBuffer():
+    """ An asyncio.Queue based equivalent of RingBuffer, for consumers running
+    on an event loop. Items can be placed from the event loop with `aput`, or
+    from any other thread with `put`.
+    """
+    def __init__(self, capacity: int = 10, overlap: bool = True) -> None:
+        """ Construct an AsyncRingBuffer instance. Must be constructed within
+        the event loop that will consume from it.
+
+        Params:
+            capacity (int): The maximum number of items the buffer can hold.
+                capacity <= 0 means infinite.
+            overlap (bool): Whether the buffer placement can wrap. When false,
+                acts as a FIFO Queue. When true, acts as a ring buffer. Defaults
+                to True.
+        """
+        self._queue = asyncio.Queue(maxsize=capacity)
+        self._loop = asyncio.get_running_loop()
+        self._overlap = overlap
+        self._closed = False
+        self.high_water = 0 # The most items held at once
+        self.overwritten = 0 # The number of items replaced due to overlap
+
+    def _close(self):
+        """ Close the buffer so no more values can be placed/removed. """
+        self._closed = True
+
+    def _on_loop(self) -> bool:
+        """ (bool) True if called from the buffer's event loop thread. """
+        try:
+            return asyncio.get_running_loop() is self._loop
+        except RuntimeError:
+            return False
+
+    def put_nowait(self, item):
+        """ Put an item onto the buffer without blocking. Must be called from
+        the buffer's event loop.
+
+        If the buffer allows overlap and is full, the oldest value in the buffer
+        will be replaced. Otherwise raises the Full exception if the buffer is
+        full, or the Closed exception if the buffer is closed.
+        """
+        if self._closed:
+            raise Closed("The RingBuffer is closed. Cannot Put item")
+
+        if self._overlap and self._queue.full():
+            self._queue.get_nowait()
+            self.overwritten += 1
+
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull as e:
+            raise queue.Full from e
+        self._track_high_water()
+
+    def _track_high_water(self):
+        self.high_water = max(self.high_water, self._queue.qsize())
+
+    async def aput(self, item, timeout=None):
+        """ Put an item onto the buffer, waiting at most 'timeout' seconds for
+        a free slot (indefinitely if None) before raising the Full exception.
+        Must be awaited on the buffer's event loop.
+        """
+        if self._closed:
+            raise Closed("The RingBuffer is closed. Cannot Put item")
+
+        if self._overlap:
+            self.put_nowait(item)
+            return
+
+        try:
+            await asyncio.wait_for(self._queue.put(item), timeout)
+        except asyncio.TimeoutError as e:
+            raise queue.Full from e
+        self._track_high_water()
+
+    def put(self, item, block=True, timeout=None):
+        """ Put an item onto the buffer from any thread, with the same
+        semantics as RingBuffer.put.
+
+        Called from the buffer's event loop, this never blocks, as blocking
+        would stall the consumer. Use `aput` to wait for a free slot instead.
+        """
+        if self._closed:
+            raise Closed("The RingBuffer is closed. Cannot Put item")
+
+        if self._on_loop():
+            self.put_nowait(item)
+            return
+
+        put = self.aput(item, timeout) if block else self._put_nowait_async(item)
+        asyncio.run_coroutine_threadsafe(put, self._loop).result()
+
+    async def _put_nowait_async(self, item):
+        self.put_nowait(item)
+
+    async def get(self, timeout=None):
+        """ Remove and return an item from the buffer, waiting at most
+        'timeout' seconds (indefinitely if None) before raising the Empty
+        exception.
+
+        If the buffer is closed, raises Closed exception.
+        """
+        if self._closed:
+            raise Closed("The RingBuffer is closed. Cannot Get item")
+
+        try:
+            return await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError as e:
+            raise queue.Empty from e
+
+    def empty(self) -> bool:
+        """ (bool) True if no items are held. """
+        return self._queue.empty()
+
+    def full(self) -> bool:
+        """ (bool) True if no more items can be placed. """
+        return self._queue.full()
+
+    def qsize(self) -> int:
+        """ (int) The number of items held. """
+        return self._queue.qsize()
+
+    def capacity(self):
+        """ (int) The most items held at once, or 0 for no limit. """
+        return self._queue.maxsize
+
+    async def notify_finish(self):
+        """ Begin the process of notifying all consumers that the buffer should
+        close.
+        """
+        await self.aput(NotifyBufferFinish())
+
     def confirm_sentinel(self, sentinel: NotifyBufferFinish) -> None:
         """ Used to acknowledge that a sentinel has been received. Will
         propagate the sentinel to other consumers, unless the buffer is empty.
@@ -95,5 +615,4 @@ class RingBuffer(queue.Queue):
         if self.empty():
             self._close()
         else:
-            self.put(sentinel)
-
+            self.put_nowait(sentinel)
@@ -95,7 +95,8 @@ class ThreadController():
 
     def join(self) -> None:
         """ Join on the controller's thread """
-        if self.closer.is_active():
+        # Killing clears the active flag, so check the thread itself
+        if self.t.is_alive():
             self.t.join()
 
     def finish(self) -> None:
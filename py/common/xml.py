@@ -40,6 +40,29 @@ def create_subelement(
     return element
 
 
+def create_parser(schema: ET.XMLSchema = None) -> ET.XMLParser:
+    """ Construct an lxml parser that is safe to use on untrusted input. DTDs
+        are not loaded, entities are not resolved, nothing is fetched from the
+        network, and libxml2's default size limits are kept.
+
+    Params:
+        schema (lxml.etree.XMLSchema): An optional schema that parsed documents
+            must be valid against.
+
+    Returns:
+        (lxml.etree.XMLParser)
+    """
+    return ET.XMLParser(
+        schema=schema,
+        resolve_entities=False,
+        load_dtd=False,
+        no_network=True,
+        huge_tree=False,
+        remove_comments=True,
+        remove_pis=True,
+    )
+
+
 # Classes
 class ContainsXml:
     """ A class to represent information that has an XML representation. """
@@ -54,8 +77,13 @@ class ContainsXml:
         return self._xml
 
 
+    def to_bytes(self) -> bytes:
+        """ Get the serialised, UTF-8 encoded XML representation. """
+        return ET.tostring(self._xml, pretty_print=self._pp)
+
+
     def __repr__(self) -> str:
-        return ET.tostring(self._xml, pretty_print=self._pp).decode()
+        return self.to_bytes().decode()
 
 
     def __str__(self) -> str:
@@ -16,4 +16,10 @@ export MQTT_PORT=1883
 export DISPATCH_SIZE=10
 export DISPATCH_TIMEOUT=10
 export DISPATCH_CYCLE=False
+# Telemetry held once its lane is full: drop_oldest sheds the oldest
+# telemetry so controls never wait behind it, drop_newest refuses new
+# telemetry, and block makes the listener wait for room instead
+export DISPATCH_TELEMETRY_OVERFLOW=drop_oldest
+export DISPATCH_BATCH_SIZE=20   # Items committed per transaction
+export DISPATCH_BATCH_WAIT=50   # Max milliseconds to wait to fill a batch
 
@@ -5,6 +5,7 @@ Description: Developer access to the sqlite database object. Should only be used
     in state/end-of-lifetime events.
 """
 
+import logging
 import sqlite3 as sql
 
 from common.env_vars import SHEMS_DB_PATH
@@ -26,15 +27,30 @@ TABLE_ALARMS = """alarms(
     FOREIGN KEY(dev_id) REFERENCES devices(dev_id)
 )"""
 
-TABLE_READINGS = """reading(
-    reading_id PRIMARY KEY,
+# Totals of every alarm received, per device and code. See database/alarms.py
+TABLE_ALARM_SUMMARY = """alarm_summary(
     dev_id NOT NULL,
+    code NOT NULL,
+    count NOT NULL,
+    first_seen NOT NULL,
+    last_seen NOT NULL,
+    last_value,
+    PRIMARY KEY(dev_id, code),
+    FOREIGN KEY(dev_id) REFERENCES devices(dev_id)
+) WITHOUT ROWID"""
+
+# Meter samples, as packed float32 blocks per tier. See database/readings.py
+TABLE_READINGS = """readings(
+    dev_id NOT NULL,
+    code NOT NULL,
+    tier NOT NULL,
     start_time NOT NULL,
     duration NOT NULL,
-    description NOT NULL,
+    count NOT NULL,
     readings NOT NULL,
+    PRIMARY KEY(dev_id, code, tier, start_time),
     FOREIGN KEY(dev_id) REFERENCES devices(dev_id)
-)"""
+) WITHOUT ROWID"""
 
 # This setup will store the most recent default and non-default versions of a
 # code per device. NOTE May want to check.
@@ -59,29 +75,117 @@ TABLE_STATUS = """status(
     FOREIGN KEY(dev_id) REFERENCES devices(dev_id)
 )"""
 
+# A ring of recent status readings per device. See database/status.py
+TABLE_STATUS_HISTORY = """status_history(
+    dev_id NOT NULL,
+    slot NOT NULL,
+    reading_time NOT NULL,
+    connect_status NOT NULL,
+    charge_state,
+    PRIMARY KEY(dev_id, slot),
+    FOREIGN KEY(dev_id) REFERENCES devices(dev_id)
+) WITHOUT ROWID"""
+
+# The slot of each device's ring to write next
+TABLE_STATUS_HISTORY_HEAD = """status_history_head(
+    dev_id PRIMARY KEY,
+    next_slot NOT NULL,
+    FOREIGN KEY(dev_id) REFERENCES devices(dev_id)
+) WITHOUT ROWID"""
+
 TABLES = [
     TABLE_DEVICES,
     TABLE_ALARMS,
+    TABLE_ALARM_SUMMARY,
     TABLE_READINGS,
     TABLE_SETTINGS,
     TABLE_STATUS,
+    TABLE_STATUS_HISTORY,
+    TABLE_STATUS_HISTORY_HEAD,
+]
+
+# Indexes, as `name ON table(columns)`
+INDEX_ALARMS_TIME = "alarms_time ON alarms(reading_time)"
+INDEX_ALARMS_DEVICE_TIME = "alarms_device_time ON alarms(dev_id, reading_time)"
+INDEX_READINGS_TIER_TIME = "readings_tier_time ON readings(tier, start_time)"
+INDEX_SETTINGS_EXPIRY = "settings_expiry ON settings(is_default, finish_time)"
+INDEX_STATUS_HISTORY_TIME = (
+    "status_history_time ON status_history(dev_id, reading_time)"
+)
+
+INDEXES = [
+    INDEX_ALARMS_TIME,
+    INDEX_ALARMS_DEVICE_TIME,
+    INDEX_READINGS_TIER_TIME,
+    INDEX_SETTINGS_EXPIRY,
+    INDEX_STATUS_HISTORY_TIME,
+]
+
+# Fill the alarm summary from the history of a database from before it existed
+BACKFILL_ALARM_SUMMARY = """
+    INSERT INTO alarm_summary(
+        dev_id, code, count, first_seen, last_seen, last_value
+    )
+    SELECT dev_id, code, COUNT(*), MIN(reading_time), MAX(reading_time), (
+            SELECT value FROM alarms AS latest
+            WHERE latest.dev_id = alarms.dev_id AND latest.code = alarms.code
+            ORDER BY reading_time DESC LIMIT 1
+        )
+    FROM alarms
+    GROUP BY dev_id, code
+"""
+
+# Changes to databases made by earlier versions, each applied once in order.
+# PRAGMA user_version holds how many have been applied.
+MIGRATIONS = [
+    "DROP TABLE IF EXISTS reading", # Never written to, replaced by readings
 ]
 
 def create_database():
-    """ Create sqlite database according to above schema. """
+    """ Create sqlite database according to above schema. Tables and indexes
+        that already exist are left as they are, so this is safe to run on
+        every start.
+    """
     con = sql.connect(SHEMS_DB_PATH)
     cur = con.cursor()
 
+    # Only takes effect on a new database. Lets pruned pages be returned to
+    # the file system without a full vacuum.
+    cur.execute("PRAGMA auto_vacuum = INCREMENTAL")
+
+    existing = {name for (name,) in cur.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table'"
+    )}
     for table in TABLES:
-        print(f"Creating table {table.partition('(')[0]}")
+        name = table.partition('(')[0]
+        if name not in existing:
+            logging.info("Creating table %s", name)
         cur.execute("CREATE TABLE IF NOT EXISTS " + table)
 
+    for index in INDEXES:
+        cur.execute("CREATE INDEX IF NOT EXISTS " + index)
+
+    if cur.execute("SELECT 1 FROM alarm_summary LIMIT 1").fetchone() is None:
+        cur.execute(BACKFILL_ALARM_SUMMARY)
+
+    [version] = cur.execute("PRAGMA user_version").fetchone()
+    if version < len(MIGRATIONS):
+        for migration in MIGRATIONS[version:]:
+            logging.info("Migrating database: %s", migration)
+            cur.execute(migration)
+        cur.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+    con.commit()
+    con.close()
+
 def destroy_database():
     """ Remove all tables from within the database """
     con = sql.connect(SHEMS_DB_PATH)
     cur = con.cursor()
 
     for table in TABLES[::-1]:
-        print(f"Dropping table {table.partition('(')[0]}")
+        logging.info("Dropping table %s", table.partition('(')[0])
         cur.execute("DROP TABLE " + table.partition('(')[0])
+    cur.execute("PRAGMA user_version = 0")
+    con.commit()
+    con.close()
 
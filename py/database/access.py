@@ -1,14 +1,388 @@
+"""
+File: database/access.py
+Email: e.roderick@uqconnect.edu.au
+Description: Managed access to the sqlite database. A long-lived writer
+    connection is kept for each dispatcher thread, and a small pool of
+    read-only connections is shared by the server's request handlers.
+"""
+
+import queue
 import sqlite3 as sql
+import threading
+import time
+from contextlib import contextmanager
+from enum import Enum
+from pathlib import Path
+from typing import Callable, Hashable, Iterator
+
+from common import metrics
+from common.env_vars import SHEMS_DB_BUSY_TIMEOUT, SHEMS_DB_CACHE_SIZE
+from common.env_vars import SHEMS_DB_MMAP_SIZE, SHEMS_DB_PATH
+from common.env_vars import SHEMS_DB_READER_TIMEOUT, SHEMS_DB_READERS
+
+# Classes
+class ConnectionManager(): # pylint: disable=too-many-instance-attributes
+    """ Owner of all long-lived connections to a single sqlite database file.
+        Connections are opened lazily and tuned with the same pragmas, so the
+        cost of opening a connection and parsing the schema is paid once.
+    """
+    def __init__( # pylint: disable=too-many-arguments
+        self,
+        path: str,
+        *,
+        readers: int = 2,
+        mmap_size: int = 0,
+        cache_size: int = -2000,
+        busy_timeout: int = 5000,
+        reader_timeout: float = 5,
+    ) -> None:
+        """ Construct a connection manager.
+
+        Params:
+            path: The path to the sqlite database file.
+            readers: The maximum number of read-only connections to pool.
+            mmap_size: The number of bytes of the database to memory map.
+            cache_size: The sqlite page cache size. Negative values are KiB,
+                positive values are pages.
+            busy_timeout: The milliseconds a writer waits for another writer
+                to finish its transaction.
+            reader_timeout: The seconds to wait for a pooled read-only
+                connection when every one is in use.
+        """
+        self._path = path
+        self._readers = max(1, readers)
+        self._mmap_size = mmap_size
+        self._cache_size = cache_size
+        self._busy_timeout = busy_timeout
+        self._reader_timeout = reader_timeout
+
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._writers = []
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+
+        # Writer state of each thread: its connection, whether a transaction
+        # block is open, the tables it has changed, and callbacks to run once
+        # those changes commit
+        self._local = threading.local()
+
+        # Change counters for tables, bumped when writes to them are committed
+        self._versions = {}
+
+    def _tune(self, con: sql.Connection) -> None:
+        """ Apply the pragmas shared by every connection. """
+        con.execute(f"PRAGMA mmap_size = {int(self._mmap_size)}")
+        con.execute(f"PRAGMA cache_size = {int(self._cache_size)}")
+
+    def _open_writer(self) -> sql.Connection:
+        """ Open the read-write connection. WAL mode lets the pooled readers
+            run alongside the writer, and NORMAL sync is durable in WAL mode
+            apart from the last transactions before a power loss.
+        """
+        con = sql.connect(self._path, check_same_thread=False)
+        # Only takes effect before the first table of a new database is made
+        con.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        con.execute("PRAGMA journal_mode = WAL")
+        con.execute("PRAGMA synchronous = NORMAL")
+        con.execute(f"PRAGMA busy_timeout = {int(self._busy_timeout)}")
+        self._tune(con)
+        return con
+
+    def _open_reader(self) -> sql.Connection:
+        """ Open a read-only connection for use by any single thread at a time.
+        """
+        uri = Path(self._path).resolve().as_uri() + "?mode=ro"
+        con = sql.connect(uri, uri=True, check_same_thread=False)
+        self._tune(con)
+        return con
+
+    def _state(self) -> threading.local:
+        """ The calling thread's writer state, initialised on first use. """
+        local = self._local
+        if not hasattr(local, 'writer'):
+            local.writer = None
+            local.in_transaction = False
+            local.changed = set()
+            local.on_commit = []
+        return local
+
+    def writer(self) -> sql.Connection:
+        """ (sql.Connection) The calling thread's writer connection, opened on
+            first use. Writers on different threads take turns to hold
+            sqlite's write lock.
+        """
+        state = self._state()
+        if state.writer is None:
+            state.writer = self._open_writer()
+            with self._lock:
+                self._writers.append(state.writer)
+        return state.writer
+
+    @contextmanager
+    def transaction(self) -> Iterator[sql.Connection]:
+        """ Hold a single transaction open on the writer for the duration of a
+            with block. Calls to `commit` are deferred until the block exits,
+            at which point the transaction is committed, or rolled back if the
+            block or the commit raised.
+        """
+        con = self.writer()
+        state = self._state()
+        if con.in_transaction:
+            self._commit(con)
+
+        # Writers on other threads queue here rather than in sqlite's busy
+        # handler, which polls with sleeps. The sqlite write lock is taken up
+        # front, as a read transaction cannot wait for a writer outside this
+        # process when it later upgrades to write.
+        with self._write_lock:
+            con.execute("BEGIN IMMEDIATE")
+            state.in_transaction = True
+            try:
+                yield con
+                self._commit(con, run_callbacks=False)
+            except BaseException:
+                # Also reached if the commit itself fails
+                if con.in_transaction:
+                    con.rollback()
+                state.changed.clear()
+                state.on_commit.clear()
+                raise
+            finally:
+                state.in_transaction = False
+
+        # Callbacks run after the lock is released, so other writers can
+        # proceed while they relay changes
+        self._run_on_commit()
+
+    @contextmanager
+    def savepoint(self, name: str = "dispatch_item") -> Iterator[None]:
+        """ Isolate the writes made within a with block, so an error only
+            rolls back that block's writes. Has no effect outside of a
+            `transaction` block.
+        """
+        state = self._state()
+        if not state.in_transaction:
+            yield
+            return
+
+        con = state.writer
+        callbacks = len(state.on_commit)
+        con.execute(f"SAVEPOINT {name}")
+        try:
+            yield
+        except BaseException:
+            con.execute(f"ROLLBACK TO {name}")
+            con.execute(f"RELEASE {name}")
+            del state.on_commit[callbacks:]
+            raise
+        con.execute(f"RELEASE {name}")
+
+    def commit(self) -> None:
+        """ Commit the writer, unless a `transaction` block will commit it. """
+        state = self._state()
+        if not state.in_transaction and state.writer is not None:
+            self._commit(state.writer)
+
+    def _commit(self, con: sql.Connection, run_callbacks: bool = True) -> None:
+        start = time.perf_counter()
+        con.commit()
+        metrics.DB_COMMIT_SECONDS.observe(time.perf_counter() - start)
+        self._bump_versions()
+        if run_callbacks:
+            self._run_on_commit()
+
+    def on_commit(self, callback: Callable[[], None]) -> None:
+        """ Run a callback once the calling thread's writes commit, or
+            immediately outside of a `transaction` block. Callbacks are
+            discarded if the writes they follow are rolled back.
+        """
+        state = self._state()
+        if not state.in_transaction:
+            callback()
+            return
+        state.on_commit.append(callback)
+
+    def _run_on_commit(self) -> None:
+        state = self._state()
+        callbacks, state.on_commit = state.on_commit, []
+        for callback in callbacks:
+            callback()
+
+    def mark_changed(self, table: str, key: Hashable = None) -> None:
+        """ Record that a table has been written to. The table's version is
+            bumped once the write is committed. If a key is given, the version
+            of that key within the table is bumped as well.
+        """
+        changed = self._state().changed
+        changed.add(table)
+        if key is not None:
+            changed.add((table, key))
+
+    def _bump_versions(self) -> None:
+        changed = self._state().changed
+        with self._lock:
+            for table in changed:
+                self._versions[table] = self._versions.get(table, 0) + 1
+        changed.clear()
+
+    def version(self, table: str, key: Hashable = None) -> int:
+        """ (int) The number of committed changes to a table, or to a key
+            within the table, since startup.
+        """
+        return self._versions.get(table if key is None else (table, key), 0)
+
+    @contextmanager
+    def reader(self) -> Iterator[sql.Connection]:
+        """ Borrow a read-only connection from the pool for the duration of a
+            with block. Waits if every pooled connection is in use.
+
+        Raises:
+            sqlite3.OperationalError: If no connection is returned to the pool
+                within the reader timeout.
+        """
+        con = self._acquire_reader()
+        try:
+            yield con
+        finally:
+            self._release_reader(con)
+
+    def _acquire_reader(self) -> sql.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_open = self._opened < self._readers
+            if can_open:
+                self._opened += 1
 
-from common.env_vars import SHEMS_DB_PATH
+        if not can_open:
+            try:
+                return self._idle.get(timeout=self._reader_timeout)
+            except queue.Empty:
+                raise sql.OperationalError(
+                    "Timed out waiting for a read connection"
+                ) from None
 
+        try:
+            return self._open_reader()
+        except sql.Error:
+            with self._lock:
+                self._opened -= 1
+            raise
+
+    def _release_reader(self, con: sql.Connection) -> None:
+        # Discard any read transaction left open by the borrower
+        if con.in_transaction:
+            con.rollback()
+        self._idle.put(con)
+
+    def close(self) -> None:
+        """ Close the writers and all idle readers. Connections are reopened on
+            next use, so this is safe to call more than once. Must not be
+            called while another thread is writing.
+        """
+        with self._lock:
+            for writer in self._writers:
+                writer.close()
+            self._writers = []
+            self._local = threading.local()
+
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+                self._opened -= 1
+
+
+# Shared manager for the configured database
+_manager = ConnectionManager(
+    SHEMS_DB_PATH,
+    readers=SHEMS_DB_READERS,
+    mmap_size=SHEMS_DB_MMAP_SIZE,
+    cache_size=SHEMS_DB_CACHE_SIZE,
+    busy_timeout=SHEMS_DB_BUSY_TIMEOUT,
+    reader_timeout=SHEMS_DB_READER_TIMEOUT,
+)
+
+
+# Functions
 def get_cursor() -> tuple[sql.Connection, sql.Cursor]:
-    """ Get an sqlite db connection and a cursor to execute queries with.
-        Returns from this function should be used for multiple queries (if
-        needed) per calling function.
+    """ Get the calling thread's sqlite writer connection and a cursor to
+        execute queries with. Returns from this function should be used for
+        multiple queries (if needed) per calling function. Only the dispatcher
+        should write.
     """
-    con = sql.connect(SHEMS_DB_PATH)
+    con = _manager.writer()
     cur = con.cursor()
 
     return con, cur
 
+
+def commit() -> None:
+    """ Commit the writes made through `get_cursor`. Inside a `transaction`
+        block the commit is deferred until the block exits.
+    """
+    _manager.commit()
+
+
+def on_commit(callback: Callable[[], None]) -> None:
+    """ Run a callback, such as relaying a change to devices, once the writes
+        made so far commit. Inside a `transaction` block, this is after the
+        block's writes commit, and never if they are rolled back.
+    """
+    _manager.on_commit(callback)
+
+
+def mark_changed(table: str | Enum, key: Hashable = None) -> None:
+    """ Record a write to a table, so its version is bumped on commit. Readers
+        can use the version to tell if anything cached from the table is stale.
+        Give a key, such as a row's primary key, to also version that row.
+    """
+    _manager.mark_changed(
+        table.value if isinstance(table, Enum) else table,
+        key
+    )
+
+
+def table_version(table: str | Enum, key: Hashable = None) -> int:
+    """ (int) A counter that increases each time writes to a table, or to a
+        key within the table, commit.
+    """
+    return _manager.version(
+        table.value if isinstance(table, Enum) else table,
+        key
+    )
+
+
+@contextmanager
+def transaction() -> Iterator[sql.Connection]:
+    """ Run every write within a with block as one writer transaction. """
+    with _manager.transaction() as con:
+        yield con
+
+
+@contextmanager
+def savepoint() -> Iterator[None]:
+    """ Roll back only this block's writes if it raises, within a
+        `transaction` block.
+    """
+    with _manager.savepoint():
+        yield
+
+
+@contextmanager
+def get_reader() -> Iterator[sql.Connection]:
+    """ Borrow a pooled read-only sqlite connection for the duration of a with
+        block.
+    """
+    with _manager.reader() as con:
+        yield con
+
+
+def close_connections() -> None:
+    """ Close every open connection to the database. """
+    _manager.close()
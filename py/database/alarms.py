@@ -0,0 +1,150 @@
+"""
+File: database/alarms.py
+Email: e.roderick@uqconnect.edu.au
+Description: Storage of device alarm history. Each alarm is kept as a row of
+    the alarms table until it passes the retention window, and a per device,
+    per code summary is kept up to date as alarms arrive, so that summaries
+    never scan the history.
+"""
+
+import sqlite3 as sql
+from typing import NamedTuple, Optional
+
+from database.constants import Tables
+import database.access as db
+
+
+# Classes
+class Alarm(NamedTuple):
+    """ An alarm kept in the alarm history. """
+    dev_id: str
+    code: str
+    reading_time: float
+    value: object
+
+
+class AlarmSummary(NamedTuple):
+    """ Every alarm of a code received from a device, including those that
+        have since been pruned.
+    """
+    dev_id: str
+    code: str
+    count: int
+    first_seen: float
+    last_seen: float
+    last_value: object
+
+
+# Functions
+def store_alarm(mrid: str, code: str, read_time: float, value) -> None:
+    """ Add an alarm to the history, and to its device's summary. Must be
+        called by the dispatcher.
+
+    Params:
+        mrid: The device that raised the alarm.
+        code: The alarm code.
+        read_time: When the alarm was raised.
+        value: The value the alarm was raised with.
+
+    Raises:
+        sqlite3.IntegrityError: If the alarm has already been stored.
+    """
+    _, cur = db.get_cursor()
+    cur.execute(
+        """INSERT INTO alarms(dev_id, code, reading_time, value)
+            VALUES (?, ?, ?, ?)
+        """,
+        (mrid, code, read_time, value)
+    )
+
+    # An alarm received out of order does not replace the last value
+    cur.execute(
+        """INSERT INTO alarm_summary(
+                dev_id, code, count, first_seen, last_seen, last_value
+            ) VALUES (?, ?, 1, ?, ?, ?)
+            ON CONFLICT (dev_id, code) DO UPDATE SET
+                count = count + 1,
+                first_seen = MIN(first_seen, excluded.first_seen),
+                last_value = CASE WHEN excluded.last_seen >= last_seen
+                    THEN excluded.last_value ELSE last_value END,
+                last_seen = MAX(last_seen, excluded.last_seen)
+        """,
+        (mrid, code, read_time, read_time, value)
+    )
+    db.mark_changed(Tables.ALARMS, mrid)
+    db.commit()
+
+
+def prune_alarms(before: float, limit: int) -> int:
+    """ Remove up to `limit` of the oldest alarms from before a time, so that
+        a large backlog is removed over several short transactions. Summaries
+        are unchanged. Must be called by the dispatcher.
+
+    Returns:
+        The number of alarms removed. Fewer than `limit` if none remain.
+    """
+    _, cur = db.get_cursor()
+    cur.execute(
+        """DELETE FROM alarms WHERE rowid IN (
+                SELECT rowid FROM alarms
+                WHERE reading_time < ?
+                ORDER BY reading_time
+                LIMIT ?
+            )
+        """,
+        (before, limit)
+    )
+    removed = cur.rowcount
+
+    if removed:
+        db.mark_changed(Tables.ALARMS)
+    db.commit()
+    return removed
+
+
+def recent_alarms(
+    con: sql.Connection,
+    after: Optional[float] = None,
+    mrid: Optional[str] = None,
+    limit: int = 100,
+) -> list[Alarm]:
+    """ The newest alarms, of every device or of one, newest first.
+
+    Params:
+        con: The connection to read with.
+        after: Only include alarms raised after this time, if given.
+        mrid: The device to read alarms of, or None for every device.
+        limit: The most alarms to return.
+    """
+    where, args = [], []
+    if mrid is not None:
+        where.append("dev_id = ?")
+        args.append(mrid)
+    if after is not None:
+        where.append("reading_time > ?")
+        args.append(after)
+    filters = "WHERE " + " AND ".join(where) if where else ""
+
+    rows = con.execute(
+        f"""SELECT dev_id, code, reading_time, value FROM alarms
+            {filters}
+            ORDER BY reading_time DESC LIMIT ?
+        """,
+        (*args, limit)
+    )
+    return [Alarm(*row) for row in rows]
+
+
+def alarm_summaries(
+    con: sql.Connection,
+    mrid: Optional[str] = None,
+) -> list[AlarmSummary]:
+    """ The alarm summaries of every device, or of one. """
+    query = """SELECT dev_id, code, count, first_seen, last_seen, last_value
+        FROM alarm_summary
+    """
+    if mrid is None:
+        rows = con.execute(query)
+    else:
+        rows = con.execute(query + " WHERE dev_id = ?", (mrid,))
+    return [AlarmSummary(*row) for row in rows]
@@ -11,9 +11,12 @@ class Tables(Enum):
     """ Definitions of all table names """
     DEVICES = "devices"
     ALARMS = "alarms"
+    ALARM_SUMMARY = "alarm_summary"
     READINGS = "readings"
     SETTINGS = "settings"
     STATUS = "status"
+    STATUS_HISTORY = "status_history"
+    STATUS_HISTORY_HEAD = "status_history_head"
 
 # Constants
 SCHEMA = {
@@ -28,12 +31,21 @@ SCHEMA = {
         "reading_time": "reading_time",
         "value": "value"
     },
+    Tables.ALARM_SUMMARY.value: {
+        "dev_id": "dev_id",
+        "code": "code",
+        "count": "count",
+        "first_seen": "first_seen",
+        "last_seen": "last_seen",
+        "last_value": "last_value",
+    },
     Tables.READINGS.value: {
-        "reading_id": "reading_id",
         "dev_id": "dev_id",
+        "code": "code",
+        "tier": "tier",
         "start_time": "start_time",
         "duration": "duration",
-        "description": "description",
+        "count": "count",
         "readings": "readings",
     },
     Tables.SETTINGS.value: {
@@ -48,8 +60,21 @@ SCHEMA = {
         "connect_status": "connect_status",
         "charge_state": "charge_state",
     },
+    Tables.STATUS_HISTORY.value: {
+        "dev_id": "dev_id",
+        "slot": "slot",
+        "reading_time": "reading_time",
+        "connect_status": "connect_status",
+        "charge_state": "charge_state",
+    },
+    Tables.STATUS_HISTORY_HEAD.value: {
+        "dev_id": "dev_id",
+        "next_slot": "next_slot",
+    },
 }
 
 DEVICE_STATUS_OFF = 0
 DEVICE_STATUS_ON = 1
 
+READING_TIER_RAW = 0
+
@@ -0,0 +1,313 @@
+"""
+File: database/readings.py
+Email: e.roderick@uqconnect.edu.au
+Description: Time-series storage of device meter readings. Each batch of raw
+    samples is kept as one row holding a packed float32 array. Samples are also
+    downsampled into tiers of fixed width buckets, where each row is a block of
+    buckets holding packed count, sum, min and max columns. Rows older than
+    their tier's retention are pruned, keeping the database small while still
+    answering range queries from a few rows.
+"""
+
+import array
+import sqlite3 as sql
+import sys
+from typing import NamedTuple, Sequence
+
+from common.env_vars import SHEMS_READING_RAW_RETENTION, SHEMS_READING_TIERS
+from database.constants import READING_TIER_RAW, Tables
+import database.access as db
+
+# Constants
+BLOCK_BUCKETS = 60 # Buckets per downsampled row
+MAX_RAW_SPAN = 3600 # The most seconds a single batch of samples may cover
+
+# Blobs are little-endian, whatever the host's byte order
+_SWAP = sys.byteorder == 'big'
+
+
+# Classes
+class Tier(NamedTuple):
+    """ A level of downsampling, and how long its rows are kept. """
+    seconds: int # The bucket width, or READING_TIER_RAW for raw samples
+    retention: float # Seconds to keep rows for after they end
+
+    @property
+    def span(self) -> float:
+        """ (float) The most seconds covered by a single row of the tier. """
+        if self.seconds == READING_TIER_RAW:
+            return MAX_RAW_SPAN
+        return self.seconds * BLOCK_BUCKETS
+
+
+class Bucket(NamedTuple):
+    """ The summary of the samples within a downsampled bucket. """
+    time: float
+    count: int
+    mean: float
+    min: float
+    max: float
+
+
+class TierBlock():
+    """ A row of a downsampled tier, as columns of per-bucket values. """
+    def __init__(self, blob: bytes = None) -> None:
+        """ Construct a block, empty or from a stored blob. """
+        self.counts = array.array('I')
+        self.sums = array.array('d')
+        self.mins = array.array('f')
+        self.maxs = array.array('f')
+
+        if blob is None:
+            self.counts.extend([0] * BLOCK_BUCKETS)
+            self.sums.extend([0.0] * BLOCK_BUCKETS)
+            self.mins.extend([0.0] * BLOCK_BUCKETS)
+            self.maxs.extend([0.0] * BLOCK_BUCKETS)
+            return
+
+        offset = 0
+        for column in self._columns():
+            size = column.itemsize * BLOCK_BUCKETS
+            column.frombytes(blob[offset:offset + size])
+            offset += size
+            if _SWAP:
+                column.byteswap()
+
+    def _columns(self) -> tuple[array.array, ...]:
+        return (self.counts, self.sums, self.mins, self.maxs)
+
+    def add(self, index: int, value: float) -> None:
+        """ Add a sample to a bucket. """
+        if self.counts[index] == 0:
+            self.mins[index] = self.maxs[index] = value
+        else:
+            self.mins[index] = min(self.mins[index], value)
+            self.maxs[index] = max(self.maxs[index], value)
+        self.counts[index] += 1
+        self.sums[index] += value
+
+    def to_blob(self) -> bytes:
+        """ (bytes) The block's columns, as stored in the database. """
+        return b''.join(_le_bytes(column) for column in self._columns())
+
+    def buckets(self, start: float, width: int) -> list[Bucket]:
+        """ The buckets holding samples, given the block's start time. """
+        return [
+            Bucket(start + i * width, count, self.sums[i] / count,
+                   self.mins[i], self.maxs[i])
+            for i, count in enumerate(self.counts) if count
+        ]
+
+
+# Functions
+def _parse_tiers(spec: str) -> list[Tier]:
+    """ Parse tiers given as `seconds:retention,...`. """
+    tiers = [Tier(READING_TIER_RAW, SHEMS_READING_RAW_RETENTION)]
+    for part in filter(None, spec.split(',')):
+        seconds, _, retention = part.partition(':')
+        tiers.append(Tier(int(seconds), float(retention)))
+
+    if any(tier.seconds <= 0 for tier in tiers[1:]):
+        raise ValueError("SHEMS_READING_TIERS bucket widths must be positive")
+    return tiers
+
+
+# The raw tier, then each downsampled tier
+TIERS = _parse_tiers(SHEMS_READING_TIERS)
+
+
+def _le_bytes(values: array.array) -> bytes:
+    if _SWAP:
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _floats(blob: bytes) -> array.array:
+    values = array.array('f')
+    values.frombytes(blob)
+    if _SWAP:
+        values.byteswap()
+    return values
+
+
+def store_readings(
+    mrid: str,
+    code: str,
+    start: float,
+    interval: float,
+    values: Sequence[float],
+) -> bool:
+    """ Store a batch of evenly spaced samples, and add them to each
+        downsampled tier. A batch already stored under the same start time,
+        such as a redelivered message, is ignored so that it is not counted
+        in the tiers twice. Must be called by the dispatcher.
+
+    Params:
+        mrid: The device the samples were read by.
+        code: What was measured, such as a meter register.
+        start: The timestamp of the first sample.
+        interval: The seconds between samples.
+        values: The samples. A little-endian float32 memoryview, such as
+            from `decode_readings`, is stored without conversion.
+
+    Returns:
+        False if the batch had already been stored.
+
+    Raises:
+        ValueError: If the batch is empty, or covers too long a time.
+    """
+    count = len(values)
+    duration = interval * count
+    if count == 0 or interval <= 0 or duration > MAX_RAW_SPAN:
+        raise ValueError(
+            f"Readings must be a non-empty batch of up to {MAX_RAW_SPAN}s"
+        )
+    if isinstance(values, memoryview) and values.format == 'f' and not _SWAP:
+        blob = values
+    else:
+        if not isinstance(values, array.array) or values.typecode != 'f':
+            values = array.array('f', values)
+        blob = _le_bytes(values)
+
+    _, cur = db.get_cursor()
+    query = """
+        INSERT INTO readings (
+            dev_id, code, tier, start_time, duration, count, readings
+        ) VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT DO NOTHING
+    """
+    cur.execute(query, (mrid, code, READING_TIER_RAW, start, duration, count,
+                        blob))
+    stored = cur.rowcount > 0
+
+    if stored:
+        query = """
+            INSERT OR REPLACE INTO readings (
+                dev_id, code, tier, start_time, duration, count, readings
+            ) VALUES (?, ?, ?, ?, ?, ?, ?)
+        """
+        for tier in TIERS[1:]:
+            _add_to_tier(cur, query, mrid, code, tier, start, interval,
+                         values)
+        db.mark_changed(Tables.READINGS, mrid)
+    db.commit()
+    return stored
+
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+def _add_to_tier(
+    cur: sql.Cursor,
+    query: str,
+    mrid: str,
+    code: str,
+    tier: Tier,
+    start: float,
+    interval: float,
+    values: Sequence[float],
+) -> None:
+    """ Merge samples into the blocks of a downsampled tier. """
+    # Group samples by the block they fall in
+    blocks = {}
+    for i, value in enumerate(values):
+        bucket = int((start + i * interval) // tier.seconds)
+        block, index = divmod(bucket, BLOCK_BUCKETS)
+        blocks.setdefault(block, []).append((index, value))
+
+    for block, samples in blocks.items():
+        block_start = block * tier.span
+        res = cur.execute(
+            """SELECT readings FROM readings
+                WHERE dev_id = ? AND code = ? AND tier = ? AND start_time = ?
+            """,
+            (mrid, code, tier.seconds, block_start)
+        ).fetchone()
+
+        stored = TierBlock(res[0] if res else None)
+        for index, value in samples:
+            stored.add(index, value)
+
+        cur.execute(query, (mrid, code, tier.seconds, block_start, tier.span,
+                            BLOCK_BUCKETS, stored.to_blob()))
+
+
+# pylint: disable-next=too-many-arguments,too-many-positional-arguments
+def query_readings(
+    con: sql.Connection,
+    mrid: str,
+    code: str,
+    start: float,
+    end: float,
+    tier: int = READING_TIER_RAW,
+) -> list[tuple[float, float]] | list[Bucket]:
+    """ Read the samples of a device within a time range.
+
+    Params:
+        con: The connection to read with.
+        mrid: The device the samples were read by.
+        code: What was measured.
+        start: The earliest sample time to include.
+        end: The time to include samples up to, exclusive.
+        tier: The bucket width of the tier to read, or READING_TIER_RAW.
+
+    Returns:
+        For the raw tier, (time, value) for each sample. Otherwise, the
+        buckets holding samples.
+
+    Raises:
+        ValueError: If no tier has the given bucket width.
+    """
+    spans = {t.seconds: t.span for t in TIERS}
+    if tier not in spans:
+        raise ValueError(f"No readings tier of {tier}s")
+
+    # Bound the scan of the primary key from both sides
+    rows = con.execute(
+        """SELECT start_time, duration, count, readings FROM readings
+            WHERE dev_id = ? AND code = ? AND tier = ?
+                AND start_time > ? AND start_time < ?
+            ORDER BY start_time
+        """,
+        (mrid, code, tier, start - spans[tier], end)
+    ).fetchall()
+
+    result = []
+    for row_start, duration, count, blob in rows:
+        if tier == READING_TIER_RAW:
+            interval = duration / count
+            result.extend(
+                (row_start + i * interval, value)
+                for i, value in enumerate(_floats(blob))
+            )
+        else:
+            result.extend(TierBlock(blob).buckets(row_start, tier))
+
+    if tier == READING_TIER_RAW:
+        return [(t, value) for t, value in result if start <= t < end]
+    return [bucket for bucket in result if start <= bucket.time < end]
+
+
+def prune_readings(now: float) -> int:
+    """ Remove rows that ended longer ago than their tier's retention, then
+        return the freed pages to the file system if incremental vacuuming is
+        enabled. Must be called by the dispatcher.
+
+    Returns:
+        The number of rows removed.
+    """
+    _, cur = db.get_cursor()
+    removed = 0
+    for tier in TIERS:
+        # A row starting this early has certainly ended before the cutoff
+        cur.execute(
+            "DELETE FROM readings WHERE tier = ? AND start_time < ?",
+            (tier.seconds, now - tier.retention - tier.span)
+        )
+        removed += cur.rowcount
+
+    if removed:
+        # Each step frees one page, so the pragma must be run to completion
+        cur.execute("PRAGMA incremental_vacuum").fetchall()
+        db.mark_changed(Tables.READINGS)
+    db.commit()
+    return removed
@@ -0,0 +1,173 @@
+"""
+File: database/status.py
+Email: e.roderick@uqconnect.edu.au
+Description: Storage of device status readings. The status table holds the
+    latest reading of each device. Every reading is also kept in a history
+    ring of SHEMS_STATUS_HISTORY slots per device, where the oldest slot is
+    overwritten in place, so the history of a device never grows and each
+    reading costs the same to store.
+"""
+
+import sqlite3 as sql
+from typing import NamedTuple, Optional
+
+from common.env_vars import SHEMS_STATUS_HISTORY
+from database.constants import Tables
+import database.access as db
+
+
+# Classes
+class StatusReading(NamedTuple):
+    """ A status kept in a device's history ring. """
+    reading_time: float
+    connect_status: int
+    charge_state: Optional[float]
+
+
+# Functions
+def record_status(
+    mrid: str,
+    read_time: float,
+    connect_status: int,
+    charge_state: Optional[float] = None,
+) -> bool:
+    """ Add a status to the device's history ring, and replace the device's
+        latest status unless that was read later. Must be called by the
+        dispatcher.
+
+    Params:
+        mrid: The device the status is of.
+        read_time: When the status was read.
+        connect_status: One of the DEVICE_STATUS values.
+        charge_state: The device's state of charge, if known.
+
+    Returns:
+        True if the status is now the device's latest.
+    """
+    _, cur = db.get_cursor()
+    latest = cur.execute(
+        """INSERT INTO status(
+                dev_id, reading_time, connect_status, charge_state
+            ) VALUES (?, ?, ?, ?)
+            ON CONFLICT (dev_id) DO UPDATE SET
+                reading_time = excluded.reading_time,
+                connect_status = excluded.connect_status,
+                charge_state = excluded.charge_state
+            WHERE excluded.reading_time >= status.reading_time
+            RETURNING 1
+        """,
+        (mrid, read_time, connect_status, charge_state)
+    ).fetchone() is not None
+
+    # Claim the device's next slot, then overwrite it
+    [slot] = cur.execute(
+        """INSERT INTO status_history_head(dev_id, next_slot) VALUES (?, ?)
+            ON CONFLICT (dev_id) DO UPDATE SET next_slot = (next_slot + 1) % ?
+            RETURNING next_slot
+        """,
+        (mrid, 1 % SHEMS_STATUS_HISTORY, SHEMS_STATUS_HISTORY)
+    ).fetchone()
+    cur.execute(
+        """INSERT INTO status_history(
+                dev_id, slot, reading_time, connect_status, charge_state
+            ) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (dev_id, slot) DO UPDATE SET
+                reading_time = excluded.reading_time,
+                connect_status = excluded.connect_status,
+                charge_state = excluded.charge_state
+        """,
+        (mrid, (slot - 1) % SHEMS_STATUS_HISTORY, read_time, connect_status,
+         charge_state)
+    )
+    db.mark_changed(Tables.STATUS_HISTORY, mrid)
+    db.commit()
+    return latest
+
+
+def trim_status_history() -> None:
+    """ Keep only the newest SHEMS_STATUS_HISTORY readings of each device, for
+        when the rings have been shrunk since they were written. The kept
+        readings are moved to the first slots, oldest first, and each ring
+        carries on after its newest reading. Must be called by the dispatcher.
+    """
+    _, cur = db.get_cursor()
+    shrunk = cur.execute(
+        "SELECT 1 FROM status_history WHERE slot >= ? LIMIT 1",
+        (SHEMS_STATUS_HISTORY,)
+    ).fetchone()
+    if shrunk:
+        # Slots wrap around, so only the reading times tell which are newest
+        cur.execute(
+            """DELETE FROM status_history WHERE (dev_id, slot) IN (
+                    SELECT dev_id, slot FROM (
+                        SELECT dev_id, slot, ROW_NUMBER() OVER (
+                            PARTITION BY dev_id
+                            ORDER BY reading_time DESC, slot DESC
+                        ) AS age
+                        FROM status_history
+                    )
+                    WHERE age > ?
+                )
+            """,
+            (SHEMS_STATUS_HISTORY,)
+        )
+
+        # Renumber through negative slots, which never collide with a slot
+        # still waiting to be moved
+        cur.execute(
+            """UPDATE status_history SET slot = -1 - ordered.position
+                FROM (
+                    SELECT dev_id, slot, ROW_NUMBER() OVER (
+                        PARTITION BY dev_id ORDER BY reading_time, slot
+                    ) - 1 AS position
+                    FROM status_history
+                ) AS ordered
+                WHERE status_history.dev_id = ordered.dev_id
+                    AND status_history.slot = ordered.slot
+            """
+        )
+        cur.execute("UPDATE status_history SET slot = -1 - slot")
+        cur.execute(
+            """UPDATE status_history_head SET next_slot = (
+                    SELECT COUNT(*) FROM status_history
+                    WHERE status_history.dev_id = status_history_head.dev_id
+                ) % ?
+            """,
+            (SHEMS_STATUS_HISTORY,)
+        )
+        db.mark_changed(Tables.STATUS_HISTORY)
+    db.commit()
+
+
+def status_history(
+    con: sql.Connection,
+    mrid: str,
+    after: Optional[float] = None,
+    before: Optional[float] = None,
+) -> list[StatusReading]:
+    """ The status readings of a device held in its history ring, oldest
+        first.
+
+    Params:
+        con: The connection to read with.
+        mrid: The device to read the history of.
+        after: Only include readings read after this time, if given.
+        before: Only include readings read before this time, if given.
+    """
+    where, args = ["dev_id = ?"], [mrid]
+    if after is not None:
+        where.append("reading_time > ?")
+        args.append(after)
+    if before is not None:
+        where.append("reading_time < ?")
+        args.append(before)
+
+    rows = con.execute(
+        f"""SELECT reading_time, connect_status, charge_state
+            FROM status_history
+            WHERE {" AND ".join(where)}
+            ORDER BY reading_time
+        """,
+        args
+    )
+    return [StatusReading(*row) for row in rows]
@@ -1,22 +1,33 @@
+from __future__ import annotations
+import asyncio
 import logging
-import os
+import sqlite3 as sql
 import time
-from enum import Enum
+from enum import Enum, IntEnum
 from queue import Full
-from threading import Timer
-from typing import Any, Callable, NamedTuple
-
-from common.connect import get_addresses
-from common.env_vars import SHEMS_DB_PATH
-from common.ring_buffer import Closed, RingBuffer
+from typing import Any, Callable, NamedTuple, Optional, TYPE_CHECKING
+
+from common import metrics
+from common.env_vars import SHEMS_ALARM_PRUNE, SHEMS_ALARM_PRUNE_CHUNK
+from common.env_vars import SHEMS_ALARM_RETENTION, SHEMS_CONTROL_SWEEP
+from common.env_vars import SHEMS_CONTROL_SWEEP_BATCH, SHEMS_HOST_REFRESH
+from common.env_vars import SHEMS_READING_PRUNE, SHEMS_STATE_FLUSH
+from common.ring_buffer import AsyncRingBuffer, Closed, RingBuffer
 from database._dev_access import create_database
-from database.constants import DEVICE_STATUS_OFF, DEVICE_STATUS_ON
+from database.alarms import prune_alarms, store_alarm
+from database.constants import DEVICE_STATUS_OFF, DEVICE_STATUS_ON, Tables
+from database.readings import prune_readings, store_readings
+from database.status import record_status, trim_status_history
+from dispatch.state import DEVICE_REGISTRY, DeviceState
 from relay.local import writeout
-from relay.remote import topic_from_control, publish_mqtt
-from shems.der_control import Control, DefaultControl
-from shems.mrid import get_device_mrid
+from relay.remote import topic_from_control, publish_many
+from shems.der_control import Control, ControlValue, DefaultControl
+from shems.host import get_host
 import database.access as db
 
+if TYPE_CHECKING:
+    from dispatch.scheduler import DispatchScheduler
+
 # Enums
 class DispatchAction(Enum):
     """ The actions that the dispatcher can handle. """
@@ -25,8 +36,20 @@ class DispatchAction(Enum):
     CONTROL = "DERControl"
     CONTROL_CLEAN = "DERControl_remove_old"
     CONTROL_EXPIRE = "auto_DERControl_default"
+    CONTROL_RESTORE = "DERControl_restore_expiry"
+    HOST_REFRESH = "Host_refresh"
     LISTEN_RECV_DEV = "Listener_receive_device"
     LISTEN_RECV_ALARM = "Listener_receive_alarm"
+    LISTEN_RECV_READINGS = "Listener_receive_readings"
+    READINGS_PRUNE = "Readings_prune"
+    ALARMS_PRUNE = "Alarms_prune"
+    STATE_FLUSH = "Device_state_flush"
+
+
+class DispatchLane(IntEnum):
+    """ The dispatch buffer lanes, from highest to lowest priority. """
+    CONTROL = 0
+    TELEMETRY = 1
 
 
 # Classes
@@ -36,13 +59,65 @@ class DispatchData(NamedTuple):
     data: Any
 
 
+# Constants
+# Controls, their expiry and server housekeeping are never queued behind
+# device telemetry. Everything a device sends shares one lane, so its
+# announcement is always handled before its later alarms and readings.
+# Controls can only name devices the server has read from the device list,
+# so a control never overtakes the announcement that made its device known.
+ACTION_LANES = {
+    DispatchAction.DB_INIT: DispatchLane.CONTROL,
+    DispatchAction.PRELOAD: DispatchLane.CONTROL,
+    DispatchAction.CONTROL: DispatchLane.CONTROL,
+    DispatchAction.CONTROL_CLEAN: DispatchLane.CONTROL,
+    DispatchAction.CONTROL_EXPIRE: DispatchLane.CONTROL,
+    DispatchAction.CONTROL_RESTORE: DispatchLane.CONTROL,
+    DispatchAction.HOST_REFRESH: DispatchLane.CONTROL,
+    DispatchAction.READINGS_PRUNE: DispatchLane.CONTROL,
+    DispatchAction.ALARMS_PRUNE: DispatchLane.CONTROL,
+    DispatchAction.STATE_FLUSH: DispatchLane.CONTROL,
+    DispatchAction.LISTEN_RECV_ALARM: DispatchLane.TELEMETRY,
+    DispatchAction.LISTEN_RECV_DEV: DispatchLane.TELEMETRY,
+    DispatchAction.LISTEN_RECV_READINGS: DispatchLane.TELEMETRY,
+}
+
+# Seconds between chunks of a backlog of alarms to prune or controls to expire
+ALARM_PRUNE_PAUSE = 0.5
+CONTROL_SWEEP_PAUSE = 0.5
+
+
 # Functions
-def buffer_dispatch(
+def dispatch_lane(msg: DispatchData) -> int:
+    """ The index of the dispatch buffer lane for a dispatched item. """
+    return ACTION_LANES[msg.action]
+
+
+def dispatch_key(msg: DispatchData) -> Optional[str]:
+    """ The mRID of the device a dispatched item acts on. Items for the same
+        device must be handled in order.
+
+    Returns:
+        The device mRID, or None for actions over every device, which must not
+        run alongside any other action.
+    """
+    if msg.action in (DispatchAction.LISTEN_RECV_DEV,
+                      DispatchAction.LISTEN_RECV_ALARM,
+                      DispatchAction.LISTEN_RECV_READINGS,
+                      DispatchAction.CONTROL_EXPIRE):
+        return msg.data[0]
+    if msg.action is DispatchAction.CONTROL:
+        return msg.data[0].mrid
+    return None
+
+
+def buffer_dispatch( # pylint: disable=too-many-arguments
     buf: RingBuffer,
     action: DispatchAction,
     data: any = None,
     block: bool = True,
     timeout: float = None,
+    *,
+    quiet: bool = False,
 ) -> bool:
     """ Dispatch an action to the dispatcher thread.
 
@@ -53,6 +128,8 @@ def buffer_dispatch(
         data: Any information the specified action needs to take.
         block: Block on attempting to dispatch an action.
         timeout: If blocking, the time to wait for the buffer to unblock.
+        quiet: Do not log or count a failure to dispatch, such as when the
+            caller will retry.
 
     Returns:
         False if the action was not dispatched due to the buffer being closed or
@@ -63,75 +140,231 @@ def buffer_dispatch(
 
     try:
         buf.put(msg, block, timeout)
+        metrics.DISPATCH_ENQUEUED.inc(action.value)
     except (Closed, Full) as e:
-        logging.warning("Could not place on buffer. %s", e)
+        if not quiet:
+            logging.warning("Could not place on buffer. %s", e)
+            _count_dropped(action, e)
         success = False
     return success
 
 
+async def buffer_dispatch_async(
+    buf: RingBuffer | AsyncRingBuffer,
+    action: DispatchAction,
+    data: any = None,
+    timeout: float = None,
+) -> bool:
+    """ Dispatch an action to the dispatcher from the event loop, without
+        blocking the loop while waiting for the buffer.
+
+    Params:
+        buf: The buffer/queue with which to send a message to the dispatcher.
+        action: The action the dispatcher should undertake.
+        data: Any information the specified action needs to take.
+        timeout: The time to wait for the buffer to have a free slot. None
+            waits indefinitely.
+
+    Returns:
+        False if the action was not dispatched due to the buffer being closed or
+            full. True otherwise.
+    """
+    if isinstance(buf, AsyncRingBuffer):
+        try:
+            await buf.aput(DispatchData(action, data), timeout)
+        except (Closed, Full) as e:
+            logging.warning("Could not place on buffer. %s", e)
+            _count_dropped(action, e)
+            return False
+        metrics.DISPATCH_ENQUEUED.inc(action.value)
+        return True
+
+    # Only wait on a thread if the buffer has no free slot
+    if buffer_dispatch(buf, action, data, block=False, quiet=True):
+        return True
+    return await asyncio.to_thread(
+        buffer_dispatch, buf, action, data, True, timeout
+    )
+
+
+def _count_dropped(action: DispatchAction, error: Exception) -> None:
+    reason = "closed" if isinstance(error, Closed) else "full"
+    metrics.DISPATCH_DROPPED.inc(action.value, reason)
+
+
+def _expiry_key(mrid: str, code: str) -> tuple:
+    """ The scheduler key for the expiry of a device's non-default control. """
+    return (DispatchAction.CONTROL_EXPIRE, mrid, code)
+
+
 # Dispatch action handlers
 def init_db():
-    """ Create an sqlite3 database if one does not exist. """
-    if not os.path.exists(SHEMS_DB_PATH):
-        create_database()
+    """ Create an sqlite3 database if one does not exist, and add any tables or
+        indexes missing from an existing one. Status history rings are trimmed
+        to SHEMS_STATUS_HISTORY slots.
+    """
+    create_database()
+    trim_status_history()
+    DEVICE_REGISTRY.clear()
+
+
+def preload():
+    """ Ensure the host is in the device table, then load every known device
+        into DEVICE_REGISTRY.
+    """
+    preload_host()
+    _, cur = db.get_cursor()
+    DEVICE_REGISTRY.load(cur)
+    logging.info("Loaded %d devices", len(DEVICE_REGISTRY))
 
 
 def preload_host():
     """ Ensure that the host running the SHEMS server is present in the SHEMS
         device table.
     """
-    mrid = get_device_mrid()
-    address = str(get_addresses()[0][0])
+    host = get_host()
+    mrid = str(host.mrid)
+    address = str(host.address)
 
-    con, cur = db.get_cursor()
-    res = cur.execute("SELECT * FROM devices WHERE dev_id = ?", (str(mrid),))
+    _, cur = db.get_cursor()
+    res = cur.execute("SELECT description FROM devices WHERE dev_id = ?",
+                      (mrid,)).fetchone()
 
     # Make the host device known
-    if res.fetchall():
+    if res is not None:
+        [description] = res
         query = "UPDATE devices SET last_ip = ? WHERE dev_id = ?"
-        cur.execute(query, (address, str(mrid)))
+        cur.execute(query, (address, mrid))
     else:
+        description = "SHEMS Host controller"
         query = """INSERT INTO devices (dev_id, last_ip, description)
             VALUES (?,?,?)"""
-        cur.execute(query, (str(mrid), address, "SHEMS Host controller"))
+        cur.execute(query, (mrid, address, description))
+
+    # Update device status and its history
+    state = DeviceState(address, description, int(time.time()),
+                        DEVICE_STATUS_ON, None)
+    record_status(mrid, state.reading_time, DEVICE_STATUS_ON)
+    db.mark_changed(Tables.DEVICES, mrid)
+    db.commit()
+    DEVICE_REGISTRY.stored(mrid, state)
+
+
+def handle_host_refresh(scheduler: DispatchScheduler):
+    """ Check if the host's primary address has changed, and if so, update the
+        host in the device table. Reschedules itself to run periodically.
+
+    Params:
+        scheduler: The scheduler to place the next check on.
+    """
+    try:
+        if get_host().refresh():
+            preload_host()
+    finally:
+        scheduler.schedule(
+            DispatchAction.HOST_REFRESH,
+            time.time() + SHEMS_HOST_REFRESH,
+            DispatchAction.HOST_REFRESH,
+            scheduler
+        )
+
+
+def handle_clean_controls(scheduler: DispatchScheduler):
+    """ Remove up to SHEMS_CONTROL_SWEEP_BATCH expired non-default controls,
+        oldest first, and relay the defaults they were overriding. Catches
+        controls that expired while the system was offline, or whose expiry
+        was never dispatched. Reschedules itself shortly while expired
+        controls remain, otherwise after SHEMS_CONTROL_SWEEP.
+
+    Params:
+        scheduler: The scheduler to place the next sweep on.
+    """
+    delay = SHEMS_CONTROL_SWEEP
+    try:
+        _, cur = db.get_cursor()
+        query = """
+            DELETE FROM settings WHERE rowid IN (
+                SELECT rowid FROM settings
+                WHERE is_default = False AND finish_time <= ?
+                ORDER BY finish_time
+                LIMIT ?
+            )
+            RETURNING dev_id, code
+        """
+        expired = cur.execute(
+            query, (time.time(), SHEMS_CONTROL_SWEEP_BATCH)
+        ).fetchall()
+        _relay_defaults(cur, expired)
+        db.commit()
+
+        logging.info("Removed %d expired controls", len(expired))
+        if len(expired) >= SHEMS_CONTROL_SWEEP_BATCH:
+            delay = CONTROL_SWEEP_PAUSE
+    finally:
+        scheduler.schedule(
+            DispatchAction.CONTROL_CLEAN,
+            time.time() + delay,
+            DispatchAction.CONTROL_CLEAN,
+            scheduler
+        )
+
+
+def _relay_defaults(cur: sql.Cursor, expired: list[tuple[str, str]]):
+    """ Relay the default value of each expired control that has one, once
+        the removal of the expired controls is committed.
+
+    Params:
+        cur: The writer's cursor.
+        expired: The mRID and control code of each removed control.
+    """
+    if not expired:
+        return
 
-    # Update device status
     query = """
-        INSERT OR REPLACE INTO status(dev_id, reading_time, connect_status)
-        VALUES (?, ?, ?)
+        SELECT code, value FROM settings
+        WHERE dev_id = ? AND code = ? AND is_default = True
     """
-    cur.execute(query, (str(mrid), int(time.time()), DEVICE_STATUS_ON))
-    con.commit()
+    defaults = [
+        ControlValue(*row) for key in expired
+        for row in cur.execute(query, key).fetchall()
+    ]
+    if defaults:
+        db.on_commit(lambda: _relay_controls(defaults))
 
 
-def handle_clean_controls():
-    """ Remove non-default controls that have expired. Intended to clean the
-        database if the system has been offline for some time.
+def handle_control_restore(scheduler: DispatchScheduler):
+    """ Schedule the expiry of every stored non-default control. Intended to
+        restore pending expiries when the system starts.
+
+    Params:
+        scheduler: The scheduler to place the expiries on.
     """
-    con, cur = db.get_cursor()
+    _, cur = db.get_cursor()
     query = """
-        DELETE FROM settings
-        WHERE finish_time <= ? AND is_default = False
+        SELECT dev_id, code, finish_time
+        FROM settings
+        WHERE is_default = False
     """
-    current_time = time.time()
 
-    cur.execute(query, (current_time,))
-    con.commit()
+    for mrid, control, finish in cur.execute(query).fetchall():
+        scheduler.schedule(
+            _expiry_key(mrid, control),
+            finish,
+            DispatchAction.CONTROL_EXPIRE,
+            (mrid, control)
+        )
 
 
-def handle_control_msg(handler_data: tuple[DefaultControl, RingBuffer]):
+def handle_control_msg(handler_data: tuple[DefaultControl, DispatchScheduler]):
     """ Update the control settings for a DER device in the database.
         TODO: Also inform the DER device via comms.
 
     Params:
-        control: The control object to adjust settings with.
+        handler_data: The control object to adjust settings with, and the
+            scheduler to place the control's expiry on.
     """
-    sent_control, dispatch_buf = handler_data
-    con, cur = db.get_cursor()
-
-    # Find valid device IDs
-    devices = cur.execute("SELECT dev_id FROM devices").fetchall()
-    devices = [mrid[0] for mrid in devices] # Unpack values from tuples
+    sent_control, scheduler = handler_data
+    _, cur = db.get_cursor()
 
     control_values = sent_control.get_values()
     controls, _ = control_values['controls'] # TODO handle curve controls
@@ -139,7 +372,7 @@ def handle_control_msg(handler_data: tuple[DefaultControl, RingBuffer]):
     mrid = control_values['mRID']
 
     # Fail silently if referencing a bad device
-    if mrid not in devices:
+    if mrid not in DEVICE_REGISTRY:
         logging.warning("Got control for unknown device")
         return
 
@@ -169,79 +402,110 @@ def handle_control_msg(handler_data: tuple[DefaultControl, RingBuffer]):
             duration, finish
         ))
 
-        # Schedule removal of control behaviour if needed
+        # Schedule removal of control behaviour if needed. This replaces the
+        # expiry of any control that this one supersedes.
         if not is_default:
-            Timer(
-                finish - time.time(),
-                buffer_dispatch,
-                [dispatch_buf, DispatchAction.CONTROL_EXPIRE, (mrid, control)]
-            ).start()
-    con.commit()
-
-    # Relay the control information
+            scheduler.schedule(
+                _expiry_key(mrid, control),
+                finish,
+                DispatchAction.CONTROL_EXPIRE,
+                (mrid, control)
+            )
+    db.commit()
+
+    # Relay the control once it is stored, outside of the write lock
+    db.on_commit(lambda: _relay_controls(controls))
+
+
+def _relay_controls(controls: list[ControlValue]):
+    """ Relay control values to devices, locally and remotely. """
+    # Relay the control information locally
     for control, value in controls:
-        # Locally
         try:
             writeout(control, value)
         except OSError as e:
             logging.error("Error in relaying information locally. %s", e)
-        # Remotely
-        try:
-            print(topic_from_control(control))
-            publish_mqtt(topic_from_control(control), value)
-        except OSError as e:
-            logging.error("Error in relaying information remotely. %s", e)
+
+    # Relay the control information remotely, as a single exchange
+    try:
+        publish_many([
+            (topic_from_control(control), value) for control, value in controls
+        ])
+    except OSError as e:
+        logging.error("Error in relaying information remotely. %s", e)
 
 
 def handle_control_revert(control_data: tuple[str]):
-    """ Remove a non-default control from the control settings table.
-        TODO also inform the device of the change.
+    """ Remove a non-default control from the control settings table, and
+        relay the default value it was overriding.
 
     Params:
         control_data: The mRID and control code to be removed.
     """
-    con, cur = db.get_cursor()
+    _, cur = db.get_cursor()
+    # Only remove the control if it has finished, in case a superseding
+    # control was stored after this expiry was dispatched
     query = """
         DELETE FROM settings
         WHERE dev_id = ? AND code = ? AND is_default = False
+            AND finish_time <= ?
+        RETURNING dev_id, code
     """
-    cur.execute(query, control_data)
-    con.commit()
+    expired = cur.execute(query, (*control_data, time.time())).fetchall()
+    _relay_defaults(cur, expired)
+    db.commit()
 
 
 def handle_listener_dev(dev_data: tuple[str]):
     """ Update the status of a device based on a listener's received message.
-        This will update the device and status tables.
+        This will update the device, status and status history tables. If only
+        the reading time has changed since the device's last announcement, the
+        update is held in DEVICE_REGISTRY until the next state flush.
     """
     mrid, last_ip, description, read_time, *dev_data = dev_data
     charge_state = None
     if dev_data:
         [charge_state] = dev_data
         charge_state = float(charge_state)
+    state = DeviceState(last_ip, description, float(read_time),
+                        DEVICE_STATUS_ON, charge_state)
+
+    known = DEVICE_REGISTRY.get(mrid)
+    if (SHEMS_STATE_FLUSH > 0 and known is not None
+            and known._replace(reading_time=state.reading_time) == state):
+        if state.reading_time > known.reading_time:
+            DEVICE_REGISTRY.defer(mrid, state)
+        return
 
-    con, cur = db.get_cursor()
+    # An announcement read before the latest known state is only history
+    newer = (known is None or known.reading_time is None
+             or state.reading_time >= known.reading_time)
+    _, cur = db.get_cursor()
 
     # Update device
-    query = """
-        INSERT OR REPLACE INTO devices(dev_id, last_ip, description)
-        VALUES (?, ?, ?)
-    """
-    cur.execute(query, (mrid, last_ip, description))
+    if newer and (known is None or (known.last_ip, known.description)
+                  != (last_ip, description)):
+        query = """
+            INSERT OR REPLACE INTO devices(dev_id, last_ip, description)
+            VALUES (?, ?, ?)
+        """
+        cur.execute(query, (mrid, last_ip, description))
 
-    # Update device status
-    query = """
-        INSERT OR REPLACE INTO status(
-            dev_id, reading_time, connect_status, charge_state
-        )
-        VALUES (?, ?, ?, ?)
-    """
-    cur.execute(query, (mrid, float(read_time), DEVICE_STATUS_ON, charge_state))
-    con.commit()
+    # Update device status and its history
+    latest = record_status(mrid, state.reading_time, DEVICE_STATUS_ON,
+                           charge_state)
+    db.mark_changed(Tables.DEVICES, mrid)
+    db.commit()
+    # Registered now rather than on commit, so the device's items later in
+    # the same batch find it. The handler has not raised by this point, so
+    # its writes are kept.
+    if newer and latest:
+        DEVICE_REGISTRY.stored(mrid, state)
 
 
 def handle_listener_alarm(alarm_data: tuple[str]):
     """ Store the occurrence of a device alarm. This will update the status
-        table as well as the alarm table.
+        table as well as the alarm history and summary tables.
 
         NOTE: In future, additional actions can be placed after the table
         updates to handle the alarm outcomes.
@@ -252,30 +516,117 @@ def handle_listener_alarm(alarm_data: tuple[str]):
         [charge_state] = alarm_data
         charge_state = float(charge_state)
 
-    con, cur = db.get_cursor()
+    # Ensure device is known
+    if mrid not in DEVICE_REGISTRY:
+        logging.warning("Got alarm for unknown device '%s'", mrid)
+        return
+
+    # Update device status and its history
+    read_time = float(read_time)
+    latest = record_status(mrid, read_time, DEVICE_STATUS_ON, charge_state)
+    db.mark_changed(Tables.DEVICES, mrid)
+
+    # Add alarm, and count it in the device's alarm summary. Raises for a
+    # repeated alarm, rolling back the status too.
+    store_alarm(mrid, code, read_time, value)
+
+    # The alarm's status replaces any older one held by DEVICE_REGISTRY, now
+    # that every write has succeeded
+    if latest:
+        DEVICE_REGISTRY.status_stored(mrid, read_time, DEVICE_STATUS_ON,
+                                      charge_state)
+
+
+def handle_listener_readings(readings_data: tuple):
+    """ Store a batch of meter readings received by the listener, and add them
+        to the downsampled tiers.
+
+    Params:
+        readings_data: The mRID, measured code, first sample time, seconds
+            between samples, and the samples.
+    """
+    mrid, code, start, interval, samples = readings_data
 
     # Ensure device is known
-    res = cur.execute("SELECT * FROM devices WHERE dev_id = ?", (str(mrid),))
-    if not res.fetchall():
-        logging.warning("Got alarm for unknown device '%e'", mrid)
+    if mrid not in DEVICE_REGISTRY:
+        logging.warning("Got readings for unknown device '%s'", mrid)
         return
 
-    # Update device status
-    query = """
-        INSERT OR REPLACE INTO status(
-            dev_id, reading_time, connect_status, charge_state
+    if not store_readings(mrid, code, start, interval, samples):
+        logging.info("Ignored repeated readings from '%s' at %s", mrid, start)
+
+
+def handle_readings_prune(scheduler: DispatchScheduler):
+    """ Remove meter readings older than their tier's retention. Reschedules
+        itself to run periodically.
+
+    Params:
+        scheduler: The scheduler to place the next prune on.
+    """
+    try:
+        removed = prune_readings(time.time())
+        logging.info("Pruned %d rows of readings", removed)
+    finally:
+        scheduler.schedule(
+            DispatchAction.READINGS_PRUNE,
+            time.time() + SHEMS_READING_PRUNE,
+            DispatchAction.READINGS_PRUNE,
+            scheduler
         )
-        VALUES (?, ?, ?, ?)
+
+
+def handle_alarms_prune(scheduler: DispatchScheduler):
+    """ Remove alarms older than SHEMS_ALARM_RETENTION, a chunk at a time so
+        other items are not held up behind a long delete. Reschedules itself
+        shortly while a backlog remains, otherwise after SHEMS_ALARM_PRUNE.
+
+    Params:
+        scheduler: The scheduler to place the next prune on.
     """
-    cur.execute(query, (mrid, float(read_time), DEVICE_STATUS_ON, charge_state))
+    delay = SHEMS_ALARM_PRUNE
+    try:
+        removed = prune_alarms(
+            time.time() - SHEMS_ALARM_RETENTION,
+            SHEMS_ALARM_PRUNE_CHUNK
+        )
+        logging.info("Pruned %d alarms", removed)
+        if removed >= SHEMS_ALARM_PRUNE_CHUNK:
+            delay = ALARM_PRUNE_PAUSE
+    finally:
+        scheduler.schedule(
+            DispatchAction.ALARMS_PRUNE,
+            time.time() + delay,
+            DispatchAction.ALARMS_PRUNE,
+            scheduler
+        )
 
-    # Add alarm
-    query = """
-        INSERT INTO alarms(dev_id, code, reading_time, value)
-        VALUES (?, ?, ?, ?)
+
+def handle_state_flush(scheduler: DispatchScheduler = None):
+    """ Write out the device states held in DEVICE_REGISTRY since the last
+        flush. Reschedules itself to run every SHEMS_STATE_FLUSH seconds if
+        given a scheduler.
+
+    Params:
+        scheduler: The scheduler to place the next flush on, or None for a
+            final flush at shutdown.
     """
-    cur.execute(query, (mrid, code, float(read_time), value))
-    con.commit()
+    try:
+        pending = DEVICE_REGISTRY.dirty()
+        for mrid, state in pending.items():
+            record_status(mrid, state.reading_time, state.connect_status,
+                          state.charge_state)
+            db.mark_changed(Tables.DEVICES, mrid)
+        db.commit()
+        db.on_commit(lambda: DEVICE_REGISTRY.flushed(pending))
+        logging.info("Flushed the state of %d devices", len(pending))
+    finally:
+        if scheduler is not None and SHEMS_STATE_FLUSH > 0:
+            scheduler.schedule(
+                DispatchAction.STATE_FLUSH,
+                time.time() + SHEMS_STATE_FLUSH,
+                DispatchAction.STATE_FLUSH,
+                scheduler
+            )
 
 
 # Action to handler mapping
@@ -283,9 +634,15 @@ DISPATCH_ACTIONS: dict[DispatchAction, Callable] = {
     DispatchAction.CONTROL: handle_control_msg,
     DispatchAction.CONTROL_CLEAN: handle_clean_controls,
     DispatchAction.CONTROL_EXPIRE: handle_control_revert,
+    DispatchAction.CONTROL_RESTORE: handle_control_restore,
     DispatchAction.LISTEN_RECV_DEV: handle_listener_dev,
     DispatchAction.LISTEN_RECV_ALARM: handle_listener_alarm,
+    DispatchAction.LISTEN_RECV_READINGS: handle_listener_readings,
+    DispatchAction.READINGS_PRUNE: handle_readings_prune,
+    DispatchAction.ALARMS_PRUNE: handle_alarms_prune,
+    DispatchAction.STATE_FLUSH: handle_state_flush,
     DispatchAction.DB_INIT: init_db,
-    DispatchAction.PRELOAD: preload_host,
+    DispatchAction.PRELOAD: preload,
+    DispatchAction.HOST_REFRESH: handle_host_refresh,
 }
 
@@ -1,69 +1,409 @@
+import asyncio
 import logging
+import sqlite3 as sql
+import threading
+import time
+import zlib
+from concurrent.futures import Executor
+from queue import Empty
 from typing import Any, Callable
 
-from common.ring_buffer import NotifyBufferFinish, RingBuffer
+from common import metrics
+from common.env_vars import DISPATCH_BARRIER_WARN
+from common.env_vars import DISPATCH_BATCH_SIZE, DISPATCH_BATCH_WAIT
+from common.env_vars import DISPATCH_CONTROL_SIZE, DISPATCH_LANE_WEIGHTS
+from common.env_vars import DISPATCH_PRIORITY, DISPATCH_SIZE
+from common.env_vars import DISPATCH_TELEMETRY_OVERFLOW
+from common.env_vars import DISPATCH_TELEMETRY_SIZE, DISPATCH_WORKERS
+from common.env_vars import SHEMS_HANDLER_RING
+from common.profiler import TimingRing
+from common.ring_buffer import AsyncRingBuffer, Lane, LaneBuffer
+from common.ring_buffer import NotifyBufferFinish, Overflow, RingBuffer
 from common.thread_control import ThreadCloser
-from dispatch.actions import DISPATCH_ACTIONS, DispatchAction
+from dispatch.actions import DISPATCH_ACTIONS, DispatchAction, DispatchData
+from dispatch.actions import dispatch_key, dispatch_lane, DispatchLane
+from dispatch.state import DEVICE_REGISTRY
+import database.access as db
+
+# Constants
+# Actions that manage their own database connections, so must not run while
+# the writer holds a batch transaction open.
+UNBATCHED_ACTIONS = {DispatchAction.DB_INIT}
+
+# Recent wall and CPU times of each action's handler
+HANDLER_TIMINGS = TimingRing(SHEMS_HANDLER_RING)
+
+
+# Classes
+class DispatchBarrier():
+    """ Placed on every worker's buffer to pause the workers, once they have
+        handled everything placed before it, while an action over every
+        device runs. The action never runs alongside a worker, so the router
+        waits for as long as a worker takes to arrive, warning every
+        DISPATCH_BARRIER_WARN seconds.
+    """
+    def __init__(
+        self,
+        workers: int,
+        warn_after: float = DISPATCH_BARRIER_WARN,
+    ) -> None:
+        self._workers = workers
+        self._warn_after = warn_after
+        self._arrived = 0
+        self._condition = threading.Condition()
+        self._released = threading.Event()
+
+    def hold(self) -> None:
+        """ Called by a worker. Wait until the barrier's action has run. """
+        with self._condition:
+            self._arrived += 1
+            self._condition.notify()
+        self._released.wait()
+
+    def run(self, batch: list[DispatchData]) -> None:
+        """ Called by the router. Wait for every worker to reach the barrier,
+            dispatch the batch, then release the workers.
+        """
+        waited = 0.0
+        with self._condition:
+            while not self._condition.wait_for(
+                lambda: self._arrived == self._workers, self._warn_after
+            ):
+                waited += self._warn_after
+                logging.warning(
+                    "Dispatcher barrier has waited %.0fs for %d of %d workers",
+                    waited, self._workers - self._arrived, self._workers
+                )
+
+        try:
+            dispatch_batch(batch)
+        finally:
+            self._released.set()
+
 
 # Functions
+def create_dispatch_buffer() -> LaneBuffer:
+    """ Create the dispatcher's buffer, with a lane per DispatchLane. Controls
+        always wait for a free slot rather than being dropped. A full
+        telemetry lane follows DISPATCH_TELEMETRY_OVERFLOW, which sheds the
+        oldest telemetry by default.
+
+    Raises:
+        ValueError: If the lane configuration is invalid.
+    """
+    weights = [int(weight) for weight in DISPATCH_LANE_WEIGHTS.split(',')]
+    if len(weights) != len(DispatchLane) or min(weights) < 1:
+        raise ValueError(
+            f"DISPATCH_LANE_WEIGHTS needs {len(DispatchLane)} positive weights"
+        )
+    if DISPATCH_PRIORITY not in ('strict', 'weighted'):
+        raise ValueError("DISPATCH_PRIORITY must be 'strict' or 'weighted'")
+
+    lanes = {
+        DispatchLane.CONTROL: (DISPATCH_CONTROL_SIZE, Overflow.BLOCK),
+        DispatchLane.TELEMETRY: (
+            DISPATCH_TELEMETRY_SIZE, Overflow(DISPATCH_TELEMETRY_OVERFLOW)
+        ),
+    }
+    return LaneBuffer(
+        [Lane(*lanes[lane], weights[lane]) for lane in DispatchLane],
+        dispatch_lane,
+        DISPATCH_PRIORITY == 'weighted'
+    )
+
+
 def _action_lookup(action: DispatchAction) -> Callable:
     return DISPATCH_ACTIONS[action]
 
 
-# Dispatch Thread
-def dispatcher_t(
-    buffer: RingBuffer,
-    closer: ThreadCloser,
-) -> None:
-    """ Thread to handle performing operations other than server requests. """
-    logging.info("Starting dispatcher")
-    while not closer.is_killed():
-        # Wait until thread is active
-        closer.wait()
+def _collect_batch(
+    buffer: RingBuffer | LaneBuffer
+) -> tuple[list[DispatchData], bool]:
+    """ Wait for an item to dispatch, then keep draining the buffer until
+        DISPATCH_BATCH_SIZE items are held or DISPATCH_BATCH_WAIT milliseconds
+        have passed.
 
-        # Wait for an item to dispatch
-        msg = buffer.get()
+    Returns:
+        The items to dispatch, and False if the buffer has been told to finish.
+    """
+    batch = []
+    msgs = buffer.get_many(DISPATCH_BATCH_SIZE)
+    deadline = time.monotonic() + DISPATCH_BATCH_WAIT / 1000
 
-        # Check for thread shutdown
+    while True:
+        for msg in msgs:
+            # Check for thread shutdown. The sentinel is always the last item.
+            if isinstance(msg, NotifyBufferFinish):
+                buffer.confirm_sentinel(msg)
+                return batch, False
+            batch.append(msg)
+
+        remaining = deadline - time.monotonic()
+        if len(batch) >= DISPATCH_BATCH_SIZE or remaining <= 0:
+            return batch, True
+
+        try:
+            msgs = buffer.get_many(DISPATCH_BATCH_SIZE - len(batch),
+                                   timeout=remaining)
+        except Empty:
+            return batch, True
+
+
+async def _collect_batch_async(
+    buffer: AsyncRingBuffer
+) -> tuple[list[DispatchData], bool]:
+    """ Equivalent of `_collect_batch` for an AsyncRingBuffer. """
+    batch = []
+    msg = await buffer.get()
+    deadline = time.monotonic() + DISPATCH_BATCH_WAIT / 1000
+
+    while True:
+        # Check for dispatcher shutdown
         if isinstance(msg, NotifyBufferFinish):
             buffer.confirm_sentinel(msg)
-            break
+            return batch, False
 
-        action, data = msg
-        # Attempt to get the correct handler
-        try:
-            action_handler = _action_lookup(action)
-            if action_handler is None:
-                continue
-        except ValueError as e:
-            logging.warning("Invalid action given. %s", e)
-            continue
+        batch.append(msg)
+        remaining = deadline - time.monotonic()
+        if len(batch) >= DISPATCH_BATCH_SIZE or remaining <= 0:
+            return batch, True
 
-        # Dispatch based on received message
         try:
-            action_handler = log_handler(action_handler, data)
+            msg = await buffer.get(timeout=remaining)
+        except Empty:
+            return batch, True
+
+
+def _dispatch(msg: DispatchData) -> None:
+    """ Run the handler for a single dispatched item. Any writes the handler
+        makes are rolled back on error, without affecting the rest of a batch.
+    """
+    action, data = msg
+    # Attempt to get the correct handler
+    try:
+        action_handler = _action_lookup(action)
+        if action_handler is None:
+            return
+    except (KeyError, ValueError) as e:
+        logging.warning("Invalid action given. %s", e)
+        return
+
+    # Dispatch based on received message
+    start = time.perf_counter()
+    try:
+        action_handler = log_handler(action_handler, data, action)
+        with db.savepoint():
             if data:
                 action_handler(data)
             else:
                 action_handler()
-        except Exception as e:
-            # Want to ensure thread remains operational, so no errors should
-            # be raised.
-            logging.error(
-                "Error in executing action '%s' with '%s'. %s",
-                action, action_handler, e
-            )
-            continue
+    except Exception as e: # pylint: disable=broad-exception-caught
+        # Want to ensure thread remains operational, so no errors should
+        # be raised.
+        logging.error(
+            "Error in executing action '%s' with '%s'. %s",
+            action, action_handler, e
+        )
+        metrics.DISPATCH_ERRORS.inc(action.value)
+    finally:
+        metrics.DISPATCH_DEQUEUED.inc(action.value)
+        metrics.DISPATCH_HANDLER_SECONDS.observe(
+            time.perf_counter() - start,
+            action.value
+        )
+
+
+def _dispatch_transaction(batch: list[DispatchData]) -> None:
+    """ Dispatch each item of a batch, committing all of their writes once. """
+    if not batch:
+        return
+
+    try:
+        with db.transaction():
+            for msg in batch:
+                _dispatch(msg)
+    # Includes errors from on_commit callbacks, which must not stop the thread
+    except Exception as e: # pylint: disable=broad-exception-caught
+        logging.error("Error in committing %d dispatched items. %s",
+                      len(batch), e)
+        _reload_registry()
+
+
+def _reload_registry() -> None:
+    """ Reload DEVICE_REGISTRY from the database, after a failed commit has
+        rolled back writes that handlers already recorded in it. States held
+        for the next flush are lost.
+    """
+    try:
+        _, cur = db.get_cursor()
+        DEVICE_REGISTRY.load(cur)
+    except sql.Error as e:
+        logging.error("Error in reloading the device registry. %s", e)
+
+
+def dispatch_batch(batch: list[DispatchData]) -> None:
+    """ Dispatch a batch of items in order. Items are grouped into as few
+        transactions as possible, split around any unbatched actions.
+    """
+    pending = []
+    for msg in batch:
+        if isinstance(msg, DispatchBarrier):
+            _dispatch_transaction(pending)
+            pending = []
+            msg.hold()
+        elif msg.action in UNBATCHED_ACTIONS:
+            _dispatch_transaction(pending)
+            pending = []
+            _dispatch(msg)
+        else:
+            pending.append(msg)
+
+    _dispatch_transaction(pending)
+
+
+# Dispatch Thread
+def dispatcher_t(
+    buffer: RingBuffer | LaneBuffer,
+    closer: ThreadCloser,
+) -> None:
+    """ Thread to handle performing operations other than server requests.
+        With DISPATCH_WORKERS above one, items are handed to a pool of
+        workers instead.
+    """
+    if DISPATCH_WORKERS > 1:
+        _dispatcher_pool_t(buffer, closer, DISPATCH_WORKERS)
+        return
+
+    logging.info("Starting dispatcher")
+    _dispatch_loop(buffer, closer)
 
     # Thread closing - cleanup
     logging.info("Closing dispatcher")
 
 
-def log_handler(func: Callable, data: Any) -> Callable:
-    """ Wrap the given function with a helper to log the function result. """
+def _dispatch_loop(
+    buffer: RingBuffer | LaneBuffer,
+    closer: ThreadCloser,
+) -> None:
+    """ Dispatch batches from a buffer until it is told to finish. """
+    running = True
+    while running and not closer.is_killed():
+        # Wait until thread is active
+        closer.wait()
+
+        # Wait for items to dispatch
+        batch, running = _collect_batch(buffer)
+        dispatch_batch(batch)
+
+
+def _shard(key: str, workers: int) -> int:
+    """ The worker for a device, stable for the life of the process. """
+    return zlib.crc32(key.encode()) % workers
+
+
+def _dispatcher_pool_t(
+    buffer: RingBuffer | LaneBuffer,
+    closer: ThreadCloser,
+    workers: int,
+) -> None:
+    """ Route items to a pool of worker threads by device mRID, so each
+        device's items are handled in order while different devices are
+        handled in parallel. Each worker writes through its own connection.
+        Actions over every device run on this thread once every worker is
+        idle, as a barrier.
+    """
+    logging.info("Starting dispatcher with %d workers", workers)
+    shards = [RingBuffer(DISPATCH_SIZE, overlap=False) for _ in range(workers)]
+    threads = []
+    for index, shard in enumerate(shards):
+        shard_closer = ThreadCloser()
+        shard_closer.set_active()
+        thread = threading.Thread(
+            target=_dispatch_loop,
+            args=(shard, shard_closer),
+            name=f"dispatcher-{index}"
+        )
+        thread.start()
+        threads.append(thread)
+
+    running = True
+    while running and not closer.is_killed():
+        closer.wait()
+        batch, running = _collect_batch(buffer)
+
+        routed = [[] for _ in shards]
+        for msg in batch:
+            key = dispatch_key(msg)
+            if key is not None:
+                routed[_shard(key, workers)].append(msg)
+                continue
+
+            # Hand over everything before the barrier, then wait on it
+            _route(shards, routed)
+            barrier = DispatchBarrier(workers)
+            for shard in shards:
+                shard.put(barrier)
+            barrier.run([msg])
+        _route(shards, routed)
+
+    # Pool closing - cleanup once workers finish their items
+    for shard in shards:
+        shard.notify_finish()
+    for thread in threads:
+        thread.join()
+    logging.info("Closing dispatcher")
+
+
+def _route(shards: list[RingBuffer], routed: list[list]) -> None:
+    for shard, msgs in zip(shards, routed):
+        if msgs:
+            shard.put_many(msgs)
+            msgs.clear()
+
+
+# Dispatch Task
+async def dispatcher_a(
+    buffer: AsyncRingBuffer,
+    executor: Executor,
+) -> None:
+    """ Event loop equivalent of `dispatcher_t`. Batches are collected on the
+        event loop, and their blocking database work is run on the executor.
+        The executor should have a single worker, as only one thread may write
+        at a time.
+    """
+    logging.info("Starting async dispatcher")
+    loop = asyncio.get_running_loop()
+    running = True
+    while running:
+        # Wait for items to dispatch
+        batch, running = await _collect_batch_async(buffer)
+        if batch:
+            await loop.run_in_executor(executor, dispatch_batch, batch)
+
+    # Task closing - cleanup
+    logging.info("Closing async dispatcher")
+
+
+def log_handler(
+    func: Callable,
+    data: Any,
+    action: DispatchAction = None,
+) -> Callable:
+    """ Wrap the given function with a helper to log the function call, and
+        record its wall and CPU time in HANDLER_TIMINGS against the action.
+    """
+    name = action.value if action is not None else func.__name__
+
     def wrapper(*args):
         logging.info("Performing '%s' with data '%s'", func.__name__, data)
-        return func(*args)
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            return func(*args)
+        finally:
+            HANDLER_TIMINGS.record(
+                name,
+                time.perf_counter() - wall,
+                time.thread_time() - cpu
+            )
 
     return wrapper
-
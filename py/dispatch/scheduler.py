@@ -0,0 +1,161 @@
+"""
+File: dispatch/scheduler.py
+Email: e.roderick@uqconnect.edu.au
+Description: A single scheduler thread that dispatches actions once they are
+    due. Pending actions are held in a min-heap ordered by due time, so the
+    number of threads stays fixed however many actions are outstanding.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from typing import Any, Hashable, Optional
+
+from common.ring_buffer import RingBuffer
+from common.thread_control import ThreadCloser
+from dispatch.actions import buffer_dispatch, DispatchAction, DispatchData
+
+# Constants
+_REMOVED = object() # Placeholder key for cancelled heap entries
+
+
+# Classes
+class DispatchScheduler():
+    """ A set of actions to dispatch at given times. Each scheduled action has
+        a key, and scheduling an action with a key that is already pending
+        replaces the pending action.
+    """
+    def __init__(self, buffer: RingBuffer) -> None:
+        """ Construct a dispatch scheduler.
+
+        Params:
+            buffer: The buffer to place actions on once they are due.
+        """
+        self._buffer = buffer
+        self._heap = []
+        self._entries = {}
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._closed = False
+
+    @property
+    def buffer(self) -> RingBuffer:
+        """ (RingBuffer) The buffer that due actions are placed on. """
+        return self._buffer
+
+    def schedule(
+        self,
+        key: Hashable,
+        due: float,
+        action: DispatchAction,
+        data: Any = None,
+    ) -> None:
+        """ Schedule an action to be dispatched, replacing any pending action
+            with the same key.
+
+        Params:
+            key: Identifies the scheduled action for cancellation.
+            due: The timestamp (seconds since the epoch) to dispatch at.
+            action: The action the dispatcher should undertake.
+            data: Any information the specified action needs to take.
+        """
+        entry = [due, next(self._counter), key, action, data]
+        with self._cond:
+            self._remove(key)
+            self._entries[key] = entry
+            heapq.heappush(self._heap, entry)
+
+            # Wake the scheduler thread if this is now the earliest action
+            if self._heap[0] is entry:
+                self._cond.notify()
+
+    def cancel(self, key: Hashable) -> bool:
+        """ Cancel a pending action.
+
+        Returns:
+            True if an action was pending for the key. False otherwise.
+        """
+        with self._cond:
+            return self._remove(key)
+
+    def _remove(self, key: Hashable) -> bool:
+        """ Mark the entry for a key as removed. The entry is discarded once it
+            reaches the top of the heap. Requires the lock to be held.
+        """
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+
+        entry[2] = _REMOVED
+        # Rebuild if cancelled entries make up most of the heap
+        if len(self._heap) > 2 * len(self._entries) + 16:
+            self._heap = [e for e in self._heap if e[2] is not _REMOVED]
+            heapq.heapify(self._heap)
+        return True
+
+    def pending(self) -> int:
+        """ (int) The number of actions waiting to be dispatched. """
+        with self._cond:
+            return len(self._entries)
+
+    def close(self) -> None:
+        """ Stop waiting for actions. Pending actions are discarded. """
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def wait_due(self) -> Optional[list[DispatchData]]:
+        """ Block until at least one action is due, then remove and return all
+            due actions in due order.
+
+        Returns:
+            The due actions, or None if the scheduler has been closed.
+        """
+        with self._cond:
+            while not self._closed:
+                # Discard cancelled entries
+                while self._heap and self._heap[0][2] is _REMOVED:
+                    heapq.heappop(self._heap)
+
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+
+                delay = self._heap[0][0] - time.time()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+
+                due = []
+                while self._heap and self._heap[0][0] <= time.time():
+                    _, _, key, action, data = heapq.heappop(self._heap)
+                    if key is not _REMOVED:
+                        del self._entries[key]
+                        due.append(DispatchData(action, data))
+                return due
+
+        return None
+
+
+# Scheduler Thread
+def scheduler_t(
+    scheduler: DispatchScheduler,
+    closer: ThreadCloser,
+) -> None:
+    """ Thread to dispatch scheduled actions once they are due. """
+    logging.info("Starting scheduler")
+    while not closer.is_killed():
+        # Wait until thread is active
+        closer.wait()
+
+        due = scheduler.wait_due()
+        if due is None:
+            break
+
+        for action, data in due:
+            buffer_dispatch(scheduler.buffer, action, data)
+
+    # Thread closing - cleanup
+    logging.info("Closing scheduler")
@@ -0,0 +1,126 @@
+"""
+File: dispatch/state.py
+Email: e.roderick@uqconnect.edu.au
+Description: The registry of known devices and their latest state, held by the
+    dispatcher. It is loaded from the database at preload and kept current by
+    the listener handlers, so checking whether a device is known needs no
+    query. Announcements that change nothing but the reading time are absorbed
+    here instead of rewriting the devices and status rows, and are written out
+    together every SHEMS_STATE_FLUSH seconds and at shutdown.
+"""
+
+import sqlite3 as sql
+import threading
+from typing import Iterator, NamedTuple, Optional
+
+
+# Classes
+class DeviceState(NamedTuple):
+    """ A device's fields as last stored or announced. The status fields are
+        None for a device that has never reported its status.
+    """
+    last_ip: str
+    description: str
+    reading_time: Optional[float]
+    connect_status: Optional[int]
+    charge_state: Optional[float]
+
+
+class DeviceRegistry():
+    """ The known devices, and the latest state of each, by mRID. States are
+        replaced rather than modified, so a flushed state can be told apart
+        from a newer one.
+    """
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._states: dict[str, DeviceState] = {}
+        self._dirty: dict[str, DeviceState] = {}
+
+    def __contains__(self, mrid: str) -> bool:
+        return mrid in self._states
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._states))
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def get(self, mrid: str) -> Optional[DeviceState]:
+        """ The latest state of a device, or None if it is not known. """
+        return self._states.get(mrid)
+
+    def load(self, cur: sql.Cursor) -> None:
+        """ Replace the registry with the devices and statuses in the
+            database, discarding any states waiting to be written.
+        """
+        rows = cur.execute(
+            """SELECT dev_id, last_ip, description, reading_time,
+                    connect_status, charge_state
+                FROM devices LEFT JOIN status USING (dev_id)
+            """
+        )
+        states = {mrid: DeviceState(*state) for mrid, *state in rows}
+        with self._lock:
+            self._states = states
+            self._dirty.clear()
+
+    def stored(self, mrid: str, state: DeviceState) -> None:
+        """ Record a state that has been written to the database. """
+        with self._lock:
+            self._states[mrid] = state
+            self._dirty.pop(mrid, None)
+
+    def status_stored(
+        self,
+        mrid: str,
+        reading_time: float,
+        connect_status: int,
+        charge_state: Optional[float],
+    ) -> None:
+        """ Record a status of a known device that has been written to the
+            database, replacing any state read before it, including one
+            waiting to be written.
+        """
+        with self._lock:
+            state = self._states.get(mrid)
+            if state is None or (state.reading_time is not None
+                                 and reading_time < state.reading_time):
+                return
+            self._states[mrid] = state._replace(
+                reading_time=reading_time,
+                connect_status=connect_status,
+                charge_state=charge_state
+            )
+            self._dirty.pop(mrid, None)
+
+    def defer(self, mrid: str, state: DeviceState) -> None:
+        """ Record a state that has not yet been written to the database. """
+        with self._lock:
+            self._states[mrid] = state
+            self._dirty[mrid] = state
+
+    def dirty(self) -> dict[str, DeviceState]:
+        """ (dict) A copy of the states waiting to be written, by mRID. """
+        with self._lock:
+            return dict(self._dirty)
+
+    def flushed(self, states: dict[str, DeviceState]) -> None:
+        """ Mark states from `dirty` as written, unless they have since been
+            replaced by a newer state.
+        """
+        with self._lock:
+            for mrid, state in states.items():
+                if self._dirty.get(mrid) is state:
+                    del self._dirty[mrid]
+
+    def clear(self) -> None:
+        """ Forget every state, including those not yet written. """
+        with self._lock:
+            self._states.clear()
+            self._dirty.clear()
+
+
+# Constants
+# Shared by every dispatcher worker. Each device is only handled by one
+# worker, so a device's state is never replaced by two threads at once.
+DEVICE_REGISTRY = DeviceRegistry()
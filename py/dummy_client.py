@@ -18,6 +18,21 @@ MQTT_TOPIC_DEVICE = "shem/dev/"
 MQTT_TOPIC_ALARM= "shem/alm/"
 DEVICE_ID = "demo_shems_client"
 
+def device_message(
+    dev_id: str,
+    ip: str,
+    description: str,
+    charge: float
+) -> str:
+    """ Format a device status message for the MQTT_TOPIC_DEVICE topic. """
+    return f'{dev_id},{ip},{description},{time.time()},{charge}'
+
+
+def alarm_message(dev_id: str, code: str, value: float, charge: float) -> str:
+    """ Format a device alarm message for the MQTT_TOPIC_ALARM topic. """
+    return f'{dev_id},{code},{time.time()},{value},{charge}'
+
+
 def alarm_cb(client):
     """ Callback to change LEDs and send an alarm to MQTT broker """
     print("Sending alarm")
@@ -26,7 +41,7 @@ def alarm_cb(client):
     # Enable red LED
     os.system("/shems/rpi-utils/led-red-on.sh")
     # Send charge alarm
-    alarm_data = f'{DEVICE_ID},opChargeStatus,{time.time()},0.25,0.25'
+    alarm_data = alarm_message(DEVICE_ID, 'opChargeStatus', 0.25, 0.25)
     client.publish(MQTT_TOPIC_ALARM, alarm_data)
 
 
@@ -64,7 +79,12 @@ def main():
     client.connect(broker_addr, MQTT_PORT)
 
     # Notify controller of device existence
-    data = f'{DEVICE_ID},192.168.10.10,A demo shems device,{time.time()},0.98'
+    data = device_message(
+        DEVICE_ID,
+        '192.168.10.10',
+        'A demo shems device',
+        0.98
+    )
     client.publish(MQTT_TOPIC_DEVICE, data)
 
     # Wait for messages
@@ -8,21 +8,37 @@ import logging
 
 import paho.mqtt.client as mqtt
 
+from common import metrics
 from common.env_vars import MQTT_ADDR, MQTT_PORT
 from common.ring_buffer import RingBuffer
 from common.thread_control import ThreadCloser
 from dispatch.actions import buffer_dispatch, DispatchAction
+from relay.payload import decode_alarm, decode_device, decode_readings
 from relay.remote import MQTT_TOPIC_ALARM, MQTT_TOPIC_DEVICE
-from shems.mrid import get_device_mrid
+from relay.remote import MQTT_TOPIC_READINGS
+from shems.host import get_host
 
 
 # Constants
 SENTINEL_TOPIC = "listener/sentinel"
-TOPICS = [SENTINEL_TOPIC, MQTT_TOPIC_ALARM, MQTT_TOPIC_DEVICE]
+TOPICS = [
+    SENTINEL_TOPIC,
+    MQTT_TOPIC_ALARM,
+    MQTT_TOPIC_DEVICE,
+    MQTT_TOPIC_READINGS,
+]
 
 MQTT_TIMEOUT = 1
 
-DATA_DELIMITER = ','
+# Payload decoders, by topic, and the action to dispatch the result with
+DECODERS = {
+    MQTT_TOPIC_ALARM: (decode_alarm, DispatchAction.LISTEN_RECV_ALARM),
+    MQTT_TOPIC_DEVICE: (decode_device, DispatchAction.LISTEN_RECV_DEV),
+    MQTT_TOPIC_READINGS: (
+        decode_readings,
+        DispatchAction.LISTEN_RECV_READINGS
+    ),
+}
 
 
 # Listener Thread
@@ -36,7 +52,7 @@ def mqtt_listener_t(
     logging.info("Starting MQTT listener")
 
     # Create MQTT client
-    client_id = f"{get_device_mrid()}_listener" # Add to mRID for disambiguation
+    client_id = f"{get_host().mrid}_listener" # Add to mRID for disambiguation
     client = mqtt.Client(client_id)
     client.on_connect = _on_connect
     client.on_message = _on_message
@@ -77,29 +93,29 @@ def _on_connect(client: mqtt.Client, userdata, flags, ret_val: int):
 def _on_message(client: mqtt.Client, userdata, msg):
     """ Callback for PUBLISH message received from broker. Of note in the
         received data is `msg.topic`, and the `msg.payload`, which is a byte
-        string.
+        string in either the text or binary layout of `relay.payload`.
     """
-    topic, data = msg.topic, msg.payload.decode()
-    logging.info("Listener on topic '%s' received '%s'", topic, data)
+    topic = msg.topic
+    metrics.LISTENER_MESSAGES.inc(topic)
 
     # Check if the listener should close
     if topic == SENTINEL_TOPIC:
         client.is_killed = True
-
-    # Dispatch relevant action
-    elif topic == MQTT_TOPIC_ALARM:
-        dispatch_data = data.split(DATA_DELIMITER)
-        buffer_dispatch(
-            client.dispatch_buf,
-            DispatchAction.LISTEN_RECV_ALARM,
-            dispatch_data
-        )
-
-    elif topic == MQTT_TOPIC_DEVICE:
-        dispatch_data = data.split(DATA_DELIMITER)
-        buffer_dispatch(
-            client.dispatch_buf,
-            DispatchAction.LISTEN_RECV_DEV,
-            dispatch_data
-        )
+        return
+
+    if topic not in DECODERS:
+        return
+
+    # Decode in place, and dispatch the relevant action
+    decode, action = DECODERS[topic]
+    try:
+        dispatch_data = decode(memoryview(msg.payload))
+    except ValueError as e:
+        logging.warning("Listener on topic '%s' got a bad payload. %s",
+                        topic, e)
+        metrics.LISTENER_INVALID.inc(topic)
+        return
+
+    logging.info("Listener on topic '%s' received '%s'", topic, dispatch_data)
+    buffer_dispatch(client.dispatch_buf, action, dispatch_data)
 
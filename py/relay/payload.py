@@ -0,0 +1,245 @@
+"""
+File: payload.py
+Email: e.roderick@uqconnect.edu.au
+Description: Encoding and decoding of device telemetry payloads received over
+    MQTT. Devices send either comma separated text, or a compact binary layout
+    that starts with a version byte. Version bytes are control characters, so
+    they never begin a text payload.
+
+    Binary version 1, little-endian:
+        Device status: version (B), reading time (d), charge state (f, NaN if
+            unknown), then the mRID, address and description as strings.
+        Device alarm: version (B), reading time (d), value (f), charge state
+            (f, NaN if unknown), then the mRID and alarm code as strings.
+        Meter readings: version (B), first sample time (d), seconds between
+            samples (f), then the mRID and measured code as strings, then the
+            samples (f) until the end of the payload.
+        Strings are a length byte followed by that many UTF-8 bytes.
+
+    Text device statuses are `mRID,address,description,reading time[,charge]`
+    and text alarms `mRID,code,reading time,value[,charge]`. Text meter
+    readings are `mRID,code,first time,interval,sample,...`.
+"""
+
+import array
+import codecs
+import math
+import struct
+import sys
+
+# Constants
+PAYLOAD_V1 = 0x01
+DATA_DELIMITER = ','
+
+_DEVICE_V1 = struct.Struct('<Bdf')
+_ALARM_V1 = struct.Struct('<Bdff')
+_READINGS_V1 = struct.Struct('<Bdf')
+_SAMPLE = struct.Struct('<f')
+_LENGTH = struct.Struct('<B')
+MAX_STRING = 255
+
+# Decodes a buffer slice without first copying it to bytes
+_utf_8_decode = codecs.utf_8_decode
+
+
+# Functions
+def is_binary(payload: memoryview) -> bool:
+    """ (bool) True if a payload uses the binary layout rather than text. """
+    return len(payload) > 0 and payload[0] == PAYLOAD_V1
+
+
+def _pack_strings(*values: str) -> bytes:
+    parts = []
+    for value in values:
+        encoded = value.encode()
+        if len(encoded) > MAX_STRING:
+            raise ValueError(f"String over {MAX_STRING} bytes: {value[:16]}...")
+        parts.append(_LENGTH.pack(len(encoded)))
+        parts.append(encoded)
+    return b''.join(parts)
+
+
+def _unpack_strings(
+    payload: memoryview,
+    offset: int,
+    count: int,
+    trailing: bool = False,
+) -> tuple[list[str], int]:
+    """ Decode strings from a payload without copying it first.
+
+    Params:
+        trailing: Allow bytes to follow the strings.
+
+    Returns:
+        The strings, and the offset of the byte after them.
+
+    Raises:
+        ValueError: If the strings overrun the payload, or are not UTF-8.
+    """
+    values = []
+    end = len(payload)
+    for _ in range(count):
+        if offset >= end:
+            raise ValueError("Payload string overruns the payload")
+        stop = offset + 1 + payload[offset]
+        if stop > end:
+            raise ValueError("Payload string overruns the payload")
+        values.append(_utf_8_decode(payload[offset + 1:stop], None, True)[0])
+        offset = stop
+
+    if offset != end and not trailing:
+        raise ValueError("Payload has trailing bytes")
+    return values, offset
+
+
+def _split_text(payload: memoryview, fields: int, kind: str) -> list[str]:
+    """ Split a text payload of `fields` fields, optionally followed by a
+        charge state.
+
+    Raises:
+        ValueError: If the payload has too few or too many fields, or is not
+            UTF-8.
+    """
+    values = str(payload, 'utf-8').split(DATA_DELIMITER)
+    if len(values) not in (fields, fields + 1):
+        raise ValueError(
+            f"{kind} payload has {len(values)} fields, expected {fields} or "
+            f"{fields + 1}"
+        )
+    return values
+
+
+def _charge(value: float) -> tuple:
+    return () if math.isnan(value) else (value,)
+
+
+def encode_device(
+    mrid: str,
+    address: str,
+    description: str,
+    reading_time: float,
+    charge_state: float = None,
+) -> bytes:
+    """ Encode a device status payload in the binary layout. """
+    charge = math.nan if charge_state is None else charge_state
+    return (_DEVICE_V1.pack(PAYLOAD_V1, reading_time, charge)
+            + _pack_strings(mrid, address, description))
+
+
+def encode_alarm(
+    mrid: str,
+    code: str,
+    reading_time: float,
+    value: float,
+    charge_state: float = None,
+) -> bytes:
+    """ Encode a device alarm payload in the binary layout. """
+    charge = math.nan if charge_state is None else charge_state
+    return (_ALARM_V1.pack(PAYLOAD_V1, reading_time, value, charge)
+            + _pack_strings(mrid, code))
+
+
+def decode_device(payload: memoryview) -> tuple:
+    """ Decode a device status payload of either layout.
+
+    Returns:
+        The mRID, address, description and reading time, then the charge
+        state if known. The same fields as `handle_listener_dev` takes.
+
+    Raises:
+        ValueError: If the payload is malformed.
+    """
+    if not is_binary(payload):
+        mrid, address, description, reading_time, *charge = \
+            _split_text(payload, 4, "Device")
+        return (mrid, address, description, float(reading_time),
+                *map(float, charge))
+
+    try:
+        _, reading_time, charge = _DEVICE_V1.unpack_from(payload)
+        (mrid, address, description), _ = _unpack_strings(
+            payload, _DEVICE_V1.size, 3
+        )
+    except struct.error as e:
+        raise ValueError(f"Truncated device payload. {e}") from e
+    return (mrid, address, description, reading_time, *_charge(charge))
+
+
+def decode_alarm(payload: memoryview) -> tuple:
+    """ Decode a device alarm payload of either layout.
+
+    Returns:
+        The mRID, alarm code, reading time and value, then the charge state if
+        known. The same fields as `handle_listener_alarm` takes. A text
+        alarm's value is kept as the string sent, as it always has been.
+
+    Raises:
+        ValueError: If the payload is malformed.
+    """
+    if not is_binary(payload):
+        mrid, code, reading_time, value, *charge = \
+            _split_text(payload, 4, "Alarm")
+        return (mrid, code, float(reading_time), value, *map(float, charge))
+
+    try:
+        _, reading_time, value, charge = _ALARM_V1.unpack_from(payload)
+        (mrid, code), _ = _unpack_strings(payload, _ALARM_V1.size, 2)
+    except struct.error as e:
+        raise ValueError(f"Truncated alarm payload. {e}") from e
+    return (mrid, code, reading_time, value, *_charge(charge))
+
+
+def encode_readings(
+    mrid: str,
+    code: str,
+    start: float,
+    interval: float,
+    samples: list[float],
+) -> bytes:
+    """ Encode a batch of evenly spaced meter readings in the binary layout. """
+    values = array.array('f', samples)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return (_READINGS_V1.pack(PAYLOAD_V1, start, interval)
+            + _pack_strings(mrid, code) + values.tobytes())
+
+
+def decode_readings(payload: memoryview) -> tuple:
+    """ Decode a batch of meter readings of either layout. On little-endian
+        hosts, binary samples are returned as a view of the payload.
+
+    Returns:
+        The mRID, measured code, first sample time, seconds between samples,
+        and the samples as float32 values. The same fields as
+        `handle_listener_readings` takes.
+
+    Raises:
+        ValueError: If the payload is malformed.
+    """
+    if not is_binary(payload):
+        values = str(payload, 'utf-8').split(DATA_DELIMITER)
+        if len(values) < 4:
+            raise ValueError(
+                f"Readings payload has {len(values)} fields, expected at "
+                f"least 4"
+            )
+        mrid, code, start, interval, *samples = values
+        return (mrid, code, float(start), float(interval),
+                array.array('f', map(float, samples)))
+
+    try:
+        _, start, interval = _READINGS_V1.unpack_from(payload)
+        (mrid, code), offset = _unpack_strings(
+            payload, _READINGS_V1.size, 2, trailing=True
+        )
+    except struct.error as e:
+        raise ValueError(f"Truncated readings payload. {e}") from e
+
+    samples = payload[offset:]
+    if len(samples) % _SAMPLE.size:
+        raise ValueError("Readings payload has a partial sample")
+    if sys.byteorder == 'big':
+        values = array.array('f', samples.tobytes())
+        values.byteswap()
+        return (mrid, code, start, interval, values)
+    return (mrid, code, start, interval, samples.cast('f'))
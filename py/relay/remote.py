@@ -4,18 +4,23 @@ Email: e.roderick@uqconnect.edu.au
 Description: Functions to relay information to other *remote* devices.
 """
 
-from typing import Callable
+import logging
+import threading
+import time
+from typing import Callable, Iterable
 
-from paho.mqtt import publish
 import paho.mqtt.client as mqtt
 
-from shems.mrid import get_device_mrid
+from common.env_vars import MQTT_ADDR, MQTT_MAX_INFLIGHT, MQTT_MAX_QUEUED
+from common.env_vars import MQTT_PORT, MQTT_PUBLISH_QOS, MQTT_PUBLISH_TIMEOUT
+from shems.host import get_host
 from shems.uri import get_endpoint, UriType
 
 # Constants
 MQTT_TOPIC_ALARM = get_endpoint(UriType.ALARM)
 MQTT_TOPIC_DEVICE = get_endpoint(UriType.DEVICE, '')
 MQTT_TOPIC_NOTIFY = get_endpoint(UriType.NOTIFY)
+MQTT_TOPIC_READINGS = get_endpoint(UriType.READINGS)
 
 def _get_mqtt_client(
     client_id: str,
@@ -44,22 +49,145 @@ def topic_from_control(control: str) -> str:
     return MQTT_TOPIC_NOTIFY + control
 
 
-def publish_mqtt(
-    topic: str,
-    data: bytes,
-    client_id: str = None,
-    hostname: str = "localhost",
-    port: int = 1883
-):
-    """ Publish a single message using mqtt """
-    if client_id is None:
-        client_id = str(get_device_mrid())
-
-    publish.single(
-        topic,
-        payload=data,
-        hostname=hostname,
-        port=port,
-        client_id=client_id
-    )
+# Classes
+class MqttPublisher():
+    """ A long-lived MQTT client for publishing. The client runs its own
+        network loop, reconnects automatically, and pipelines QoS 1 messages
+        up to an in-flight window rather than waiting on each acknowledgement.
+    """
+    def __init__( # pylint: disable=too-many-arguments
+        self,
+        client_id: str,
+        hostname: str = "localhost",
+        port: int = 1883,
+        *,
+        qos: int = 1,
+        max_inflight: int = 20,
+        max_queued: int = 1000,
+    ) -> None:
+        """ Construct an MQTT publisher. The connection is made by `start`.
+
+        Params:
+            client_id: The client ID to connect to the broker with.
+            hostname: The address of the MQTT broker.
+            port: The port of the MQTT broker.
+            qos: The quality of service to publish messages with.
+            max_inflight: The number of QoS > 0 messages that can await
+                acknowledgement at once.
+            max_queued: The number of messages held while disconnected or
+                outside the in-flight window. 0 means unlimited.
+        """
+        self._hostname = hostname
+        self._port = port
+        self._qos = qos
+
+        self._client = _get_mqtt_client(client_id)
+        self._client.max_inflight_messages_set(max_inflight)
+        self._client.max_queued_messages_set(max_queued)
+        self._client.reconnect_delay_set(min_delay=1, max_delay=30)
+
+    def start(self) -> None:
+        """ Start the network loop, which connects (and reconnects) to the
+            broker in the background.
+        """
+        self._client.connect_async(self._hostname, self._port)
+        self._client.loop_start()
+
+    def stop(self) -> None:
+        """ Disconnect from the broker and stop the network loop. """
+        self._client.disconnect()
+        self._client.loop_stop()
+
+    def is_connected(self) -> bool:
+        """ (bool) True if connected to the broker. False otherwise. """
+        return self._client.is_connected()
+
+    def publish(self, topic: str, data: bytes, timeout: float = None) -> None:
+        """ Publish a single message. See `publish_many`. """
+        self.publish_many([(topic, data)], timeout)
+
+    def publish_many(
+        self,
+        topics_values: Iterable[tuple[str, bytes]],
+        timeout: float = None,
+    ) -> None:
+        """ Publish several messages at once. Every message is sent before any
+            acknowledgement is waited on. If the broker is not connected, the
+            messages are held and sent on reconnection rather than waited on.
+
+        Params:
+            topics_values: The (topic, payload) pairs to publish.
+            timeout: The maximum time to wait for the messages to be
+                acknowledged. None waits indefinitely.
+
+        Raises:
+            (OSError) if a message could not be queued, or if the messages are
+                not acknowledged within the timeout.
+        """
+        infos = [
+            self._client.publish(topic, data, qos=self._qos)
+            for topic, data in topics_values
+        ]
+
+        for info in infos:
+            if info.rc == mqtt.MQTT_ERR_QUEUE_SIZE:
+                raise OSError("MQTT publish queue is full")
+
+        if any(info.rc == mqtt.MQTT_ERR_NO_CONN for info in infos):
+            logging.warning("MQTT publisher not connected. Holding %d messages",
+                            len(infos))
+            return
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for info in infos:
+            remaining = None
+            if deadline is not None:
+                remaining = max(0, deadline - time.monotonic())
+            info.wait_for_publish(remaining)
+
+            if not info.is_published():
+                raise TimeoutError("MQTT publish was not acknowledged in time")
+
+
+# Shared publisher
+_publisher = None # pylint: disable=invalid-name
+_publisher_lock = threading.Lock()
+
+
+def get_publisher() -> MqttPublisher:
+    """ (MqttPublisher) The shared publisher, started on first use. """
+    global _publisher # pylint: disable=global-statement
+    with _publisher_lock:
+        if _publisher is None:
+            _publisher = MqttPublisher(
+                f"{get_host().mrid}_publisher", # Disambiguate from listener
+                MQTT_ADDR,
+                MQTT_PORT,
+                qos=MQTT_PUBLISH_QOS,
+                max_inflight=MQTT_MAX_INFLIGHT,
+                max_queued=MQTT_MAX_QUEUED,
+            )
+            _publisher.start()
+        return _publisher
+
+
+def close_publisher() -> None:
+    """ Stop the shared publisher, if it has been started. """
+    global _publisher # pylint: disable=global-statement
+    with _publisher_lock:
+        if _publisher is not None:
+            _publisher.stop()
+            _publisher = None
+
+
+def publish_mqtt(topic: str, data: bytes):
+    """ Publish a single message using the shared mqtt publisher """
+    get_publisher().publish(topic, data, MQTT_PUBLISH_TIMEOUT)
+
+
+def publish_many(topics_values: Iterable[tuple[str, bytes]]):
+    """ Publish several messages using the shared mqtt publisher, waiting on
+        their acknowledgements together.
+    """
+    get_publisher().publish_many(topics_values, MQTT_PUBLISH_TIMEOUT)
 
@@ -1,13 +1,26 @@
+import hmac
 import logging
 from enum import Enum
+from typing import Collection, NamedTuple, Optional
 
 from fastapi import HTTPException, Request
 from lxml import etree as ET
 
-from shems.der_control import parse_control
+from common.env_vars import SHEMS_DEV, SHEMS_MAX_BODY, SHEMS_PROFILE_TOKEN
+from common.env_vars import SHEMS_XSD_VALIDATE
+from common.xml import create_parser
+from shems.der_control import CONTROL_SCHEMA_PATH, parse_control
 
 # Constants
 VALID_CONTENT_TYPE = ('application/xml', 'application/sep+xml')
+NOTIFY_ROOT_TAGS = ('DERControl', 'DefaultDERControl')
+ROOT_PEEK_SIZE = 512 # Bytes fed at a time while looking for the root element
+
+# Shared parsers, so the schema is only loaded and compiled once
+XML_PARSER = create_parser()
+NOTIFY_PARSER = create_parser(
+    ET.XMLSchema(ET.parse(str(CONTROL_SCHEMA_PATH), XML_PARSER))
+) if SHEMS_XSD_VALIDATE else XML_PARSER
 
 class RequestMethod(Enum):
     GET = "GET"
@@ -15,6 +28,13 @@ class RequestMethod(Enum):
     PUT = "PUT"
 
 
+class ListParams(NamedTuple):
+    """ IEEE 2030.5 list query parameters. """
+    start: int = 0 # `s`: Index of the first list item to return
+    after: Optional[int] = None # `a`: Only return items changed after this time
+    limit: Optional[int] = None # `l`: Maximum number of items to return
+
+
 # Helpers
 def get_params(query_params: str) -> dict[str, str]:
     """ Custom query parameter getter that follows the IEEE 2030.5 requirement
@@ -22,10 +42,10 @@ def get_params(query_params: str) -> dict[str, str]:
         left to right.
     """
     result = {}
-    params = [tuple(param.split('=')) for param in query_params.split('&')]
+    params = [param.partition('=') for param in query_params.split('&')]
 
-    for key, value in params:
-        if key in result:
+    for key, _, value in params:
+        if not key or key in result:
             continue
 
         result[key] = value
@@ -33,14 +53,117 @@ def get_params(query_params: str) -> dict[str, str]:
     return result
 
 
+def get_list_params(query_params: str) -> ListParams:
+    """ Read the IEEE 2030.5 list query parameters `s`, `a` and `l` from a
+        query string. Missing parameters take their ListParams defaults.
+
+    Raises:
+        HTTPException: If a given parameter is not a non-negative integer.
+    """
+    params = get_params(query_params)
+    values = {}
+    for key, field in (('s', 'start'), ('a', 'after'), ('l', 'limit')):
+        if key not in params:
+            continue
+
+        value = params[key]
+        if not (value.isascii() and value.isdigit()):
+            raise HTTPException(
+                status_code = 400,
+                detail = f'Invalid list query parameter {key}'
+            )
+        values[field] = int(value)
+
+    return ListParams(**values)
+
+
 # Validation
+def validate_profiling(request: Request) -> None:
+    """ Check that a request may use the profiling endpoints. If a profiling
+        token is configured, the request must present it as a bearer token.
+        Otherwise, profiling is only available in dev mode.
+
+    Raises:
+        HTTPException: If profiling is not allowed for the request.
+    """
+    if SHEMS_PROFILE_TOKEN:
+        expected = f"Bearer {SHEMS_PROFILE_TOKEN}".encode()
+        given = request.headers.get('authorization', '').encode()
+        if not hmac.compare_digest(given, expected):
+            raise HTTPException(
+                status_code = 401,
+                headers = { 'WWW-Authenticate': 'Bearer' }
+            )
+
+    elif not SHEMS_DEV:
+        raise HTTPException(status_code = 404)
+
+
+async def _read_body(request: Request, max_size: int) -> bytes:
+    """ Read a request body, stopping as soon as it is known to be too large.
+
+    Raises:
+        HTTPException: If the body is larger than `max_size` bytes.
+    """
+    too_large = HTTPException(
+        status_code = 413,
+        detail = f'Body exceeds {max_size} bytes'
+    )
+
+    # Reject on the declared length before reading anything
+    length = request.headers.get('content-length')
+    if length is not None and length.isdigit() and int(length) > max_size:
+        raise too_large
+
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > max_size:
+            raise too_large
+
+    return bytes(body)
+
+
+def _root_tag(data: bytes) -> Optional[str]:
+    """ Get the tag of a document's root element, parsing no more of the
+        document than is needed to reach it.
+
+    Raises:
+        lxml.etree.XMLSyntaxError: If the document is malformed before the
+            root element.
+    """
+    parser = ET.XMLPullParser(
+        events=('start',),
+        resolve_entities=False,
+        load_dtd=False,
+        no_network=True,
+    )
+    for offset in range(0, len(data), ROOT_PEEK_SIZE):
+        parser.feed(data[offset:offset + ROOT_PEEK_SIZE])
+        for _, element in parser.read_events():
+            return element.tag
+
+    return None
+
+
 async def validate_request(
     request: Request,
-    method: RequestMethod
+    method: RequestMethod,
+    root_tags: Collection[str] = None,
+    parser: ET.XMLParser = XML_PARSER,
 ) -> tuple[dict, ET.Element]:
     """ Check that an incoming request is valid. A request is valid if it has
         the correct request method, the headers indicate the data body is xml,
-        and the data body is valid XML.
+        the data body is no larger than SHEMS_MAX_BODY, and the data body is
+        valid XML. The cheaper checks are made first, so invalid requests are
+        rejected before the body is fully parsed.
+
+    Params:
+        request: The incoming request.
+        method: The method the request should have.
+        root_tags: If given, the tags that the body's root element may have.
+        parser: The parser to parse the body with. Give a parser with a schema
+            to also validate the body against it.
 
     Raises:
         HTTPException: If any of the above conditions are not met.
@@ -59,11 +182,17 @@ async def validate_request(
             headers = { 'Accept': 'application/sep+xml,application/xml' }
         )
 
+    data = await _read_body(request, SHEMS_MAX_BODY)
+
     try:
-        data = await request.body()
-        data_root = ET.fromstring(data)
-    except Exception as e:
-        # TODO: Make more specific exception catch
+        if root_tags is not None and _root_tag(data) not in root_tags:
+            raise HTTPException(
+                status_code = 400,
+                detail = 'Unexpected XML root element'
+            )
+
+        data_root = ET.fromstring(data, parser)
+    except ET.XMLSyntaxError as e:
         logging.warning("Invalid request body. Err: %s", e)
         raise HTTPException(
             status_code = 400,
@@ -83,13 +212,11 @@ def validate_request_notify(data_root: ET.Element):
     """
     # Try to identify the received message
     try:
-        if 'Control' in data_root.tag:
+        if data_root.tag in NOTIFY_ROOT_TAGS:
             control = parse_control(data_root)
-            # Dispatch control event
         else:
             raise ValueError("Given XML does not contain a DER Control message")
-    except Exception as e:
-        # TODO: Make more specific exception catch
+    except (KeyError, TypeError, ValueError) as e:
         logging.warning("Invalid request body. Err: %s", e)
         raise HTTPException(
                 status_code = 400,
@@ -97,4 +224,3 @@ def validate_request_notify(data_root: ET.Element):
         ) from e
 
     return control
-
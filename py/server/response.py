@@ -1,12 +1,69 @@
+import sqlite3 as sql
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Hashable, Iterator, Mapping, Optional
+
 from fastapi import HTTPException, Response
+from fastapi.responses import StreamingResponse
 
 from common.env_vars import SHEMS_DEV
-from database.access import get_cursor
-from shems.der_device import Device, DeviceList
-from shems.mrid import get_device_mrid
+from database.access import get_reader, table_version
+from database.alarms import alarm_summaries, recent_alarms
+from database.constants import Tables
+from database.status import status_history
+from server.request import ListParams
+from shems.der_alarm import Alarm, AlarmList, AlarmSummary, AlarmSummaryList
+from shems.der_device import Device, StatusHistory, StatusReading
+from shems.der_device import stream_device_list
+from shems.host import get_host
 from shems.uri import DEVICE_ID_URI_SEG, get_uri, UriType
 
 
+# Constants
+DEVICE_LIST_CACHE_ENTRIES = 8 # Number of rendered device list pages to keep
+DEVICE_LIST_CACHE_BYTES = 262144 # Largest rendered page to keep in memory
+DEVICE_LIST_CHUNK = 256 # Device rows read from the database at a time
+DEVICE_CACHE_ENTRIES = 1024 # Number of rendered single devices to keep
+ALARM_LIST_LIMIT = 100 # Alarms listed when no limit is given
+ALARM_LIST_MAX = 1000 # Most alarms listed in a single response
+
+# The device list queries share their ordering, so pages are consistent with
+# each other and with device indexes. The host device is always first.
+_DEVICE_SELECT = """
+    SELECT *
+    FROM devices
+    INNER JOIN status using (dev_id)
+"""
+_DEVICE_ORDER = """
+    ORDER BY CASE dev_id WHEN ? THEN 1 ELSE 2 END, dev_id
+"""
+
+# Rendered device list pages, keyed by list parameters and paired with the
+# devices table version they were read at. The devices version is bumped by
+# writes to either the devices or the status table, so covers every value in
+# a rendered page.
+_device_list_cache: OrderedDict[ListParams, tuple[int, bytes]] = OrderedDict()
+_device_list_lock = threading.Lock()
+
+# Rendered single devices and their reading times, keyed by device mRID or
+# list index and paired with the version they were read at
+_device_cache: OrderedDict[Hashable, tuple[int, bytes, Optional[float]]] = (
+    OrderedDict()
+)
+_device_lock = threading.Lock()
+
+# Latest device reading time, paired with the devices table version it was
+# read at
+# pylint: disable-next=invalid-name
+_last_modified_cache: tuple[int, Optional[float]] = None
+
+# Table versions count from startup, so entity tags include the startup time
+# to tell them apart from those given out before a restart
+_ETAG_EPOCH = format(time.time_ns(), 'x')
+
+
 # Classes
 class SHEMSResponse(Response):
     """ Custom base response class that presets some values for IEEE 2030.5
@@ -26,87 +83,460 @@ class SHEMSResponse(Response):
         )
 
 
+class SHEMSStreamingResponse(StreamingResponse):
+    """ Streamed equivalent of SHEMSResponse, for bodies that are produced
+        incrementally.
+    """
+    media_type = SHEMSResponse.media_type
+
+
+# Helpers
+def _new_device(values: tuple) -> Device:
+    """ Construct a device from a row of the devices and status tables. """
+    mrid, ip, description, change_time, enabled, charge = values
+    href = get_uri(UriType.DEVICE, ip, DEVICE_ID_URI_SEG.format(mrid))
+    return Device(href, description, change_time, enabled, charge)
+
+
+def _etag(version: int) -> str:
+    """ Create a weak entity tag for a version of a resource. """
+    return f'W/"{_ETAG_EPOCH}-{version}"'
+
+
+def _last_modified(version: int) -> Optional[float]:
+    """ Get the latest status reading time of any device, reading it from the
+        database only if the devices table has changed since it was last read.
+    """
+    global _last_modified_cache # pylint: disable=global-statement
+    cached = _last_modified_cache
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    with get_reader() as con:
+        (modified,) = con.execute(
+            "SELECT MAX(reading_time) FROM devices INNER JOIN status "
+            "using (dev_id)"
+        ).fetchone()
+
+    _last_modified_cache = (version, modified)
+    return modified
+
+
+def _is_not_modified(
+    headers: Mapping[str, str],
+    etag: str,
+    modified: Optional[float],
+) -> bool:
+    """ Check if a conditional request for an existing resource can be
+        answered with 304 Not Modified. If-None-Match is compared against the
+        entity tag, and takes precedence over If-Modified-Since, which is
+        compared against the resource's last modified time.
+
+    Params:
+        headers: The request headers.
+        etag: The entity tag of the current version of the resource.
+        modified: The reading time the resource was last modified at, if any.
+    """
+    if_none_match = headers.get('if-none-match')
+    if if_none_match is not None:
+        # Weak comparison, so the W/ prefix is ignored
+        tags = {
+            tag.strip().removeprefix('W/') for tag in if_none_match.split(',')
+        }
+        return '*' in tags or etag.removeprefix('W/') in tags
+
+    if_modified_since = headers.get('if-modified-since')
+    if if_modified_since is None:
+        return False
+
+    try:
+        since = parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+    return modified is not None and int(modified) <= since
+
+
+def _cache_headers(etag: str, modified: Optional[float]) -> dict[str, str]:
+    """ Get the validator headers to send with a device resource. """
+    headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+    if modified is not None:
+        headers['Last-Modified'] = formatdate(modified, usegmt=True)
+    return headers
+
+
+def _not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=_cache_headers(etag, None))
+
+
+def _cache_device_list(params: ListParams, version: int, page: bytes) -> None:
+    with _device_list_lock:
+        _device_list_cache[params] = (version, page)
+        _device_list_cache.move_to_end(params)
+        if len(_device_list_cache) > DEVICE_LIST_CACHE_ENTRIES:
+            _device_list_cache.popitem(last=False)
+
+
+def _render_device(
+    key: Hashable,
+    version: int,
+    query: str,
+    args: tuple,
+) -> Optional[tuple[bytes, Optional[float]]]:
+    """ Get a rendered device and its reading time, from memory if it was
+        rendered at the same version, otherwise by reading it with a query.
+        Devices that do not exist are not kept, so are always read.
+
+    Params:
+        key: Identifies the device resource the query selects.
+        version: The version of the devices table, or of the device, that
+            the resource changes with. Read before the query runs.
+        query: Selects the device's row of the devices and status tables.
+        args: The arguments of the query.
+
+    Returns:
+        The rendered device and its reading time, or None if no device
+        matches the query.
+    """
+    with _device_lock:
+        cached = _device_cache.get(key)
+        if cached is not None and cached[0] == version:
+            _device_cache.move_to_end(key)
+            return cached[1:]
+
+    with get_reader() as con:
+        values = con.execute(query, args).fetchone()
+    if not values:
+        return None
+
+    body = str(_new_device(values)).encode("utf-8")
+    with _device_lock:
+        _device_cache[key] = (version, body, values[3])
+        _device_cache.move_to_end(key)
+        if len(_device_cache) > DEVICE_CACHE_ENTRIES:
+            _device_cache.popitem(last=False)
+    return body, values[3]
+
+
+def _device_response(
+    headers: Mapping[str, str],
+    etag: str,
+    body: bytes,
+    modified: Optional[float],
+) -> Response:
+    """ Respond with a rendered device, or with 304 Not Modified if the
+        request's validators match it.
+    """
+    if _is_not_modified(headers, etag, modified):
+        return _not_modified(etag)
+    return SHEMSResponse(body, headers=_cache_headers(etag, modified))
+
+
+def _alarm_href(mrid: Optional[str]) -> str:
+    """ The URI of the alarms of a device, or of every device. """
+    if mrid is None:
+        return get_uri(UriType.ALARM)
+    return get_uri(UriType.DEVICE, dev_id=DEVICE_ID_URI_SEG.format(mrid)) \
+        + "alm/"
+
+
+def _check_device(con: sql.Connection, mrid: Optional[str]) -> None:
+    """ Check a device exists, if one is given.
+
+    Raises:
+        (HTTPException) if the device is not found.
+    """
+    if mrid is None:
+        return
+    if con.execute("SELECT 1 FROM devices WHERE dev_id = ?",
+                   (mrid,)).fetchone() is None:
+        raise HTTPException(
+            status_code = 404,
+            detail = 'Device ID not known'
+        )
+
+
+def _read_device_page(
+    params: ListParams,
+) -> tuple[int, int, Iterator[tuple]]:
+    """ Read a page of the device list. The count and the first chunk of rows
+        are read from a single snapshot. Later chunks are read as the page is
+        consumed, so a large page is never held in memory.
+
+    Returns:
+        The number of devices matching the query, the number on the page, and
+        the page's rows.
+    """
+    host = str(get_host().mrid)
+    where, args = [], ()
+    if params.after is not None:
+        where, args = ["reading_time > ?"], (params.after,)
+    filters = "WHERE " + " AND ".join(where) if where else ""
+
+    with get_reader() as con:
+        con.execute("BEGIN")
+        (all_count,) = con.execute(
+            f"SELECT COUNT(*) FROM devices INNER JOIN status using (dev_id) "
+            f"{filters}",
+            args
+        ).fetchone()
+        rows = con.execute(
+            _DEVICE_SELECT + filters + _DEVICE_ORDER + "LIMIT ? OFFSET ?",
+            (*args, host, DEVICE_LIST_CHUNK, params.start)
+        ).fetchall()
+
+    results = max(0, all_count - params.start)
+    if params.limit is not None:
+        results = min(results, params.limit)
+    return all_count, results, _read_device_rows(rows, results, where, args,
+                                                 host)
+
+
+def _read_device_rows(
+    rows: list[tuple],
+    remaining: int,
+    where: list[str],
+    args: tuple,
+    host: str,
+) -> Iterator[tuple]:
+    """ Yield up to `remaining` device rows, starting with those already read,
+        then reading DEVICE_LIST_CHUNK rows at a time. Each chunk continues
+        after the last device yielded, and the read connection is returned to
+        the pool between chunks.
+    """
+    while rows:
+        rows = rows[:remaining]
+        yield from rows
+        remaining -= len(rows)
+        if remaining <= 0 or len(rows) < DEVICE_LIST_CHUNK:
+            return
+
+        # Devices sort by whether they are the host, then by mRID
+        last = rows[-1][0]
+        after = "(CASE dev_id WHEN ? THEN 1 ELSE 2 END, dev_id) > (?, ?)"
+        with get_reader() as con:
+            rows = con.execute(
+                _DEVICE_SELECT + "WHERE " + " AND ".join([*where, after])
+                + _DEVICE_ORDER + "LIMIT ?",
+                (*args, host, 1 if last == host else 2, last, host,
+                 DEVICE_LIST_CHUNK)
+            ).fetchall()
+
+
+def _stream_device_list(
+    params: ListParams,
+    version: int,
+    all_count: int,
+    results: int,
+    rows: Iterator[tuple],
+) -> Iterator[bytes]:
+    """ Serialise a page of the device list, one chunk at a time. No read
+        connection is held while a slow client reads the page. Pages small
+        enough are cached once fully sent.
+    """
+    devices = (_new_device(values) for values in rows)
+    href = get_uri(UriType.DEVICE, dev_id='')
+
+    page, size = [], 0
+    for chunk in stream_device_list(href, all_count, results, devices):
+        yield chunk
+        if page is None:
+            continue
+
+        size += len(chunk)
+        if size > DEVICE_LIST_CACHE_BYTES:
+            page = None # Too large to keep
+        else:
+            page.append(chunk)
+
+    if page is not None:
+        _cache_device_list(params, version, b''.join(page))
+
+
 # Response handlers
-def handle_read_device(index: int = None) -> str:
-    """ Get and return the known devices from the database. If an index is
-        specified, only return that device. The list should be ordered with the
-        host device as index 0.
+def handle_read_device_list(
+    params: ListParams,
+    headers: Mapping[str, str],
+) -> Response:
+    """ Get the known devices from the database, as an IEEE 2030.5 list. The
+        list is ordered with the host device as index 0. Rendered pages are
+        served from memory until the devices table changes. Other pages are
+        read and streamed DEVICE_LIST_CHUNK devices at a time.
+
+    Params:
+        params: The list query parameters selecting the page to return.
+        headers: The request headers, checked for conditional requests.
+    """
+    # Read the version before the table, so a concurrent change leaves the
+    # cache stale rather than tagging old values with the new version
+    version = table_version(Tables.DEVICES)
+    etag = _etag(version)
+    modified = _last_modified(version)
+    if _is_not_modified(headers, etag, modified):
+        return _not_modified(etag)
+
+    response_headers = _cache_headers(etag, modified)
+    with _device_list_lock:
+        cached = _device_list_cache.get(params)
+        if cached is not None and cached[0] == version:
+            _device_list_cache.move_to_end(params)
+            return SHEMSResponse(cached[1], headers=response_headers)
+
+    return SHEMSStreamingResponse(
+        _stream_device_list(params, version, *_read_device_page(params)),
+        headers=response_headers
+    )
+
+
+def handle_read_device(index: int, headers: Mapping[str, str]) -> Response:
+    """ Get and return a single known device from the database by its index
+        in the device list.
 
     Params:
         index: The index of the device to select.
+        headers: The request headers, checked for conditional requests.
 
     Raises:
         (HTTPException) if the index is greater than device list length.
     """
-    response = ''
-
-    con, _ = get_cursor()
-    mrid = str(get_device_mrid())
-    device_values = con.execute(
-        """
-            SELECT *
-            FROM devices
-            INNER JOIN status using (dev_id)
-            ORDER BY CASE dev_id WHEN ? THEN 1 ELSE 2 END
-        """, (mrid,)
-    ).fetchall()
-
-    if not device_values:
-        return response
-
-    # Want the entire devices list
-    if index is None:
-        def new_device(values):
-            mrid, ip, description, time, enabled, charge = values
-            href = get_uri(UriType.DEVICE, ip, DEVICE_ID_URI_SEG.format(mrid))
-            return Device(href, description, time, enabled, charge)
-
-        devices = [new_device(values) for values in device_values]
-        href = get_uri(UriType.DEVICE, dev_id='')
-        response = str(DeviceList(href, devices))
-
-    # Want a specific device
-    else:
-        if index >= len(device_values):
-            raise HTTPException(
-                status_code = 400,
-                detail = 'Index exceeds device list'
-            )
-
-        mrid, ip, description, time, enabled, charge = device_values[index]
-        href = get_uri(UriType.DEVICE, ip, DEVICE_ID_URI_SEG.format(mrid))
-        response = str(Device(href, description, time, enabled, charge))
-
-    return response
-
-
-def handle_read_device_id(dev_id: str) -> str:
+    # Any change to the devices may change which device is at an index
+    version = table_version(Tables.DEVICES)
+    device = _render_device(
+        ('index', index), version,
+        _DEVICE_SELECT + _DEVICE_ORDER + "LIMIT 1 OFFSET ?",
+        (str(get_host().mrid), index)
+    )
+    if device is None:
+        raise HTTPException(
+            status_code = 400,
+            detail = 'Index exceeds device list'
+        )
+
+    return _device_response(headers, _etag(version), *device)
+
+
+def handle_read_device_id(dev_id: str, headers: Mapping[str, str]) -> Response:
     """ Get and return the info of a single device based on device ID.
 
     Params:
         dev_id: The mRID of the target device.
+        headers: The request headers, checked for conditional requests.
 
     Raises:
         (HTTPException) if the device is not found.
     """
-    con, _ = get_cursor()
-    values = con.execute(
-        """
-            SELECT *
-            FROM devices
-            INNER JOIN status using (dev_id)
-            WHERE devices.dev_id = ?
-        """, (dev_id,)
-    ).fetchone()
-
-    if not values:
+    version = table_version(Tables.DEVICES, dev_id)
+    device = _render_device(
+        ('id', dev_id), version,
+        _DEVICE_SELECT + "WHERE devices.dev_id = ?",
+        (dev_id,)
+    )
+    if device is None:
         raise HTTPException(
             status_code = 404,
             detail = 'Device ID not known'
         )
 
-    mrid, ip, description, time, enabled, charge = values
-    href = get_uri(UriType.DEVICE, ip, DEVICE_ID_URI_SEG.format(mrid))
-    device = Device(href, description, time, enabled, charge)
-    return str(device)
+    return _device_response(headers, _etag(version), *device)
+
+
+def handle_read_alarms(
+    params: ListParams,
+    headers: Mapping[str, str],
+    mrid: Optional[str] = None,
+) -> Response:
+    """ Get the newest alarms of every device, or of one, newest first. The
+        list query parameter `a` only lists alarms raised after a time, and
+        `l` lists up to ALARM_LIST_MAX alarms rather than ALARM_LIST_LIMIT.
+
+    Params:
+        params: The list query parameters selecting the alarms to return.
+        headers: The request headers, checked for conditional requests.
+        mrid: The mRID of the device to list the alarms of, if any.
+
+    Raises:
+        (HTTPException) if the device is not found.
+    """
+    # Pruning only bumps the version of the whole table
+    version = table_version(Tables.ALARMS)
+    etag = _etag(version)
+    if _is_not_modified(headers, etag, None):
+        return _not_modified(etag)
+
+    limit = ALARM_LIST_LIMIT if params.limit is None else params.limit
+    with get_reader() as con:
+        _check_device(con, mrid)
+        alarms = recent_alarms(con, params.after, mrid,
+                               min(limit, ALARM_LIST_MAX))
+
+    alarm_list = AlarmList(
+        _alarm_href(mrid), [Alarm(*alarm) for alarm in alarms]
+    )
+    return SHEMSResponse(alarm_list.to_bytes(),
+                         headers=_cache_headers(etag, None))
+
+
+def handle_read_alarm_summaries(
+    headers: Mapping[str, str],
+    mrid: Optional[str] = None,
+) -> Response:
+    """ Get the alarm summary of each code raised by every device, or by one.
+        Summaries are kept as alarms arrive, so the alarm history is not read.
+
+    Params:
+        headers: The request headers, checked for conditional requests.
+        mrid: The mRID of the device to list the summaries of, if any.
+
+    Raises:
+        (HTTPException) if the device is not found.
+    """
+    version = table_version(Tables.ALARMS)
+    etag = _etag(version)
+    if _is_not_modified(headers, etag, None):
+        return _not_modified(etag)
+
+    with get_reader() as con:
+        _check_device(con, mrid)
+        summaries = alarm_summaries(con, mrid)
+
+    summary_list = AlarmSummaryList(
+        _alarm_href(mrid) + "summary/",
+        [AlarmSummary(*summary) for summary in summaries]
+    )
+    return SHEMSResponse(summary_list.to_bytes(),
+                         headers=_cache_headers(etag, None))
+
+
+def handle_read_status_history(
+    dev_id: str,
+    params: ListParams,
+    headers: Mapping[str, str],
+) -> Response:
+    """ Get the status readings held in a device's history ring, oldest
+        first. The list query parameter `a` only lists readings read after a
+        time. The ring holds at most SHEMS_STATUS_HISTORY readings.
+
+    Params:
+        dev_id: The mRID of the target device.
+        params: The list query parameters selecting the readings to return.
+        headers: The request headers, checked for conditional requests.
+
+    Raises:
+        (HTTPException) if the device is not found.
+    """
+    # Trimming the rings only bumps the version of the whole table
+    version = table_version(Tables.STATUS_HISTORY)
+    etag = _etag(version)
+    if _is_not_modified(headers, etag, None):
+        return _not_modified(etag)
+
+    with get_reader() as con:
+        _check_device(con, dev_id)
+        readings = status_history(con, dev_id, params.after)
 
+    href = get_uri(UriType.DEVICE, dev_id=DEVICE_ID_URI_SEG.format(dev_id))
+    history = StatusHistory(
+        href + "status/", [StatusReading(*reading) for reading in readings]
+    )
+    return SHEMSResponse(history.to_bytes(),
+                         headers=_cache_headers(etag, None))
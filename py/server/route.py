@@ -10,12 +10,19 @@ def get_route(route_uri: UriType, template_value: str = '') -> str:
 # App routes
 ROOT = "/"
 TEST = "/test/"
+METRICS = "/metrics"
+PROFILE = "/profile/"
+PROFILE_HANDLERS = "/profile/handlers/"
 
 GET_ALARM = get_route(UriType.ALARM)
+GET_ALARM_SUMMARY = GET_ALARM + "summary/"
 GET_DER = get_route(UriType.DER)
 GET_DEVICES = get_route(UriType.DEVICE)
 GET_DEVICE_INDEX = get_route(UriType.DEVICE, "{dev_index}")
 GET_DEVICE_ID = get_route(UriType.DEVICE, "/id/{dev_id}")
+GET_DEVICE_ALARM = get_route(UriType.DEVICE, "/id/{dev_id}/alm")
+GET_DEVICE_ALARM_SUMMARY = GET_DEVICE_ALARM + "summary/"
+GET_DEVICE_STATUS = get_route(UriType.DEVICE, "/id/{dev_id}/status")
 
 POST_NOTIFY = get_route(UriType.NOTIFY)
 
@@ -4,75 +4,164 @@ Email: e.roderick@uqconnect.edu.au
 Description: Defines the SHEMS server endpoints
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
+import asyncio
 import threading
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 
-from common.env_vars import DISPATCH_SIZE, DISPATCH_CYCLE, SHEMS_DEV
-from common.ring_buffer import RingBuffer
+from common import metrics
+from common.env_vars import DISPATCH_ASYNC, DISPATCH_SIZE, DISPATCH_CYCLE
+from common.env_vars import SHEMS_DEV, SHEMS_PROFILE_MAX
+from common.profiler import render_collapsed, StackSampler
+from common.ring_buffer import AsyncRingBuffer
 from common.thread_control import ThreadCloser, ThreadController
-from dispatch.actions import buffer_dispatch, DispatchAction
-from dispatch.dispatch import dispatcher_t
+from database._dev_access import create_database
+from database.access import close_connections
+from dispatch.actions import buffer_dispatch_async, DispatchAction
+from dispatch.actions import DispatchLane
+from dispatch.dispatch import create_dispatch_buffer, dispatcher_a
+from dispatch.dispatch import dispatcher_t, HANDLER_TIMINGS
+from dispatch.scheduler import DispatchScheduler, scheduler_t
 from relay.listener import mqtt_listener_t
-from server.request import get_params, RequestMethod, validate_request
+from relay.remote import close_publisher
+from server.request import get_list_params, get_params, NOTIFY_PARSER
+from server.request import NOTIFY_ROOT_TAGS, RequestMethod
+from server.request import validate_profiling, validate_request
 from server.request import validate_request_notify
+from server.response import handle_read_alarm_summaries, handle_read_alarms
 from server.response import handle_read_device, handle_read_device_id
-from server.response import SHEMSResponse
+from server.response import handle_read_device_list
+from server.response import handle_read_status_history, SHEMSResponse
 import server.route as routes
 
 
 # Initalise fastapi server object
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """ SHEMS server should have access to a dispatch thread for its entire
-        lifetime. The dispatch thread can be communicated with using a
-        ring-buffer and controlled using a thread controller.
+    """ SHEMS server should have access to a dispatcher for its entire
+        lifetime. The dispatcher can be communicated with using a ring-buffer.
+        By default the dispatcher is a thread controlled using a thread
+        controller. If DISPATCH_ASYNC is set, it is instead a task on the
+        server's event loop. Timed actions are held by a single scheduler
+        thread until they are due.
     """
-    # Create dispatcher thread
-    dispatch_buf = RingBuffer(DISPATCH_SIZE, DISPATCH_CYCLE)
-    dispatch_closer = ThreadCloser()
-    _dispatcher_t = threading.Thread(
-        target=dispatcher_t,
-        args=(dispatch_buf, dispatch_closer)
+    # Read connections cannot open a database that does not exist yet, so
+    # the tables are created before any request is accepted
+    await asyncio.to_thread(create_database)
+
+    if DISPATCH_ASYNC:
+        # Create dispatcher task, with a single worker for database writes
+        dispatch_buf = AsyncRingBuffer(DISPATCH_SIZE, DISPATCH_CYCLE)
+        dispatch_executor = ThreadPoolExecutor(1, "dispatch_worker")
+        dispatch_task = asyncio.create_task(
+            dispatcher_a(dispatch_buf, dispatch_executor)
+        )
+    else:
+        # Create dispatcher thread, taking controls ahead of telemetry
+        dispatch_buf = create_dispatch_buffer()
+        dispatch_closer = ThreadCloser()
+        _dispatcher_t = threading.Thread(
+            target=dispatcher_t,
+            args=(dispatch_buf, dispatch_closer),
+            name="dispatcher"
+        )
+        dispatch_controller = ThreadController(_dispatcher_t, dispatch_closer)
+        app.state.dispatch_ctrl = dispatch_controller
+        dispatch_controller.start()
+
+    # Create scheduler thread
+    scheduler = DispatchScheduler(dispatch_buf)
+    scheduler_closer = ThreadCloser()
+    _scheduler_t = threading.Thread(
+        target=scheduler_t,
+        args=(scheduler, scheduler_closer),
+        name="scheduler"
     )
-    dispatch_controller = ThreadController(_dispatcher_t, dispatch_closer)
+    scheduler_controller = ThreadController(_scheduler_t, scheduler_closer)
 
     # Create listener thread
     listener_closer = ThreadCloser()
     _listener_t = threading.Thread(
         target=mqtt_listener_t,
-        args=(dispatch_buf, listener_closer)
+        args=(dispatch_buf, listener_closer),
+        name="listener"
     )
     listener_controller = ThreadController(_listener_t, listener_closer)
 
+    # Report the buffer and scheduler state when metrics are collected
+    metrics.DISPATCH_QUEUE_DEPTH.set_function(dispatch_buf.qsize)
+    metrics.DISPATCH_QUEUE_HIGH_WATER.set_function(
+        lambda: dispatch_buf.high_water
+    )
+    metrics.DISPATCH_OVERWRITTEN.set_function(
+        lambda: dispatch_buf.overwritten
+    )
+    if not DISPATCH_ASYNC:
+        metrics.DISPATCH_LANE_DEPTH.set_function(lambda: {
+            (lane.name.lower(),): size
+            for lane, size in zip(DispatchLane, dispatch_buf.lane_sizes())
+        })
+    metrics.SCHEDULER_PENDING.set_function(scheduler.pending)
+
     # Make structures endpoint-accessible
     app.state.dispatch_buf = dispatch_buf
-    app.state.dispatch_ctrl = dispatch_controller
+    app.state.scheduler = scheduler
+    app.state.scheduler_ctrl = scheduler_controller
     app.state.listener_ctrl = listener_controller
 
     # Start threads
-    dispatch_controller.start()
+    scheduler_controller.start()
     listener_controller.start()
 
-    # Dispatch action to ensure DB exists
-    buffer_dispatch(dispatch_buf, DispatchAction.DB_INIT)
+    # Dispatch action to bring the DB and device registry up to date
+    await buffer_dispatch_async(dispatch_buf, DispatchAction.DB_INIT)
 
     # Dispatch action to ensure host in DB
-    buffer_dispatch(dispatch_buf, DispatchAction.PRELOAD)
-
-    # Dispatch to remove old non-default controls
-    buffer_dispatch(dispatch_buf, DispatchAction.CONTROL_CLEAN)
+    await buffer_dispatch_async(dispatch_buf, DispatchAction.PRELOAD)
+
+    # Dispatch the actions that place timed actions on the scheduler:
+    # - Periodically removing expired non-default controls
+    # - Rescheduling the expiry of remaining non-default controls
+    # - Periodically checking for host address changes
+    # - Periodically pruning old meter readings
+    # - Pruning alarms past their retention
+    # - Periodically writing out absorbed device states
+    for action in (DispatchAction.CONTROL_CLEAN,
+                   DispatchAction.CONTROL_RESTORE,
+                   DispatchAction.HOST_REFRESH,
+                   DispatchAction.READINGS_PRUNE,
+                   DispatchAction.ALARMS_PRUNE,
+                   DispatchAction.STATE_FLUSH):
+        await buffer_dispatch_async(dispatch_buf, action, scheduler)
 
     yield
 
-    # Shutdown
-    dispatch_buf.notify_finish()
-    dispatch_controller.finish()
-    listener_controller.finish()
+    # Shutdown. Stop the producers before the dispatcher, and join threads
+    # off the event loop, as they may be waiting on it to place an item.
+    scheduler.close()
+    await asyncio.to_thread(scheduler_controller.finish)
+    await asyncio.to_thread(listener_controller.finish)
+
+    # Write out absorbed device states before the dispatcher finishes
+    await buffer_dispatch_async(dispatch_buf, DispatchAction.STATE_FLUSH)
+
+    if DISPATCH_ASYNC:
+        await dispatch_buf.notify_finish()
+        await dispatch_task
+        dispatch_executor.shutdown()
+    else:
+        await asyncio.to_thread(dispatch_buf.notify_finish)
+        await asyncio.to_thread(dispatch_controller.finish)
+
+    close_publisher()
+    close_connections()
 
 shems_server = FastAPI(lifespan = lifespan)
+_sampler = StackSampler()
 shems_server.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -90,15 +179,86 @@ def read_root():
     return { "msg": "Well howdy!" }
 
 
+@shems_server.get(routes.METRICS, response_class=PlainTextResponse)
+def read_metrics():
+    """ Report operational metrics in the Prometheus text format. """
+    return PlainTextResponse(
+        metrics.REGISTRY.render(),
+        media_type=metrics.CONTENT_TYPE
+    )
+
+
+@shems_server.get(routes.PROFILE, response_class=PlainTextResponse)
+async def read_profile(
+    request: Request,
+    seconds: float = 5,
+    threads: str = None,
+):
+    """ Sample the stacks of the server's threads, and return how often each
+        stack was seen in the collapsed format used by flame graph tools.
+        Only available in dev mode, or with the profiling token.
+
+    Params:
+        seconds: The seconds to sample for, up to SHEMS_PROFILE_MAX.
+        threads: Comma separated thread names to sample, matched by prefix,
+            such as `dispatcher,listener`. `loop` selects the event loop
+            thread. All threads are sampled if not given.
+
+    Raises:
+        (HTTPException) if profiling is not allowed, the duration is invalid,
+            or another profile is being taken.
+    """
+    validate_profiling(request)
+    if not 0 < seconds <= SHEMS_PROFILE_MAX:
+        raise HTTPException(
+            status_code = 400,
+            detail = f'Seconds must be within (0, {SHEMS_PROFILE_MAX}]'
+        )
+
+    thread_ids = None
+    if threads:
+        names = tuple(threads.split(','))
+        thread_ids = {
+            thread.ident for thread in threading.enumerate()
+            if thread.name.startswith(names)
+        }
+        if 'loop' in names:
+            thread_ids.add(threading.get_ident())
+
+    counts = await asyncio.to_thread(_sampler.sample, seconds, thread_ids)
+    if counts is None:
+        raise HTTPException(
+            status_code = 409,
+            detail = 'A profile is already being taken'
+        )
+
+    return PlainTextResponse(render_collapsed(counts))
+
+
+@shems_server.get(routes.PROFILE_HANDLERS)
+def read_profile_handlers(request: Request):
+    """ Summarise the recent wall and CPU times of each dispatcher action.
+        Only available in dev mode, or with the profiling token.
+    """
+    validate_profiling(request)
+    return HANDLER_TIMINGS.summary()
+
+
 # SHEMS endpoints
 @shems_server.get(routes.GET_DEVICES, response_class=SHEMSResponse)
-def read_devices():
-    """ List all of the known devices for this controller. """
-    return handle_read_device()
+def read_devices(request: Request):
+    """ List the known devices for this controller. Supports the IEEE 2030.5
+        list query parameters `s` (start), `a` (after) and `l` (limit).
+
+    Raises:
+        (HTTPException) if a list query parameter is invalid.
+    """
+    params = get_list_params(str(request.query_params))
+    return handle_read_device_list(params, request.headers)
 
 
 @shems_server.get(routes.GET_DEVICE_INDEX, response_class=SHEMSResponse)
-def read_device_index(dev_index: int):
+def read_device_index(dev_index: int, request: Request):
     """ List details of a specific known device by index.
 
     Params:
@@ -109,11 +269,11 @@ def read_device_index(dev_index: int):
     Raises:
         (HTTPException) if the index is greater than the number of devices.
     """
-    return handle_read_device(dev_index)
+    return handle_read_device(dev_index, request.headers)
 
 
 @shems_server.get(routes.GET_DEVICE_ID, response_class=SHEMSResponse)
-def read_device_id(dev_id: str):
+def read_device_id(dev_id: str, request: Request):
     """ List details of a specific known device by device mRID.
 
     Params:
@@ -122,7 +282,74 @@ def read_device_id(dev_id: str):
     Raises:
         (HTTPException) If the dev_id is not found within the db.
     """
-    return handle_read_device_id(dev_id)
+    return handle_read_device_id(dev_id, request.headers)
+
+
+@shems_server.get(routes.GET_DEVICE_STATUS, response_class=SHEMSResponse)
+def read_device_status(dev_id: str, request: Request):
+    """ List the recent status readings of a device, oldest first. Supports
+        the IEEE 2030.5 list query parameter `a` (after).
+
+    Params:
+        dev_id: The UUID that identifies the device.
+
+    Raises:
+        (HTTPException) if a list query parameter is invalid, or the dev_id is
+            not found within the db.
+    """
+    params = get_list_params(str(request.query_params))
+    return handle_read_status_history(dev_id, params, request.headers)
+
+
+@shems_server.get(routes.GET_ALARM, response_class=SHEMSResponse)
+def read_alarms(request: Request):
+    """ List the newest alarms of every device, newest first. Supports the
+        IEEE 2030.5 list query parameters `a` (after) and `l` (limit).
+
+    Raises:
+        (HTTPException) if a list query parameter is invalid.
+    """
+    params = get_list_params(str(request.query_params))
+    return handle_read_alarms(params, request.headers)
+
+
+@shems_server.get(routes.GET_ALARM_SUMMARY, response_class=SHEMSResponse)
+def read_alarm_summaries(request: Request):
+    """ List the count, first and last time, and last value of each alarm code
+        raised by every device.
+    """
+    return handle_read_alarm_summaries(request.headers)
+
+
+@shems_server.get(routes.GET_DEVICE_ALARM, response_class=SHEMSResponse)
+def read_device_alarms(dev_id: str, request: Request):
+    """ List the newest alarms of a device, newest first. Supports the
+        IEEE 2030.5 list query parameters `a` (after) and `l` (limit).
+
+    Params:
+        dev_id: The UUID that identifies the device.
+
+    Raises:
+        (HTTPException) if a list query parameter is invalid, or the dev_id is
+            not found within the db.
+    """
+    params = get_list_params(str(request.query_params))
+    return handle_read_alarms(params, request.headers, dev_id)
+
+
+@shems_server.get(routes.GET_DEVICE_ALARM_SUMMARY,
+                  response_class=SHEMSResponse)
+def read_device_alarm_summaries(dev_id: str, request: Request):
+    """ List the count, first and last time, and last value of each alarm code
+        raised by a device.
+
+    Params:
+        dev_id: The UUID that identifies the device.
+
+    Raises:
+        (HTTPException) If the dev_id is not found within the db.
+    """
+    return handle_read_alarm_summaries(request.headers, dev_id)
 
 
 @shems_server.post(routes.POST_NOTIFY)
@@ -130,13 +357,18 @@ async def read_notify(request: Request):
     """ Handle incoming notification requests. This endpoint should be used to
         inform the SHEMS and its devices of changes.
     """
-    headers, data = await validate_request(request, RequestMethod.POST)
+    headers, data = await validate_request(
+        request,
+        RequestMethod.POST,
+        NOTIFY_ROOT_TAGS,
+        NOTIFY_PARSER
+    )
     control = validate_request_notify(data)
-    buffer_dispatch(
+    await buffer_dispatch_async(
         request.app.state.dispatch_buf,
         DispatchAction.CONTROL,
-        # Pass the control details and a buffer reference for future callbacks
-        (control, request.app.state.dispatch_buf)
+        # Pass the control details and a scheduler reference for its expiry
+        (control, request.app.state.scheduler)
     )
 
 
@@ -0,0 +1,106 @@
+"""
+File: shems/der_alarm.py
+Email: e.roderick@uqconnect.edu.au
+Description: XML representations of device alarms, and of the per device, per
+    code alarm summaries.
+"""
+
+from __future__ import annotations
+from typing import TypeAlias
+
+from common.xml import ContainsXml, create_subelement
+
+
+# Types
+Timestamp: TypeAlias = int
+
+
+# Functions
+def _time(value: float) -> str:
+    return str(int(value))
+
+
+# Classes
+class Alarm(ContainsXml):
+    """ A single alarm raised by a device. """
+    _xml_tag = 'Alarm'
+
+    def __init__(
+        self,
+        mrid: str,
+        code: str,
+        created_time: Timestamp,
+        value: object,
+    ):
+        """ Constructs an alarm message object.
+
+        Params:
+            mrid: The mRID of the device that raised the alarm.
+            code: The alarm code.
+            created_time: The timestamp the alarm was raised at.
+            value: The value the alarm was raised with, if any.
+        """
+        super().__init__(self._xml_tag)
+        create_subelement(self._xml, 'mRID', mrid)
+        create_subelement(self._xml, 'code', code)
+        create_subelement(self._xml, 'createdDateTime', _time(created_time))
+        if value is not None:
+            create_subelement(self._xml, 'value', str(value))
+
+
+class AlarmSummary(ContainsXml):
+    """ The count, and first and last times, of a device's alarms of a code. """
+    _xml_tag = 'AlarmSummary'
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def __init__(
+        self,
+        mrid: str,
+        code: str,
+        count: int,
+        first_seen: Timestamp,
+        last_seen: Timestamp,
+        last_value: object,
+    ):
+        """ Constructs the summary of every alarm of a code from a device.
+
+        Params:
+            mrid: The mRID of the device that raised the alarms.
+            code: The alarm code.
+            count: The number of alarms received, including pruned ones.
+            first_seen: The timestamp of the earliest alarm.
+            last_seen: The timestamp of the latest alarm.
+            last_value: The value of the latest alarm, if any.
+        """
+        super().__init__(self._xml_tag)
+        create_subelement(self._xml, 'mRID', mrid)
+        create_subelement(self._xml, 'code', code)
+        create_subelement(self._xml, 'count', str(count))
+        create_subelement(self._xml, 'firstSeen', _time(first_seen))
+        create_subelement(self._xml, 'lastSeen', _time(last_seen))
+        if last_value is not None:
+            create_subelement(self._xml, 'lastValue', str(last_value))
+
+
+class AlarmList(ContainsXml):
+    """ A list of alarms, newest first. """
+    _xml_tag = 'AlarmList'
+
+    def __init__(self, href: str, alarms: list[ContainsXml]):
+        """ Constructs a list of alarms or alarm summaries.
+
+        Params:
+            href: The URI/URL to access this resource at.
+            alarms: The alarms, or alarm summaries, in the list.
+        """
+        count = str(len(alarms))
+        super().__init__(
+            self._xml_tag, {'href': href, 'all': count, 'results': count}
+        )
+        for alarm in alarms:
+            self._xml.append(alarm.xml())
+
+
+class AlarmSummaryList(AlarmList):
+    """ A list of alarm summaries. """
+    _xml_tag = 'AlarmSummaryList'
@@ -1,4 +1,5 @@
 from __future__ import annotations
+from pathlib import Path
 from typing import NamedTuple, TypeAlias
 from lxml import etree as ET
 
@@ -23,8 +24,13 @@ class ControlValue(NamedTuple):
 
 CurveControlValue: TypeAlias = ControlValue
 
+# Constants
+# IEEE 2030.5 schema subset for the control messages below
+CONTROL_SCHEMA_PATH = Path(__file__).with_name('der_control.xsd')
+
 
 # Classes
+# pylint: disable-next=too-many-instance-attributes
 class DefaultControl(ContainsXml):
     """ A DER Control message that does not have associated timing. i.e. the
         control that should be in place when no time-specific controls are
@@ -40,6 +46,7 @@ class DefaultControl(ContainsXml):
         mrid: str,
         description: str,
         controls: tuple[list[ControlValue], list[CurveControlValue]],
+        xml: ET.Element = None,
     ):
         """ Constructs a Default Control message object.
 
@@ -52,6 +59,8 @@ class DefaultControl(ContainsXml):
             description: A textual description of the control message.
             controls: A list of control values (a single value control) and a
                 list of curve control values (x,y function control).
+            xml: An existing XML representation of the message to use, rather
+                than constructing one from the other values.
         """
         self._attribs = {
             "href": href,
@@ -63,6 +72,10 @@ class DefaultControl(ContainsXml):
         self._description = description
         self._controls = controls
 
+        if xml is not None:
+            self._xml = xml
+            return
+
         super().__init__(self._xml_tag, self._attribs)
         self._construct()
 
@@ -92,6 +105,11 @@ class DefaultControl(ContainsXml):
             )
 
 
+    @property
+    def mrid(self) -> str:
+        """ (str) The mRID of the device the control applies to. """
+        return self._mrid
+
     def get_values(self) -> dict:
         return {
             **self._attribs,
@@ -117,6 +135,7 @@ class Control(DefaultControl):
         interval: Interval,
         status: EventStatus,
         controls: tuple[list[ControlValue], list[CurveControlValue]],
+        xml: ET.Element = None,
     ):
         """ Constructs a Control message object.
 
@@ -137,12 +156,22 @@ class Control(DefaultControl):
                 might (potentially) be superceded.
             controls: A list of control values (a single value control) and a
                 list of curve control values (x,y function control).
+            xml: An existing XML representation of the message to use, rather
+                than constructing one from the other values.
         """
         self._description = description
         self._creation_time = str(creation_time)
         self._interval = interval
         self._status = status
-        super().__init__(href, reply_to, responses, mrid, description, controls)
+        super().__init__(
+            href,
+            reply_to,
+            responses,
+            mrid,
+            description,
+            controls,
+            xml
+        )
 
 
     def _construct(self):
@@ -175,6 +204,31 @@ class Control(DefaultControl):
         }
 
 
+def _children(root: ET.Element) -> dict[str, ET.Element]:
+    """ Map the tags of an element's children to the first child with each
+        tag, in a single pass over the children. Comments and processing
+        instructions are skipped.
+    """
+    children = {}
+    for child in root:
+        if isinstance(child.tag, str) and child.tag not in children:
+            children[child.tag] = child
+
+    return children
+
+
+def _child(children: dict[str, ET.Element], tag: str) -> ET.Element:
+    """ Get a required child from the result of `_children`.
+
+    Raises:
+        ValueError: If there is no child with the given tag.
+    """
+    try:
+        return children[tag]
+    except KeyError:
+        raise ValueError(f"Missing '{tag}' element") from None
+
+
 def _parse_control_base(
     ctrl_base_root: ET.Element
 ) -> tuple[list[ControlValue], list[CurveControlValue]]:
@@ -183,6 +237,9 @@ def _parse_control_base(
     curve_controls = []
 
     for child in ctrl_base_root:
+        if not isinstance(child.tag, str):
+            continue
+
         if child.attrib:
             curve_controls.append(
                 CurveControlValue(child.tag, child.attrib['href'])
@@ -195,16 +252,18 @@ def _parse_control_base(
 
 def _parse_control_interval(interval_root: ET.Element) -> Interval:
     """ Reconstruct DER interval values from an interval xml element """
-    duration = interval_root.xpath('duration')[0].text
-    start = interval_root.xpath('start')[0].text
+    children = _children(interval_root)
+    duration = _child(children, 'duration').text
+    start = _child(children, 'start').text
     return Interval(int(duration), int(start))
 
 
 def _parse_control_status(status_root: ET.Element) -> EventStatus:
     """ Reconstruct DER event status  values from an EventStatus xml element """
-    status = status_root.xpath('currentStatus')[0].text
-    date = status_root.xpath('dateTime')[0].text
-    superceded = status_root.xpath('potentiallySuperceded')[0].text
+    children = _children(status_root)
+    status = _child(children, 'currentStatus').text
+    date = _child(children, 'dateTime').text
+    superceded = _child(children, 'potentiallySuperceded').text
     return EventStatus(
         int(status),
         int(date),
@@ -214,17 +273,22 @@ def _parse_control_status(status_root: ET.Element) -> EventStatus:
 
 def parse_control(ctrl_root: ET.Element):
     """ Reconstruct a DER Control message (default or not) based on a DERControl
-        or DERDefaultControl xml element.
+        or DERDefaultControl xml element. The element is kept as the XML
+        representation of the returned message, rather than being rebuilt.
+
+    Raises:
+        ValueError: If a required element is missing.
     """
     # Get DER Control element's attributes
     control_attrs = ctrl_root.attrib
+    children = _children(ctrl_root)
 
     # Get children common to all control types
-    mrid = ctrl_root.xpath('mRID')[0].text
-    description = ctrl_root.xpath('description')[0].text
+    mrid = _child(children, 'mRID').text
+    description = _child(children, 'description').text
 
     # Get control values
-    control_values = _parse_control_base(ctrl_root.xpath('DERControlBase')[0])
+    control_values = _parse_control_base(_child(children, 'DERControlBase'))
 
     # Return early if default control
     if ctrl_root.tag == 'DefaultDERControl':
@@ -234,13 +298,14 @@ def parse_control(ctrl_root: ET.Element):
             control_attrs['responsesRequired'],
             mrid,
             description,
-            control_values
+            control_values,
+            ctrl_root
         )
 
     # Get remaining values
-    creation_time = ctrl_root.xpath('creationTime')[0].text
-    interval = _parse_control_interval(ctrl_root.xpath('interval')[0])
-    status = _parse_control_status(ctrl_root.xpath('EventStatus')[0])
+    creation_time = _child(children, 'creationTime').text
+    interval = _parse_control_interval(_child(children, 'interval'))
+    status = _parse_control_status(_child(children, 'EventStatus'))
 
     return Control(
         control_attrs['href'],
@@ -251,5 +316,6 @@ def parse_control(ctrl_root: ET.Element):
         creation_time,
         interval,
         status,
-        control_values
+        control_values,
+        ctrl_root
     )
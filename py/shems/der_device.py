@@ -1,5 +1,6 @@
 from __future__ import annotations
-from typing import TypeAlias
+import io
+from typing import Iterable, Iterator, TypeAlias
 from lxml import etree as ET
 
 from common.xml import ContainsXml, create_element, create_subelement
@@ -8,6 +9,9 @@ from common.xml import ContainsXml, create_element, create_subelement
 # Types
 Timestamp: TypeAlias = int
 
+# Constants
+STREAM_CHUNK_SIZE = 16384 # Bytes to buffer before yielding a streamed chunk
+
 
 # Classes
 class Device(ContainsXml):
@@ -98,9 +102,19 @@ class DeviceList(ContainsXml):
     def __init__(
         self,
         href: str,
-        devices: list[Device]
+        devices: list[Device],
+        all_count: int = None,
     ):
-        self._all = self._results = str(len(devices))
+        """ Constructs a device list object.
+
+        Params:
+            href: The URI/URL to access this resource at.
+            devices: The devices in this page of the list.
+            all_count: The number of devices in the full list. Defaults to the
+                number of devices given.
+        """
+        self._results = str(len(devices))
+        self._all = self._results if all_count is None else str(all_count)
         self._attribs = {
             'href': href,
             'all': self._all,
@@ -115,6 +129,86 @@ class DeviceList(ContainsXml):
         for device in self._devices:
             self._xml.append(device.xml())
 
+
+class StatusReading(ContainsXml):
+    """ A device's status at a point in its status history. """
+    _xml_tag = 'StatusReading'
+
+    def __init__(
+        self,
+        change_time: Timestamp,
+        enabled: int,
+        charge_state: float = None,
+    ):
+        """ Constructs a status reading from a device's status history.
+
+        Params:
+            change_time: The timestamp the status was read at.
+            enabled: Truthian value indicating if the device was operational.
+            charge_state: The charge state of the device, if known.
+        """
+        super().__init__(self._xml_tag)
+        create_subelement(self._xml, 'changedTime', str(int(change_time)))
+        create_subelement(self._xml, 'enabled', str(int(enabled)))
+        if charge_state is not None:
+            create_subelement(self._xml, 'chargeState', str(charge_state))
+
+
+class StatusHistory(ContainsXml):
+    """ The recent status readings of a device. """
+    _xml_tag = 'StatusHistory'
+
+    def __init__(self, href: str, readings: list[StatusReading]):
+        """ Constructs the status history of a device.
+
+        Params:
+            href: The URI/URL to access this resource at.
+            readings: The status readings in the history, oldest first.
+        """
+        count = str(len(readings))
+        super().__init__(
+            self._xml_tag, {'href': href, 'all': count, 'results': count}
+        )
+        for reading in readings:
+            self._xml.append(reading.xml())
+
+
+def stream_device_list(
+    href: str,
+    all_count: int,
+    results: int,
+    devices: Iterable[Device],
+) -> Iterator[bytes]:
+    """ Serialise an EndDeviceList incrementally, without holding the whole
+        list in memory. Yields chunks of roughly STREAM_CHUNK_SIZE bytes.
+
+    Params:
+        href: The URI/URL to access this resource at.
+        all_count: The number of devices in the full list.
+        results: The number of devices that `devices` will produce.
+        devices: The devices in this page of the list.
+    """
+    # Writes the same element as DeviceList, with the same formatting
+    # pylint: disable=protected-access
+    attribs = {'href': href, 'all': str(all_count), 'results': str(results)}
+    out = io.BytesIO()
+
+    def drain() -> bytes:
+        chunk = out.getvalue()
+        out.seek(0)
+        out.truncate()
+        return chunk
+
+    with ET.xmlfile(out) as xf:
+        with xf.element(DeviceList._xml_tag, attribs):
+            for device in devices:
+                xf.write(device.xml(), pretty_print=ContainsXml._pp)
+                xf.flush()
+                if out.tell() >= STREAM_CHUNK_SIZE:
+                    yield drain()
+    yield drain()
+
+
 def parse_device(dev_root: ET.Element):
     """ Reconstruct a DER device message based on a DER device xml element. """
     device_attrs = dev_root.attrib
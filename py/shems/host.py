@@ -0,0 +1,77 @@
+"""
+File: shems/host.py
+Email: e.roderick@uqconnect.edu.au
+Description: Identity of the host running the SHEMS server. The host mRID and
+    network addresses are found once and then served from memory. Addresses
+    are only scanned again when refreshed.
+"""
+
+import ipaddress
+import logging
+import threading
+import uuid
+from typing import Union
+
+from common.connect import get_addresses
+from shems.mrid import get_device_mrid
+
+# Types
+Address = Union[ipaddress.IPv4Address, ipaddress.IPv6Address]
+
+
+# Classes
+class HostIdentity():
+    """ The mRID and connectable addresses of the host. """
+    def __init__(self) -> None:
+        self._mrid = get_device_mrid()
+        self._lock = threading.Lock()
+        self._addresses = None
+
+    @property
+    def mrid(self) -> uuid.UUID:
+        """ (uuid.UUID) The host's mRID. """
+        return self._mrid
+
+    @property
+    def addresses(self) -> list[tuple['address', 'network']]:
+        """ (list[tuple[address, network]]) The host's connectable addresses,
+            as of the last refresh. See common.connect.get_addresses.
+        """
+        if self._addresses is None:
+            self.refresh()
+        return self._addresses
+
+    @property
+    def address(self) -> Address:
+        """ (Address) The host's primary address, as of the last refresh. """
+        return self.addresses[0][0]
+
+    def refresh(self) -> bool:
+        """ Scan the network adapters for the host's addresses.
+
+        Returns:
+            True if the primary address has changed since the last refresh.
+            False otherwise, including on the first scan.
+        """
+        addresses = get_addresses()
+        with self._lock:
+            previous = self._addresses
+            self._addresses = addresses
+
+        old = previous[0][0] if previous else None
+        new = addresses[0][0] if addresses else None
+        changed = previous is not None and old != new
+        if changed:
+            logging.info("Host address changed from %s to %s", old, new)
+
+        return changed
+
+
+# Shared identity of this host
+_host = HostIdentity()
+
+
+# Functions
+def get_host() -> HostIdentity:
+    """ (HostIdentity) The identity of the host running this server. """
+    return _host
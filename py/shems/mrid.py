@@ -1,8 +1,10 @@
+import functools
 import uuid
 
+@functools.cache
 def get_device_mrid() -> uuid.UUID:
     """ Return a UUID mRID that is based on device address information, making
-        the host identifiable.
+        the host identifiable. Computed once, as the hardware address is fixed.
     """
     return uuid.uuid3(uuid.NAMESPACE_URL, str(uuid.getnode()))
 
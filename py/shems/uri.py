@@ -1,7 +1,7 @@
 import ipaddress, sys
 from enum import Enum
 
-from common.connect import get_addresses
+from shems.host import get_host
 
 
 # Enums
@@ -13,6 +13,7 @@ class UriType(Enum):
     DEVICE = "DEVICE"
     ALARM = "ALARM"
     NOTIFY = "NOTIFY"
+    READINGS = "READINGS"
 
 
 # Constants
@@ -23,6 +24,7 @@ URI_PATHS = {
         UriType.DEVICE: "dev/{}/",
         UriType.ALARM: "alm/",
         UriType.NOTIFY: "ntfy/",
+        UriType.READINGS: "rdg/",
     },
 }
 DEVICE_ID_URI_SEG = "id/{}"
@@ -43,8 +45,8 @@ def get_uri(
     dev_id: str = None,
 ) -> str:
     if ip_addr is None:
-        # Store the first IP address from the devices networks
-        ip_addr = get_addresses()[0][0]
+        # Use the host's primary address
+        ip_addr = get_host().address
 
     # Ensure required args are given
     if uri_type == UriType.DEVICE and dev_id is None:
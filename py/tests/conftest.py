@@ -0,0 +1,40 @@
+"""
+File: tests/conftest.py
+Email: e.roderick@uqconnect.edu.au
+Description: Shared test setup. Points the database, relayed control files and
+    MQTT broker at scratch stand-ins before any project module reads them.
+"""
+
+import os
+import tempfile
+from typing import Iterator
+
+import pytest
+
+from benchmarks.broker import StandInBroker
+
+_tmp = tempfile.mkdtemp(prefix="shems-test-")
+os.makedirs(os.path.join(_tmp, "data"))
+_broker = StandInBroker().start()
+
+os.environ['SHEMS_DB_PATH'] = os.path.join(_tmp, "test.sqlite3")
+os.environ['SHEMS_DATA_PATH'] = os.path.join(_tmp, "data")
+os.environ['MQTT_ADDR'] = _broker.address[0]
+os.environ['MQTT_PORT'] = str(_broker.address[1])
+
+# pylint: disable=wrong-import-position
+from database import _dev_access
+from dispatch.state import DEVICE_REGISTRY
+import database.access as db
+
+
+@pytest.fixture
+def database() -> Iterator[None]:
+    """ Start from an empty database and device registry. """
+    _dev_access.create_database()
+    with db.transaction() as con:
+        for table in _dev_access.TABLES[::-1]:
+            con.execute("DELETE FROM " + table.partition('(')[0])
+    DEVICE_REGISTRY.clear()
+    yield
+    DEVICE_REGISTRY.clear()
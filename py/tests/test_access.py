@@ -0,0 +1,128 @@
+"""
+File: tests/test_access.py
+Email: e.roderick@uqconnect.edu.au
+Description: Tests of the pooled, long-lived connections of the database
+    access layer, and of the transactions and savepoints that batch writes.
+"""
+
+# pylint: disable=missing-function-docstring,redefined-outer-name
+
+import sqlite3 as sql
+import threading
+
+import pytest
+
+from database.access import ConnectionManager
+
+
+@pytest.fixture
+def manager(tmp_path) -> ConnectionManager:
+    manager = ConnectionManager(str(tmp_path / "access.sqlite3"), readers=2)
+    con = manager.writer()
+    con.execute("CREATE TABLE values_test(value)")
+    con.execute("INSERT INTO values_test VALUES (1)")
+    con.commit()
+    yield manager
+    manager.close()
+
+
+def test_writer_uses_wal(manager):
+    [mode] = manager.writer().execute("PRAGMA journal_mode").fetchone()
+    assert mode == "wal"
+
+
+def test_writer_is_kept_per_thread(manager):
+    writers = []
+    thread = threading.Thread(target=lambda: writers.append(manager.writer()))
+    thread.start()
+    thread.join()
+
+    assert manager.writer() is manager.writer()
+    assert writers[0] is not manager.writer()
+
+
+def test_readers_are_read_only(manager):
+    with manager.reader() as con:
+        assert con.execute("SELECT value FROM values_test").fetchall() == [(1,)]
+        with pytest.raises(sql.OperationalError):
+            con.execute("INSERT INTO values_test VALUES (2)")
+
+
+def test_readers_are_reused(manager):
+    with manager.reader() as con:
+        first = con
+    with manager.reader() as con:
+        assert con is first
+
+
+def test_readers_see_committed_writes(manager):
+    with manager.reader() as con:
+        con.execute("SELECT 1").fetchone()
+
+    writer = manager.writer()
+    writer.execute("INSERT INTO values_test VALUES (2)")
+    writer.commit()
+    with manager.reader() as con:
+        rows = con.execute("SELECT value FROM values_test").fetchall()
+    assert rows == [(1,), (2,)]
+
+
+def test_savepoint_rollback_drops_its_callbacks(manager):
+    ran = []
+    with manager.transaction():
+        manager.on_commit(lambda: ran.append("before"))
+        with pytest.raises(RuntimeError):
+            with manager.savepoint():
+                manager.on_commit(lambda: ran.append("rolled back"))
+                raise RuntimeError("handler failed")
+        manager.on_commit(lambda: ran.append("after"))
+
+        # Nothing runs until the transaction commits
+        assert not ran
+
+    assert ran == ["before", "after"]
+
+
+def test_savepoint_rollback_keeps_other_writes(manager):
+    with manager.transaction() as con:
+        con.execute("INSERT INTO values_test VALUES (2)")
+        with pytest.raises(RuntimeError):
+            with manager.savepoint():
+                con.execute("INSERT INTO values_test VALUES (3)")
+                raise RuntimeError("handler failed")
+
+    with manager.reader() as con:
+        rows = con.execute("SELECT value FROM values_test").fetchall()
+    assert rows == [(1,), (2,)]
+
+
+def test_transaction_rollback_drops_every_callback(manager):
+    ran = []
+    with pytest.raises(RuntimeError):
+        with manager.transaction() as con:
+            con.execute("INSERT INTO values_test VALUES (2)")
+            manager.on_commit(lambda: ran.append("rolled back"))
+            raise RuntimeError("batch failed")
+
+    # The next transaction does not run callbacks left from the failed one
+    with manager.transaction():
+        pass
+    assert not ran
+    with manager.reader() as con:
+        rows = con.execute("SELECT value FROM values_test").fetchall()
+    assert rows == [(1,)]
+
+
+def test_commit_is_deferred_in_a_transaction(manager):
+    with manager.transaction() as con:
+        con.execute("INSERT INTO values_test VALUES (2)")
+        manager.commit()
+        with manager.reader() as reader:
+            count = reader.execute("SELECT COUNT(*) FROM values_test")
+            assert count.fetchone() == (1,)
+
+
+def test_on_commit_outside_a_transaction_runs_at_once(manager):
+    ran = []
+    manager.on_commit(lambda: ran.append("now"))
+    assert ran == ["now"]
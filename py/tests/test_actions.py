@@ -0,0 +1,265 @@
+"""
+File: tests/test_actions.py
+Email: e.roderick@uqconnect.edu.au
+Description: Tests of the dispatcher's handlers, run against a scratch
+    database, and of the order they see each device's items in.
+"""
+
+# pylint: disable=missing-function-docstring,protected-access
+# pylint: disable=redefined-outer-name,unused-argument
+
+import sqlite3 as sql
+import threading
+import time
+
+import pytest
+
+from common.thread_control import ThreadCloser
+from database.constants import DEVICE_STATUS_ON
+from dispatch import actions, dispatch
+from dispatch.actions import buffer_dispatch, DispatchAction, DispatchData
+from dispatch.actions import handle_clean_controls, handle_control_msg
+from dispatch.actions import handle_control_revert, handle_listener_alarm
+from dispatch.actions import handle_listener_dev, handle_state_flush
+from dispatch.state import DEVICE_REGISTRY
+from shems.der_control import ControlValue, DefaultControl
+import database.access as db
+
+# Constants
+DEVICES = 50
+PAIRS = 2000
+
+
+# Functions
+def _read(query: str, args: tuple = ()) -> list[tuple]:
+    with db.get_reader() as con:
+        return con.execute(query, args).fetchall()
+
+
+@pytest.mark.parametrize("workers", [1, 4])
+def test_alarms_follow_announcements_of_new_devices(monkeypatch, database,
+                                                    workers):
+    monkeypatch.setattr(dispatch, "DISPATCH_WORKERS", workers)
+    monkeypatch.setattr(dispatch, "DISPATCH_TELEMETRY_SIZE", 0)
+    buffer = dispatch.create_dispatch_buffer()
+
+    # Every device is new, so each alarm is only stored if the announcement
+    # queued ahead of it was handled first
+    for i in range(PAIRS):
+        mrid = f"dev-{i % DEVICES}"
+        buffer_dispatch(buffer, DispatchAction.LISTEN_RECV_DEV,
+                        (mrid, "10.0.0.1", "Device", str(i)))
+        buffer_dispatch(buffer, DispatchAction.LISTEN_RECV_ALARM,
+                        (mrid, "ALM", str(i), "1"))
+    buffer.notify_finish()
+
+    closer = ThreadCloser()
+    closer.set_active()
+    dispatcher = threading.Thread(target=dispatch.dispatcher_t,
+                                  args=(buffer, closer))
+    dispatcher.start()
+    dispatcher.join(timeout=60)
+    assert not dispatcher.is_alive()
+    assert _read("SELECT COUNT(*) FROM alarms") == [(PAIRS,)]
+
+
+def test_older_announcement_does_not_replace_status(database):
+    handle_listener_dev(("dev-0", "10.0.0.1", "Device", "100"))
+    handle_listener_alarm(("dev-0", "ALM", "500", "1", "0.6"))
+    handle_listener_dev(("dev-0", "10.0.0.2", "Device", "400"))
+
+    assert _read("SELECT reading_time, connect_status, charge_state "
+                 "FROM status") == [(500, DEVICE_STATUS_ON, 0.6)]
+    assert _read("SELECT last_ip FROM devices") == [("10.0.0.1",)]
+    assert (400,) in _read("SELECT reading_time FROM status_history")
+
+
+def test_unchanged_announcement_is_held_until_flush(database):
+    handle_listener_dev(("dev-0", "10.0.0.1", "Device", "100"))
+    handle_listener_dev(("dev-0", "10.0.0.1", "Device", "200"))
+    assert _read("SELECT reading_time FROM status") == [(100,)]
+    assert DEVICE_REGISTRY.get("dev-0").reading_time == 200
+
+    handle_state_flush()
+    assert _read("SELECT reading_time FROM status") == [(200,)]
+    assert not DEVICE_REGISTRY.dirty()
+
+
+def test_changed_announcement_is_stored(database):
+    handle_listener_dev(("dev-0", "10.0.0.1", "Device", "100"))
+    handle_listener_dev(("dev-0", "10.0.0.2", "Device", "200"))
+    assert _read("SELECT last_ip, reading_time "
+                 "FROM devices JOIN status USING (dev_id)") == [
+        ("10.0.0.2", 200)
+    ]
+    assert not DEVICE_REGISTRY.dirty()
+
+
+def test_announcements_stored_without_flush(monkeypatch, database):
+    monkeypatch.setattr(actions, "SHEMS_STATE_FLUSH", 0)
+    handle_listener_dev(("dev-0", "10.0.0.1", "Device", "100"))
+    handle_listener_dev(("dev-0", "10.0.0.1", "Device", "200"))
+    assert _read("SELECT reading_time FROM status") == [(200,)]
+    assert not DEVICE_REGISTRY.dirty()
+
+
+def test_older_alarm_keeps_held_state(database):
+    handle_listener_dev(("dev-0", "10.0.0.1", "Device", "100"))
+    handle_listener_dev(("dev-0", "10.0.0.1", "Device", "300"))
+    handle_listener_alarm(("dev-0", "ALM", "150", "1"))
+    assert DEVICE_REGISTRY.dirty()["dev-0"].reading_time == 300
+
+    handle_state_flush()
+    assert _read("SELECT reading_time FROM status") == [(300,)]
+    assert (150,) in _read("SELECT reading_time FROM status_history")
+
+
+def test_newer_alarm_replaces_held_state(database):
+    handle_listener_dev(("dev-0", "10.0.0.1", "Device", "100"))
+    handle_listener_dev(("dev-0", "10.0.0.1", "Device", "200"))
+    handle_listener_alarm(("dev-0", "ALM", "250", "1", "0.5"))
+    assert not DEVICE_REGISTRY.dirty()
+    assert DEVICE_REGISTRY.get("dev-0").charge_state == 0.5
+    assert _read("SELECT reading_time FROM status") == [(250,)]
+
+
+def test_repeated_alarm_keeps_first_state(database):
+    dispatch.dispatch_batch([
+        DispatchData(DispatchAction.LISTEN_RECV_DEV,
+                     ("dev-0", "10.0.0.1", "Device", "100")),
+        DispatchData(DispatchAction.LISTEN_RECV_ALARM,
+                     ("dev-0", "ALM", "500", "1", "0.4")),
+        DispatchData(DispatchAction.LISTEN_RECV_ALARM,
+                     ("dev-0", "ALM", "500", "1", "0.9")),
+    ])
+    assert DEVICE_REGISTRY.get("dev-0").charge_state == 0.4
+    assert _read("SELECT reading_time, charge_state FROM status") == [
+        (500, 0.4)
+    ]
+    assert _read("SELECT COUNT(*) FROM alarms") == [(1,)]
+
+
+def test_failed_commit_reloads_registry(monkeypatch, database):
+    handle_listener_dev(("dev-0", "10.0.0.1", "Device", "100"))
+
+    def fail(*_):
+        raise sql.OperationalError("disk I/O error")
+
+    monkeypatch.setattr(db._manager, "_commit", fail)
+    dispatch.dispatch_batch([
+        DispatchData(DispatchAction.LISTEN_RECV_DEV,
+                     ("dev-1", "10.0.0.2", "Device", "100")),
+        DispatchData(DispatchAction.LISTEN_RECV_DEV,
+                     ("dev-0", "10.0.0.1", "Device", "200")),
+    ])
+    monkeypatch.undo()
+
+    assert "dev-1" not in DEVICE_REGISTRY
+    assert DEVICE_REGISTRY.get("dev-0").reading_time == 100
+    assert not DEVICE_REGISTRY.dirty()
+    assert _read("SELECT dev_id FROM devices") == [("dev-0",)]
+
+
+def test_controls_only_for_known_devices(monkeypatch, database):
+    relayed = []
+    monkeypatch.setattr(actions, "_relay_controls", relayed.extend)
+    handle_listener_dev(("dev-0", "10.0.0.1", "Device", "100"))
+
+    for mrid in ("dev-0", "dev-9"):
+        control = DefaultControl("/ctrl", "/reply", 0, mrid, "Limit", (
+            [ControlValue("opModMaxLimW", "50")], []
+        ))
+        handle_control_msg((control, None))
+
+    assert _read("SELECT dev_id, code, value, is_default FROM settings") == [
+        ("dev-0", "opModMaxLimW", "50", True)
+    ]
+    assert relayed == [ControlValue("opModMaxLimW", "50")]
+
+
+class _Scheduler():
+    """ Records the actions placed on it instead of dispatching them. """
+    def __init__(self) -> None:
+        self.scheduled = []
+
+    def schedule(self, key, due, action, data=None) -> None:
+        self.scheduled.append((key, due, action, data))
+
+
+@pytest.fixture
+def expired(monkeypatch, database) -> list:
+    """ Five expired controls of a device, each overriding a default.
+
+    Returns:
+        The controls relayed, in the order they are relayed.
+    """
+    relayed = []
+    monkeypatch.setattr(actions, "_relay_controls", relayed.extend)
+    monkeypatch.setattr(actions, "SHEMS_CONTROL_SWEEP_BATCH", 2)
+    handle_listener_dev(("dev-0", "10.0.0.1", "Device", "100"))
+    with db.transaction() as con:
+        for i in range(5):
+            con.execute("INSERT INTO settings VALUES "
+                        "('dev-0', ?, 'on', True, NULL, NULL, NULL, NULL)",
+                        (f"code-{i}",))
+            con.execute("INSERT INTO settings VALUES "
+                        "('dev-0', ?, 'off', False, 0, 0, 10, ?)",
+                        (f"code-{i}", 10 + i))
+    return relayed
+
+
+def test_sweep_removes_oldest_batch(expired):
+    scheduler = _Scheduler()
+    before = time.time()
+    handle_clean_controls(scheduler)
+
+    assert _read("SELECT code FROM settings WHERE is_default = False "
+                 "ORDER BY code") == [("code-2",), ("code-3",), ("code-4",)]
+    assert expired == [ControlValue("code-0", "on"),
+                       ControlValue("code-1", "on")]
+
+    # A full batch means more may remain, so the next sweep is soon
+    assert len(scheduler.scheduled) == 1
+    key, due, action, data = scheduler.scheduled[0]
+    assert key == action == DispatchAction.CONTROL_CLEAN
+    assert data is scheduler
+    assert before + actions.CONTROL_SWEEP_PAUSE <= due < before + 5
+
+
+def test_sweep_drains_then_slows(expired):
+    scheduler = _Scheduler()
+    handle_clean_controls(scheduler)
+    handle_clean_controls(scheduler)
+    before = time.time()
+    handle_clean_controls(scheduler)
+    assert _read("SELECT COUNT(*) FROM settings WHERE is_default = False") \
+        == [(0,)]
+    assert len(expired) == 5
+
+    # The last sweep found less than a batch
+    assert scheduler.scheduled[-1][1] >= before + actions.SHEMS_CONTROL_SWEEP
+
+
+def test_sweep_reschedules_after_error(monkeypatch, expired):
+    def fail(*_):
+        raise sql.OperationalError("disk I/O error")
+
+    scheduler = _Scheduler()
+    monkeypatch.setattr(actions, "_relay_defaults", fail)
+    with pytest.raises(sql.OperationalError), db.transaction():
+        handle_clean_controls(scheduler)
+    assert len(scheduler.scheduled) == 1
+    assert _read("SELECT COUNT(*) FROM settings WHERE is_default = False") \
+        == [(5,)]
+
+
+def test_revert_keeps_superseding_control(expired):
+    with db.transaction() as con:
+        con.execute("UPDATE settings SET finish_time = ? WHERE code = 'code-0'"
+                    " AND is_default = False", (time.time() + 60,))
+    handle_control_revert(("dev-0", "code-0"))
+    handle_control_revert(("dev-0", "code-1"))
+
+    assert _read("SELECT code FROM settings WHERE is_default = False "
+                 "AND code IN ('code-0', 'code-1')") == [("code-0",)]
+    assert expired == [ControlValue("code-1", "on")]
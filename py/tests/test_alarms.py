@@ -0,0 +1,111 @@
+"""
+File: tests/test_alarms.py
+Email: e.roderick@uqconnect.edu.au
+Description: Tests of alarm history storage, pruning and summaries, and of the
+    alarm resource responses.
+"""
+
+# pylint: disable=missing-function-docstring,redefined-outer-name
+# pylint: disable=unused-argument
+
+import pytest
+from fastapi import HTTPException
+from lxml import etree as ET
+
+from database.alarms import prune_alarms
+from dispatch.actions import handle_listener_alarm, handle_listener_dev
+from server import response
+from server.request import ListParams
+import database.access as db
+
+
+# Functions
+@pytest.fixture
+def alarms(database) -> None:
+    """ Two devices, with alarms raised at t=100 to t=105. """
+    for mrid in ("dev-0", "dev-1"):
+        handle_listener_dev((mrid, "10.0.0.1", "Device", "50"))
+    for i in range(6):
+        handle_listener_alarm((f"dev-{i % 2}", "ALM", str(100 + i), str(i)))
+
+
+def _children(body: bytes, tag: str) -> list[list[str]]:
+    """ The text of each child of the listed elements. """
+    root = ET.fromstring(body)
+    return [[child.text for child in item] for item in root.iter(tag)]
+
+
+def _alarm_times(body: bytes) -> list[str]:
+    return [fields[2] for fields in _children(body, 'Alarm')]
+
+
+def test_alarms_newest_first(alarms):
+    body = response.handle_read_alarms(ListParams(), {}).body
+    assert _alarm_times(body) == ["105", "104", "103", "102", "101", "100"]
+    assert ET.fromstring(body).get('results') == "6"
+
+
+def test_alarms_after_and_limit(alarms):
+    body = response.handle_read_alarms(ListParams(after=102), {}).body
+    assert _alarm_times(body) == ["105", "104", "103"]
+    body = response.handle_read_alarms(ListParams(limit=2), {}).body
+    assert _alarm_times(body) == ["105", "104"]
+
+
+def test_alarms_of_device(alarms):
+    body = response.handle_read_alarms(ListParams(), {}, "dev-1").body
+    assert _children(body, 'Alarm') == [
+        ["dev-1", "ALM", "105", "5"],
+        ["dev-1", "ALM", "103", "3"],
+        ["dev-1", "ALM", "101", "1"],
+    ]
+    assert ET.fromstring(body).get('href').endswith("/shem/dev/id/dev-1/alm/")
+
+
+def test_alarms_of_unknown_device(alarms):
+    with pytest.raises(HTTPException) as e:
+        response.handle_read_alarms(ListParams(), {}, "dev-9")
+    assert e.value.status_code == 404
+    with pytest.raises(HTTPException) as e:
+        response.handle_read_alarm_summaries({}, "dev-9")
+    assert e.value.status_code == 404
+
+
+def test_summaries_outlive_pruned_alarms(alarms):
+    assert prune_alarms(103, 10) == 3
+    body = response.handle_read_alarms(ListParams(), {}).body
+    assert _alarm_times(body) == ["105", "104", "103"]
+
+    body = response.handle_read_alarm_summaries({}).body
+    assert sorted(_children(body, 'AlarmSummary')) == [
+        ["dev-0", "ALM", "3", "100", "104", "4"],
+        ["dev-1", "ALM", "3", "101", "105", "5"],
+    ]
+
+
+def test_older_alarm_keeps_last_value(alarms):
+    handle_listener_alarm(("dev-0", "ALM", "90", "late"))
+    body = response.handle_read_alarm_summaries({}, "dev-0").body
+    assert _children(body, 'AlarmSummary') == [
+        ["dev-0", "ALM", "4", "90", "104", "4"],
+    ]
+
+
+def test_alarms_not_modified(alarms):
+    etag = response.handle_read_alarms(ListParams(), {}).headers['etag']
+    not_modified = response.handle_read_alarms(
+        ListParams(), {'if-none-match': etag}
+    )
+    assert not_modified.status_code == 304
+
+    handle_listener_alarm(("dev-0", "ALM", "200", "6"))
+    changed = response.handle_read_alarm_summaries({'if-none-match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['etag'] != etag
+
+
+def test_alarm_prune_in_chunks(alarms):
+    assert prune_alarms(1000, 4) == 4
+    assert prune_alarms(1000, 4) == 2
+    with db.get_reader() as con:
+        assert con.execute("SELECT COUNT(*) FROM alarms").fetchone() == (0,)
@@ -0,0 +1,163 @@
+"""
+File: tests/test_dispatch.py
+Email: e.roderick@uqconnect.edu.au
+Description: Tests of batched dispatching, and of the dispatcher worker pool
+    and the barriers it places around actions over every device.
+"""
+
+# pylint: disable=missing-function-docstring,protected-access
+# pylint: disable=redefined-outer-name
+
+import logging
+import threading
+import time
+
+import pytest
+
+from common.ring_buffer import RingBuffer
+from common.thread_control import ThreadCloser
+from dispatch import dispatch
+from dispatch.actions import buffer_dispatch, DISPATCH_ACTIONS, DispatchAction
+from dispatch.actions import DispatchData
+from dispatch.dispatch import DispatchBarrier
+import database.access as db
+
+# Constants
+WORKERS = 4
+DEVICES = 8
+ITEMS = 400
+BARRIER_EVERY = 50
+
+
+# Functions
+@pytest.fixture
+def handled(monkeypatch) -> list:
+    """ Replace the device and state flush handlers with ones that record
+        their data, in the order they are handled.
+    """
+    handled = []
+    lock = threading.Lock()
+
+    def record(data):
+        with lock:
+            handled.append(data)
+
+    monkeypatch.setitem(DISPATCH_ACTIONS, DispatchAction.LISTEN_RECV_DEV,
+                        record)
+    monkeypatch.setitem(DISPATCH_ACTIONS, DispatchAction.STATE_FLUSH, record)
+    return handled
+
+
+def test_dispatch_drops_callbacks_of_failed_items(monkeypatch):
+    ran = []
+
+    def handle(data):
+        name, fail = data
+        db.on_commit(lambda: ran.append(name))
+        if fail:
+            raise RuntimeError(f"{name} failed")
+
+    monkeypatch.setitem(DISPATCH_ACTIONS, DispatchAction.LISTEN_RECV_DEV,
+                        handle)
+    dispatch.dispatch_batch([
+        DispatchData(DispatchAction.LISTEN_RECV_DEV, ("first", False)),
+        DispatchData(DispatchAction.LISTEN_RECV_DEV, ("second", True)),
+        DispatchData(DispatchAction.LISTEN_RECV_DEV, ("third", False)),
+    ])
+    assert ran == ["first", "third"]
+
+
+def test_dispatch_keeps_writes_of_other_items(monkeypatch):
+    _, cur = db.get_cursor()
+    cur.execute("CREATE TABLE IF NOT EXISTS dispatch_test(name)")
+    cur.execute("DELETE FROM dispatch_test")
+    db.commit()
+
+    def handle(data):
+        name, fail = data
+        db.get_cursor()[1].execute("INSERT INTO dispatch_test VALUES (?)",
+                                   (name,))
+        if fail:
+            raise RuntimeError(f"{name} failed")
+
+    monkeypatch.setitem(DISPATCH_ACTIONS, DispatchAction.LISTEN_RECV_DEV,
+                        handle)
+    dispatch.dispatch_batch([
+        DispatchData(DispatchAction.LISTEN_RECV_DEV, ("first", False)),
+        DispatchData(DispatchAction.LISTEN_RECV_DEV, ("second", True)),
+        DispatchData(DispatchAction.LISTEN_RECV_DEV, ("third", False)),
+    ])
+    with db.get_reader() as con:
+        rows = con.execute("SELECT name FROM dispatch_test").fetchall()
+    assert rows == [("first",), ("third",)]
+
+
+@pytest.mark.parametrize("batch_size", [1, 16])
+def test_pool_keeps_order_across_barriers(monkeypatch, handled, batch_size):
+    monkeypatch.setattr(dispatch, "DISPATCH_BATCH_SIZE", batch_size)
+    buffer = RingBuffer(0, overlap=False)
+    closer = ThreadCloser()
+    closer.set_active()
+    pool = threading.Thread(target=dispatch._dispatcher_pool_t,
+                            args=(buffer, closer, WORKERS))
+    pool.start()
+
+    # Every item carries its position in the buffer
+    for i in range(ITEMS):
+        if i % BARRIER_EVERY == BARRIER_EVERY - 1:
+            buffer_dispatch(buffer, DispatchAction.STATE_FLUSH, (None, i))
+        else:
+            buffer_dispatch(buffer, DispatchAction.LISTEN_RECV_DEV,
+                            (f"dev-{i % DEVICES}", i))
+    buffer.notify_finish()
+    pool.join(timeout=30)
+    assert not pool.is_alive()
+    assert sorted(i for _, i in handled) == list(range(ITEMS))
+
+    for device in range(DEVICES):
+        positions = [i for mrid, i in handled if mrid == f"dev-{device}"]
+        assert positions == sorted(positions)
+
+    # Nothing crosses a barrier in either direction
+    for index, (mrid, i) in enumerate(handled):
+        if mrid is None:
+            assert all(before < i for _, before in handled[:index])
+            assert all(after > i for _, after in handled[index + 1:])
+
+
+def test_barrier_waits_for_a_late_worker(handled, caplog):
+    barrier = DispatchBarrier(2, warn_after=0.05)
+
+    def late_worker():
+        time.sleep(0.3)
+        handled.append("late arrived")
+        barrier.hold()
+
+    workers = [threading.Thread(target=barrier.hold),
+               threading.Thread(target=late_worker)]
+    for worker in workers:
+        worker.start()
+
+    with caplog.at_level(logging.WARNING):
+        barrier.run([DispatchData(DispatchAction.STATE_FLUSH, (None, 0))])
+    for worker in workers:
+        worker.join(timeout=5)
+
+    # The action only ran once every worker had stopped
+    assert handled == ["late arrived", (None, 0)]
+    assert "barrier has waited" in caplog.text
+    assert not any(worker.is_alive() for worker in workers)
+
+
+def test_barrier_holds_workers_until_run(handled):
+    barrier = DispatchBarrier(2)
+    workers = [threading.Thread(target=lambda: (barrier.hold(),
+                                                handled.append("released")))
+               for _ in range(2)]
+    for worker in workers:
+        worker.start()
+
+    barrier.run([DispatchData(DispatchAction.STATE_FLUSH, (None, 0))])
+    for worker in workers:
+        worker.join(timeout=5)
+    assert handled == [(None, 0), "released", "released"]
@@ -0,0 +1,101 @@
+"""
+File: tests/test_metrics.py
+Email: e.roderick@uqconnect.edu.au
+Description: Tests of the process metrics and their text exposition.
+"""
+
+# pylint: disable=missing-function-docstring,protected-access
+# pylint: disable=redefined-outer-name
+
+import pytest
+from fastapi.testclient import TestClient
+
+from common import metrics
+from dispatch import dispatch
+from dispatch.actions import DISPATCH_ACTIONS, DispatchAction, DispatchData
+from server.server import shems_server
+
+
+@pytest.fixture
+def registry(monkeypatch) -> metrics.Registry:
+    """ A registry for metrics made by a test, apart from the shared one. """
+    registry = metrics.Registry()
+    monkeypatch.setattr(metrics, "REGISTRY", registry)
+    return registry
+
+
+def _lines(registry: metrics.Registry) -> list[str]:
+    return registry.render().splitlines()
+
+
+def test_counter(registry):
+    counter = metrics.Counter("shems_test_total", "Test.", ("action",))
+    counter.inc("a")
+    counter.inc("a")
+    counter.inc("b", amount=3)
+
+    assert _lines(registry) == [
+        "# HELP shems_test_total Test.",
+        "# TYPE shems_test_total counter",
+        'shems_test_total{action="a"} 2',
+        'shems_test_total{action="b"} 3',
+    ]
+
+
+def test_gauge_from_function(registry):
+    gauge = metrics.Gauge("shems_test_depth", "Test.")
+    gauge.set_function(lambda: 7)
+    lanes = metrics.Gauge("shems_test_lanes", "Test.", ("lane",))
+    lanes.set_function(lambda: {("control",): 0, ("telemetry",): 4})
+
+    lines = _lines(registry)
+    assert "shems_test_depth 7" in lines
+    assert 'shems_test_lanes{lane="control"} 0' in lines
+    assert 'shems_test_lanes{lane="telemetry"} 4' in lines
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    histogram = metrics.Histogram("shems_test_seconds", "Test.",
+                                  buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+
+    assert _lines(registry)[2:] == [
+        'shems_test_seconds_bucket{le="0.1"} 2',
+        'shems_test_seconds_bucket{le="1.0"} 3',
+        'shems_test_seconds_bucket{le="+Inf"} 4',
+        "shems_test_seconds_sum 2.65",
+        "shems_test_seconds_count 4",
+    ]
+
+
+def test_label_values_are_escaped(registry):
+    counter = metrics.Counter("shems_test_total", "Test.", ("topic",))
+    counter.inc('a"b\\c\nd')
+    assert _lines(registry)[-1] == r'shems_test_total{topic="a\"b\\c\nd"} 1'
+
+
+def test_dispatch_counts_handled_and_failed_actions(monkeypatch):
+    def fail():
+        raise RuntimeError("handler failed")
+    monkeypatch.setitem(DISPATCH_ACTIONS, DispatchAction.HOST_REFRESH, fail)
+
+    def count(counter):
+        return counter._values.get((DispatchAction.HOST_REFRESH.value,), 0)
+    handled = count(metrics.DISPATCH_DEQUEUED)
+    errors = count(metrics.DISPATCH_ERRORS)
+
+    dispatch.dispatch_batch([DispatchData(DispatchAction.HOST_REFRESH, None)])
+    assert count(metrics.DISPATCH_DEQUEUED) == handled + 1
+    assert count(metrics.DISPATCH_ERRORS) == errors + 1
+
+
+def test_metrics_endpoint():
+    with TestClient(shems_server) as client:
+        response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == metrics.CONTENT_TYPE
+    for name in ("shems_dispatch_queue_depth", "shems_dispatch_lane_depth",
+                 "shems_scheduler_pending", "shems_db_commit_seconds"):
+        assert f"# TYPE {name} " in response.text
@@ -0,0 +1,109 @@
+"""
+File: tests/test_payload.py
+Email: e.roderick@uqconnect.edu.au
+Description: Tests of the text and binary telemetry payload layouts.
+"""
+
+# pylint: disable=missing-function-docstring
+
+import pytest
+
+from relay import payload
+
+
+# Functions
+def _view(data: str | bytes) -> memoryview:
+    return memoryview(data.encode() if isinstance(data, str) else data)
+
+
+@pytest.mark.parametrize("charge", [None, 0.5])
+def test_device_binary_round_trip(charge):
+    encoded = payload.encode_device("dev-0", "10.0.0.1", "Heat pump", 1000.25,
+                                    charge)
+    assert payload.is_binary(_view(encoded))
+    assert payload.decode_device(_view(encoded)) == (
+        "dev-0", "10.0.0.1", "Heat pump", 1000.25,
+        *(() if charge is None else (charge,))
+    )
+
+
+@pytest.mark.parametrize("charge", [None, 0.25])
+def test_alarm_binary_round_trip(charge):
+    encoded = payload.encode_alarm("dev-0", "OVER_TEMP", 1000.5, 2.5, charge)
+    assert payload.decode_alarm(_view(encoded)) == (
+        "dev-0", "OVER_TEMP", 1000.5, 2.5,
+        *(() if charge is None else (charge,))
+    )
+
+
+def test_readings_binary_round_trip():
+    encoded = payload.encode_readings("dev-0", "W", 1000, 0.5,
+                                      [1.0, 2.5, -3.0])
+    mrid, code, start, interval, samples = \
+        payload.decode_readings(_view(encoded))
+    assert (mrid, code, start, interval) == ("dev-0", "W", 1000, 0.5)
+    assert list(samples) == [1.0, 2.5, -3.0]
+
+
+@pytest.mark.parametrize("decode, encoded", [
+    (payload.decode_device,
+     payload.encode_device("dev-0", "10.0.0.1", "Heat pump", 1000)),
+    (payload.decode_alarm, payload.encode_alarm("dev-0", "ALM", 1000, 1)),
+    (payload.decode_readings,
+     payload.encode_readings("dev-0", "W", 1000, 0.5, [1.0])),
+])
+def test_binary_truncated(decode, encoded):
+    for end in (1, 8, len(encoded) - 1):
+        with pytest.raises(ValueError):
+            decode(_view(encoded[:end]))
+
+
+def test_binary_trailing_bytes():
+    encoded = payload.encode_alarm("dev-0", "ALM", 1000, 1)
+    with pytest.raises(ValueError):
+        payload.decode_alarm(_view(encoded + b"x"))
+
+
+def test_device_text():
+    assert payload.decode_device(_view("dev-0,10.0.0.1,Heat pump,1000")) == (
+        "dev-0", "10.0.0.1", "Heat pump", 1000.0
+    )
+    assert payload.decode_device(
+        _view("dev-0,10.0.0.1,Heat pump,1000,0.5")
+    ) == ("dev-0", "10.0.0.1", "Heat pump", 1000.0, 0.5)
+
+
+def test_alarm_text_keeps_value():
+    assert payload.decode_alarm(_view("dev-0,ALM,1000,open")) == (
+        "dev-0", "ALM", 1000.0, "open"
+    )
+    assert payload.decode_alarm(_view("dev-0,ALM,1000,2.50,0.5")) == (
+        "dev-0", "ALM", 1000.0, "2.50", 0.5
+    )
+
+
+def test_readings_text():
+    mrid, code, start, interval, samples = \
+        payload.decode_readings(_view("dev-0,W,1000,0.5,1,2.5"))
+    assert (mrid, code, start, interval) == ("dev-0", "W", 1000.0, 0.5)
+    assert list(samples) == [1.0, 2.5]
+
+
+@pytest.mark.parametrize("decode, text", [
+    (payload.decode_device, "dev-0,10.0.0.1,Heat pump"),
+    (payload.decode_device, "dev-0,10.0.0.1,Heat pump,1000,0.5,extra"),
+    (payload.decode_device, "dev-0,10.0.0.1,Heat pump,soon"),
+    (payload.decode_alarm, "dev-0,ALM,1000"),
+    (payload.decode_alarm, "dev-0,ALM,soon,1"),
+    (payload.decode_alarm, "dev-0,ALM,1000,1,full"),
+    (payload.decode_readings, "dev-0,W,1000"),
+    (payload.decode_readings, "dev-0,W,1000,0.5,1,x"),
+])
+def test_text_malformed(decode, text):
+    with pytest.raises(ValueError):
+        decode(_view(text))
+
+
+def test_text_not_utf_8():
+    with pytest.raises(ValueError):
+        payload.decode_device(_view(b"dev-\xff,10.0.0.1,Heat pump,1000"))
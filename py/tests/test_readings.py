@@ -0,0 +1,73 @@
+"""
+File: tests/test_readings.py
+Email: e.roderick@uqconnect.edu.au
+Description: Tests of meter reading storage and its downsampled tiers.
+"""
+
+# pylint: disable=missing-function-docstring,unused-argument
+
+import sqlite3 as sql
+
+from database import _dev_access
+from database.constants import READING_TIER_RAW
+from database.readings import query_readings, store_readings, TIERS
+from dispatch.actions import handle_listener_dev, handle_listener_readings
+import database.access as db
+
+# Constants
+START = 7200.0
+SAMPLES = [float(i) for i in range(60)]
+
+
+# Functions
+def _query(tier: int) -> list:
+    with db.get_reader() as con:
+        return query_readings(con, "dev-0", "W", START, START + 3600, tier)
+
+
+def test_repeated_batch_is_counted_once(database):
+    handle_listener_dev(("dev-0", "10.0.0.1", "Device", "100"))
+    handle_listener_readings(("dev-0", "W", START, 1.0, SAMPLES))
+    stored = {tier.seconds: _query(tier.seconds) for tier in TIERS}
+
+    # A redelivered batch, even with other samples, changes nothing
+    handle_listener_readings(("dev-0", "W", START, 1.0, SAMPLES))
+    assert not store_readings("dev-0", "W", START, 1.0, [0.0] * 60)
+    for tier in TIERS:
+        assert _query(tier.seconds) == stored[tier.seconds]
+
+    assert [value for _, value in stored[READING_TIER_RAW]] == SAMPLES
+    for tier in TIERS[1:]:
+        assert sum(bucket.count for bucket in stored[tier.seconds]) == 60
+
+
+def test_later_batch_is_added_to_tiers(database):
+    handle_listener_dev(("dev-0", "10.0.0.1", "Device", "100"))
+    assert store_readings("dev-0", "W", START, 1.0, SAMPLES)
+    assert store_readings("dev-0", "W", START + 60, 1.0, SAMPLES)
+    for tier in TIERS[1:]:
+        assert sum(bucket.count for bucket in _query(tier.seconds)) == 120
+
+
+def test_legacy_table_dropped_once(monkeypatch, tmp_path):
+    path = str(tmp_path / "old.sqlite3")
+    monkeypatch.setattr(_dev_access, "SHEMS_DB_PATH", path)
+    con = sql.connect(path)
+    con.execute("CREATE TABLE reading(dev_id)")
+    con.commit()
+
+    _dev_access.create_database()
+    tables = {name for (name,) in con.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table'"
+    )}
+    assert "reading" not in tables
+    assert "readings" in tables
+
+    # Later starts leave a table of that name alone
+    con.execute("CREATE TABLE reading(dev_id)")
+    con.commit()
+    _dev_access.create_database()
+    assert con.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'reading'"
+    ).fetchone()
+    con.close()
@@ -0,0 +1,120 @@
+"""
+File: tests/test_request.py
+Email: e.roderick@uqconnect.edu.au
+Description: Tests of request validation: body size limits, the root element
+    check made before parsing, and schema validation of notify bodies.
+"""
+
+# pylint: disable=missing-function-docstring,protected-access
+# pylint: disable=redefined-outer-name
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from lxml import etree as ET
+
+from benchmarks.parse_control import CONTROL, DEFAULT_CONTROL
+from common.xml import create_parser
+from server import request as validation
+from server.request import NOTIFY_ROOT_TAGS, RequestMethod, XML_PARSER
+from shems.der_control import CONTROL_SCHEMA_PATH
+
+# Constants
+MAX_BODY = 1024
+XML_HEADERS = {"content-type": "application/sep+xml"}
+SCHEMA_PARSER = create_parser(
+    ET.XMLSchema(ET.parse(str(CONTROL_SCHEMA_PATH), XML_PARSER))
+)
+
+
+# Functions
+@pytest.fixture
+def client(monkeypatch) -> TestClient:
+    """ A client of an app that validates notify bodies against the control
+        schema, and answers with the root element's tag.
+    """
+    monkeypatch.setattr(validation, "SHEMS_MAX_BODY", MAX_BODY)
+    app = FastAPI()
+
+    @app.post("/notify")
+    async def notify(request: Request):
+        _, root = await validation.validate_request(
+            request, RequestMethod.POST, NOTIFY_ROOT_TAGS, SCHEMA_PARSER
+        )
+        return {"tag": root.tag}
+
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("body", [CONTROL, DEFAULT_CONTROL])
+def test_valid_controls_are_accepted(client, body):
+    response = client.post("/notify", content=body, headers=XML_HEADERS)
+    assert response.status_code == 200
+    assert response.json()["tag"] == ET.fromstring(body).tag
+
+
+def test_wrong_content_type_is_rejected(client):
+    response = client.post("/notify", content=CONTROL,
+                           headers={"content-type": "text/plain"})
+    assert response.status_code == 415
+
+
+def test_declared_oversize_body_is_rejected(client):
+    response = client.post("/notify", content=b"<a/>" + b" " * MAX_BODY,
+                           headers=XML_HEADERS)
+    assert response.status_code == 413
+
+
+def test_streamed_oversize_body_is_rejected(client):
+    # Sent chunked, so the size is only known from what is read
+    def chunks():
+        for _ in range(4):
+            yield b" " * (MAX_BODY // 2)
+
+    response = client.post("/notify", content=chunks(), headers=XML_HEADERS)
+    assert response.status_code == 413
+
+
+def test_unexpected_root_is_rejected(client):
+    response = client.post("/notify", content=b"<EndDevice><a/></EndDevice>",
+                           headers=XML_HEADERS)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Unexpected XML root element"
+
+
+def test_malformed_body_is_rejected(client):
+    response = client.post("/notify", content=b"<DERControl><a></DERControl>",
+                           headers=XML_HEADERS)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "XML body could not be parsed"
+
+
+def test_schema_invalid_body_is_rejected(client):
+    response = client.post(
+        "/notify",
+        content=b"<DERControl><unknown>1</unknown></DERControl>",
+        headers=XML_HEADERS
+    )
+    assert response.status_code == 400
+
+
+def test_root_tag_stops_at_the_root():
+    # The malformed tail is never parsed
+    body = b"<?xml version='1.0'?>\n<DERControl>" + b"<<<" * 2000
+    assert validation._root_tag(body) == "DERControl"
+
+
+def test_root_tag_spans_peeks():
+    body = b"<!--" + b"x" * (validation.ROOT_PEEK_SIZE * 2) + b"-->\n<Root/>"
+    assert validation._root_tag(body) == "Root"
+
+
+def test_root_tag_of_a_body_without_elements():
+    assert validation._root_tag(b"") is None
+
+
+def test_entities_are_not_resolved():
+    body = (b"<!DOCTYPE r [<!ENTITY e SYSTEM 'file:///etc/passwd'>]>"
+            b"<r>&e;</r>")
+    root = ET.fromstring(body, XML_PARSER)
+    assert "root:" not in (root.text or "")
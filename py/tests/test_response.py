@@ -0,0 +1,163 @@
+"""
+File: tests/test_response.py
+Email: e.roderick@uqconnect.edu.au
+Description: Tests of the device resource responses.
+"""
+
+# pylint: disable=missing-function-docstring,protected-access
+# pylint: disable=redefined-outer-name,unused-argument
+
+from email.utils import formatdate
+
+import pytest
+from fastapi import HTTPException
+
+from database import _dev_access
+from database.constants import Tables
+from server import response
+from server.request import ListParams
+from shems.host import get_host
+import database.access as db
+
+# Constants
+DEVICES = 20
+
+
+# Functions
+@pytest.fixture
+def devices() -> list[str]:
+    """ Replace the known devices with the host and DEVICES others, each read
+        a second after the last.
+
+    Returns:
+        The device mRIDs in list order.
+    """
+    _dev_access.create_database()
+    host = str(get_host().mrid)
+    mrids = [host] + [f"dev-{i:02}" for i in range(DEVICES)]
+    with db.transaction() as con:
+        con.execute("DELETE FROM status")
+        con.execute("DELETE FROM devices")
+        for i, mrid in enumerate(mrids):
+            con.execute("INSERT INTO devices VALUES (?, '10.0.0.1', 'Device')",
+                        (mrid,))
+            con.execute("INSERT INTO status VALUES (?, ?, 1, 0.5)",
+                        (mrid, 1000 + i))
+        db.mark_changed(Tables.DEVICES)
+    response._device_list_cache.clear()
+    response._device_cache.clear()
+    return mrids
+
+
+def _forbid_reads(monkeypatch) -> None:
+    """ Fail any read of the database or render of a device. """
+    def get_reader():
+        raise AssertionError("Read the database")
+    monkeypatch.setattr(response, "get_reader", get_reader)
+    monkeypatch.setattr(response, "_new_device", None)
+
+
+def _page(params: ListParams) -> tuple[int, int, list[str]]:
+    all_count, results, rows = response._read_device_page(params)
+    return all_count, results, [row[0] for row in rows]
+
+
+@pytest.mark.parametrize("params", [
+    ListParams(),
+    ListParams(start=4),
+    ListParams(limit=7),
+    ListParams(start=3, limit=11),
+    ListParams(start=DEVICES + 5),
+    ListParams(after=1005),
+    ListParams(start=2, after=1005, limit=9),
+])
+def test_chunked_page_matches_one_read(monkeypatch, devices, params):
+    expected = _page(params)
+    monkeypatch.setattr(response, "DEVICE_LIST_CHUNK", 3)
+    assert _page(params) == expected
+
+
+def test_page_counts(devices):
+    assert _page(ListParams()) == (DEVICES + 1, DEVICES + 1, devices)
+    assert _page(ListParams(start=5, limit=4)) == (DEVICES + 1, 4,
+                                                    devices[5:9])
+    assert _page(ListParams(after=1010)) == (DEVICES - 10, DEVICES - 10,
+                                             devices[11:])
+
+
+def test_streaming_holds_no_reader(monkeypatch, devices):
+    monkeypatch.setattr(response, "DEVICE_LIST_CHUNK", 3)
+    streams = []
+    for _ in range(db.SHEMS_DB_READERS + 1):
+        params = ListParams()
+        stream = response._stream_device_list(
+            params, db.table_version(Tables.DEVICES),
+            *response._read_device_page(params)
+        )
+        streams.append((next(stream), stream))
+
+    # Every pooled reader is free while the streams are part sent
+    with db.get_reader(), db.get_reader():
+        pass
+    for first, stream in streams:
+        assert b"dev-19" in first + b"".join(stream)
+
+
+def test_device_validators_come_from_the_device(devices):
+    result = response.handle_read_device_id("dev-03", {})
+    assert result.status_code == 200
+    assert result.headers["etag"].startswith('W/"')
+    assert result.headers["last-modified"] == formatdate(1004, usegmt=True)
+
+
+def test_matching_device_etag_reads_nothing(devices, monkeypatch):
+    etag = response.handle_read_device_id("dev-03", {}).headers["etag"]
+    modified = response.handle_read_device(4, {}).headers["last-modified"]
+
+    _forbid_reads(monkeypatch)
+    result = response.handle_read_device_id("dev-03",
+                                            {"if-none-match": etag})
+    assert result.status_code == 304
+    assert result.headers["etag"] == etag
+    result = response.handle_read_device(4, {"if-modified-since": modified})
+    assert result.status_code == 304
+
+
+def test_changed_device_is_sent_again(devices):
+    etag = response.handle_read_device_id("dev-03", {}).headers["etag"]
+    with db.transaction() as con:
+        con.execute("UPDATE status SET reading_time = 5000 "
+                    "WHERE dev_id = 'dev-03'")
+        db.mark_changed(Tables.DEVICES, "dev-03")
+
+    result = response.handle_read_device_id("dev-03",
+                                            {"if-none-match": etag})
+    assert result.status_code == 200
+    assert result.headers["etag"] != etag
+    assert result.headers["last-modified"] == formatdate(5000, usegmt=True)
+
+
+@pytest.mark.parametrize("headers", [
+    {"if-none-match": "*"},
+    {"if-modified-since": "Tue, 01 Jan 2099 00:00:00 GMT"},
+])
+def test_missing_device_is_never_not_modified(devices, headers):
+    with pytest.raises(HTTPException) as error:
+        response.handle_read_device_id("missing", headers)
+    assert error.value.status_code == 404
+
+    with pytest.raises(HTTPException) as error:
+        response.handle_read_device(DEVICES + 1, headers)
+    assert error.value.status_code == 400
+
+
+def test_matching_list_etag_reads_nothing(devices, monkeypatch):
+    result = response.handle_read_device_list(ListParams(), {})
+    etag = result.headers["etag"]
+    assert result.headers["last-modified"] == formatdate(1000 + DEVICES,
+                                                         usegmt=True)
+
+    _forbid_reads(monkeypatch)
+    result = response.handle_read_device_list(ListParams(),
+                                              {"if-none-match": etag})
+    assert result.status_code == 304
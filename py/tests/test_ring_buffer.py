@@ -0,0 +1,215 @@
+"""
+File: tests/test_ring_buffer.py
+Email: e.roderick@uqconnect.edu.au
+Description: Tests of the RingBuffer used between the server's threads, and
+    of the prioritised lanes of the dispatcher's LaneBuffer.
+"""
+
+# pylint: disable=missing-function-docstring,protected-access
+# pylint: disable=unbalanced-tuple-unpacking
+
+import queue
+import threading
+import time
+
+import pytest
+
+from common.ring_buffer import Closed, Lane, LaneBuffer, NotifyBufferFinish
+from common.ring_buffer import Overflow, RingBuffer
+from dispatch.actions import DispatchLane
+from dispatch.dispatch import create_dispatch_buffer
+
+
+def test_fifo_order():
+    buffer = RingBuffer(4, overlap=False)
+    for i in range(3):
+        buffer.put(i)
+    assert [buffer.get() for _ in range(3)] == [0, 1, 2]
+
+
+def test_overlap_replaces_the_oldest():
+    buffer = RingBuffer(3, overlap=True)
+    buffer.put_many(range(5))
+
+    assert buffer.get_many(10) == [2, 3, 4]
+    assert buffer.overwritten == 2
+    assert buffer.high_water == 3
+
+
+def test_full_buffer_without_overlap():
+    buffer = RingBuffer(2, overlap=False)
+    buffer.put_many([0, 1])
+    with pytest.raises(queue.Full):
+        buffer.put(2, block=False)
+    with pytest.raises(queue.Full):
+        buffer.put(2, timeout=0.01)
+    assert buffer.full()
+
+
+def test_empty_buffer():
+    buffer = RingBuffer(2, overlap=False)
+    with pytest.raises(queue.Empty):
+        buffer.get(block=False)
+    with pytest.raises(queue.Empty):
+        buffer.get_many(5, timeout=0.01)
+    with pytest.raises(ValueError):
+        buffer.get(timeout=-1)
+
+
+def test_get_many_returns_what_is_available():
+    buffer = RingBuffer(0, overlap=False)
+    buffer.put_many(range(5))
+    assert buffer.get_many(3) == [0, 1, 2]
+    assert buffer.get_many(10) == [3, 4]
+
+
+def test_put_many_waits_for_room():
+    buffer = RingBuffer(2, overlap=False)
+    taken = []
+
+    def consume():
+        while len(taken) < 6:
+            taken.extend(buffer.get_many(6))
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    buffer.put_many(range(6), timeout=5)
+    consumer.join(timeout=5)
+    assert taken == list(range(6))
+
+
+def test_put_many_timeout_keeps_earlier_items():
+    buffer = RingBuffer(2, overlap=False)
+    with pytest.raises(queue.Full):
+        buffer.put_many(range(4), timeout=0.01)
+    assert buffer.get_many(10) == [0, 1]
+
+
+def test_sentinel_is_the_last_item_returned():
+    buffer = RingBuffer(0, overlap=False)
+    buffer.put_many([0, 1])
+    buffer.notify_finish()
+    buffer.put(2)
+
+    items = buffer.get_many(10)
+    assert items[:2] == [0, 1]
+    assert isinstance(items[-1], NotifyBufferFinish)
+    assert buffer.get_many(10) == [2]
+
+
+def test_confirmed_sentinel_closes_an_empty_buffer():
+    buffer = RingBuffer(0, overlap=False)
+    buffer.notify_finish()
+    [sentinel] = buffer.get_many(10)
+    buffer.confirm_sentinel(sentinel)
+
+    with pytest.raises(Closed):
+        buffer.get()
+    with pytest.raises(Closed):
+        buffer.put(0)
+
+
+def test_confirmed_sentinel_is_passed_on():
+    buffer = RingBuffer(0, overlap=False)
+    buffer.notify_finish()
+    [sentinel] = buffer.get_many(10)
+    buffer.put(0)
+    buffer.confirm_sentinel(sentinel)
+
+    assert buffer.get_many(10) == [0, sentinel]
+
+
+def test_close_wakes_a_waiting_consumer():
+    buffer = RingBuffer(0, overlap=False)
+    errors = []
+
+    def consume():
+        try:
+            buffer.get()
+        except Closed as e:
+            errors.append(e)
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    time.sleep(0.05)
+    buffer.confirm_sentinel(NotifyBufferFinish())
+    consumer.join(timeout=5)
+    assert len(errors) == 1
+
+
+def _lanes(
+    overflow: Overflow = Overflow.BLOCK,
+    weighted: bool = False,
+) -> LaneBuffer:
+    """ A control lane and a telemetry lane of two items. Items are
+        (lane, value) pairs.
+    """
+    return LaneBuffer(
+        [Lane(0, Overflow.BLOCK, 3), Lane(2, overflow, 1)],
+        lambda item: item[0],
+        weighted
+    )
+
+
+def test_lanes_are_strictly_prioritised():
+    buffer = _lanes()
+    buffer.put_many([(1, "t0"), (0, "c0"), (1, "t1"), (0, "c1")])
+
+    assert buffer.get_many(10) == [(0, "c0"), (0, "c1"), (1, "t0"), (1, "t1")]
+
+
+def test_weighted_lanes_share_by_weight():
+    buffer = _lanes(Overflow.DROP_OLDEST, weighted=True)
+    buffer.put_many([(0, i) for i in range(7)] + [(1, "t0"), (1, "t1")])
+
+    assert [lane for lane, _ in buffer.get_many(20)] == \
+        [0, 0, 0, 1, 0, 0, 0, 1, 0]
+
+
+def test_full_lane_drops_oldest():
+    buffer = _lanes(Overflow.DROP_OLDEST)
+    buffer.put_many([(1, "t0"), (1, "t1"), (1, "t2")])
+
+    assert buffer.get_many(10) == [(1, "t1"), (1, "t2")]
+    assert buffer.overwritten == 1
+
+
+def test_full_lane_drops_newest():
+    buffer = _lanes(Overflow.DROP_NEWEST)
+    buffer.put_many([(1, "t0"), (1, "t1")])
+    with pytest.raises(queue.Full):
+        buffer.put((1, "t2"))
+
+    assert buffer.get_many(10) == [(1, "t0"), (1, "t1")]
+
+
+def test_full_lane_blocks_only_itself():
+    buffer = _lanes(Overflow.BLOCK)
+    buffer.put_many([(1, "t0"), (1, "t1")])
+    with pytest.raises(queue.Full):
+        buffer.put((1, "t2"), timeout=0.01)
+
+    # Controls are never held up by full telemetry
+    buffer.put((0, "c0"), block=False)
+    assert buffer.lane_sizes() == [1, 2]
+
+
+def test_lanes_finish_once_drained():
+    buffer = _lanes()
+    buffer.put((1, "t0"))
+    buffer.notify_finish()
+    buffer.put((0, "c0"))
+
+    items = buffer.get_many(10)
+    assert items[:2] == [(0, "c0"), (1, "t0")]
+    assert isinstance(items[-1], NotifyBufferFinish)
+    buffer.confirm_sentinel(items[-1])
+    with pytest.raises(Closed):
+        buffer.get()
+
+
+def test_dispatch_buffer_sheds_telemetry_by_default():
+    buffer = create_dispatch_buffer()
+    assert buffer._lanes[DispatchLane.TELEMETRY].overflow is \
+        Overflow.DROP_OLDEST
+    assert buffer._lanes[DispatchLane.CONTROL].overflow is Overflow.BLOCK
@@ -0,0 +1,95 @@
+"""
+File: tests/test_scheduler.py
+Email: e.roderick@uqconnect.edu.au
+Description: Tests of the heap-based dispatch scheduler.
+"""
+
+# pylint: disable=missing-function-docstring,protected-access
+# pylint: disable=redefined-outer-name
+
+import threading
+import time
+
+import pytest
+
+from common.ring_buffer import RingBuffer
+from dispatch.actions import DispatchAction, DispatchData
+from dispatch.scheduler import DispatchScheduler
+
+
+@pytest.fixture
+def scheduler() -> DispatchScheduler:
+    scheduler = DispatchScheduler(RingBuffer(0, overlap=False))
+    yield scheduler
+    scheduler.close()
+
+
+def test_due_actions_are_returned_in_due_order(scheduler):
+    now = time.time()
+    scheduler.schedule("b", now - 1, DispatchAction.CONTROL_EXPIRE, "b")
+    scheduler.schedule("a", now - 2, DispatchAction.CONTROL_EXPIRE, "a")
+    scheduler.schedule("later", now + 60, DispatchAction.CONTROL_EXPIRE)
+
+    assert scheduler.wait_due() == [
+        DispatchData(DispatchAction.CONTROL_EXPIRE, "a"),
+        DispatchData(DispatchAction.CONTROL_EXPIRE, "b"),
+    ]
+    assert scheduler.pending() == 1
+
+
+def test_cancel_removes_a_pending_action(scheduler):
+    now = time.time()
+    scheduler.schedule("a", now - 1, DispatchAction.CONTROL_EXPIRE, "a")
+    scheduler.schedule("b", now - 1, DispatchAction.CONTROL_EXPIRE, "b")
+
+    assert scheduler.cancel("a")
+    assert not scheduler.cancel("a")
+    assert not scheduler.cancel("missing")
+    assert scheduler.wait_due() == [
+        DispatchData(DispatchAction.CONTROL_EXPIRE, "b"),
+    ]
+    assert scheduler.pending() == 0
+
+
+def test_schedule_replaces_a_pending_action(scheduler):
+    now = time.time()
+    scheduler.schedule("a", now - 1, DispatchAction.CONTROL_EXPIRE, "old")
+    scheduler.schedule("a", now - 1, DispatchAction.CONTROL_EXPIRE, "new")
+
+    assert scheduler.pending() == 1
+    assert scheduler.wait_due() == [
+        DispatchData(DispatchAction.CONTROL_EXPIRE, "new"),
+    ]
+
+
+def test_many_cancels_do_not_grow_the_heap(scheduler):
+    now = time.time()
+    for i in range(1000):
+        scheduler.schedule("a", now + 60, DispatchAction.CONTROL_EXPIRE, i)
+    assert scheduler.pending() == 1
+    assert len(scheduler._heap) < 100
+
+
+def test_earlier_action_wakes_the_waiter(scheduler):
+    scheduler.schedule("later", time.time() + 60, DispatchAction.HOST_REFRESH)
+    due = []
+    waiter = threading.Thread(target=lambda: due.append(scheduler.wait_due()))
+    waiter.start()
+
+    time.sleep(0.05)
+    scheduler.schedule("now", time.time(), DispatchAction.CONTROL_EXPIRE)
+    waiter.join(timeout=5)
+
+    assert due == [[DispatchData(DispatchAction.CONTROL_EXPIRE, None)]]
+
+
+def test_close_releases_the_waiter(scheduler):
+    due = []
+    waiter = threading.Thread(target=lambda: due.append(scheduler.wait_due()))
+    waiter.start()
+
+    time.sleep(0.05)
+    scheduler.close()
+    waiter.join(timeout=5)
+
+    assert due == [None]
@@ -0,0 +1,65 @@
+"""
+File: tests/test_server.py
+Email: e.roderick@uqconnect.edu.au
+Description: Tests of the SHEMS server's lifespan and endpoints.
+"""
+
+# pylint: disable=missing-function-docstring,redefined-outer-name
+# pylint: disable=unused-argument
+
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+from database import _dev_access
+from database.access import ConnectionManager
+from dispatch.actions import DISPATCH_ACTIONS, DispatchAction
+from server.server import shems_server
+import database.access as db
+
+
+@pytest.fixture
+def new_database(monkeypatch, tmp_path) -> None:
+    """ Point the server at a database file that does not exist yet. """
+    path = str(tmp_path / "new.sqlite3")
+    monkeypatch.setattr(_dev_access, "SHEMS_DB_PATH", path)
+    monkeypatch.setattr(db, "_manager", ConnectionManager(path))
+
+
+def test_device_list_before_dispatcher_starts(monkeypatch, new_database):
+    # Hold the dispatcher on its first action, so only the lifespan itself
+    # has prepared the database
+    release = threading.Event()
+    monkeypatch.setitem(DISPATCH_ACTIONS, DispatchAction.DB_INIT,
+                        lambda: release.wait(5))
+
+    try:
+        with TestClient(shems_server) as client:
+            response = client.get("/shem/dev/")
+            release.set()
+    finally:
+        release.set()
+
+    assert response.status_code == 200
+
+
+def test_alarm_routes(new_database):
+    with TestClient(shems_server) as client:
+        for path in ("/shem/alm/", "/shem/alm/?a=100&l=5",
+                     "/shem/alm/summary/"):
+            response = client.get(path)
+            assert response.status_code == 200, path
+            assert response.content.startswith(b"<Alarm")
+
+        assert client.get("/shem/alm/?l=x").status_code == 400
+        assert client.get("/shem/dev/id/dev-9/alm/").status_code == 404
+        assert client.get("/shem/dev/id/dev-9/alm/summary/").status_code \
+            == 404
+
+
+def test_status_history_route(new_database):
+    with TestClient(shems_server) as client:
+        assert client.get("/shem/dev/id/dev-9/status/").status_code == 404
+        assert client.get("/shem/dev/id/dev-9/status/?a=x").status_code \
+            == 400
@@ -0,0 +1,49 @@
+"""
+File: tests/test_state.py
+Email: e.roderick@uqconnect.edu.au
+Description: Tests of the registry of known devices and their held states.
+"""
+
+# pylint: disable=missing-function-docstring
+
+from dispatch.state import DeviceRegistry, DeviceState
+
+
+# Functions
+def _state(reading_time: float) -> DeviceState:
+    return DeviceState("10.0.0.1", "Device", reading_time, 1, None)
+
+
+def test_flushed_keeps_newer_state():
+    registry = DeviceRegistry()
+    registry.stored("dev-0", _state(100))
+    registry.defer("dev-0", _state(200))
+    pending = registry.dirty()
+
+    # Replaced while the flush was being written
+    registry.defer("dev-0", _state(300))
+    registry.flushed(pending)
+    assert registry.dirty() == {"dev-0": _state(300)}
+
+    registry.flushed(registry.dirty())
+    assert not registry.dirty()
+
+
+def test_status_stored_ignores_older_status():
+    registry = DeviceRegistry()
+    registry.stored("dev-0", _state(100))
+    registry.defer("dev-0", _state(300))
+    registry.status_stored("dev-0", 150, 1, 0.5)
+    assert registry.get("dev-0") == _state(300)
+    assert "dev-0" in registry.dirty()
+
+    registry.status_stored("dev-0", 300, 0, 0.5)
+    assert registry.get("dev-0") == _state(300)._replace(connect_status=0,
+                                                         charge_state=0.5)
+    assert not registry.dirty()
+
+
+def test_status_stored_ignores_unknown_device():
+    registry = DeviceRegistry()
+    registry.status_stored("dev-0", 100, 1, None)
+    assert "dev-0" not in registry
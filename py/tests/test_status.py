@@ -0,0 +1,104 @@
+"""
+File: tests/test_status.py
+Email: e.roderick@uqconnect.edu.au
+Description: Tests of the per device status history ring, and of the status
+    history resource response.
+"""
+
+# pylint: disable=missing-function-docstring,redefined-outer-name
+# pylint: disable=unused-argument
+
+import pytest
+from fastapi import HTTPException
+from lxml import etree as ET
+
+from database import status
+from dispatch.actions import handle_listener_dev
+from server import response
+from server.request import ListParams
+import database.access as db
+
+# Constants
+SLOTS = 5
+
+
+# Functions
+@pytest.fixture
+def ring(monkeypatch, database) -> None:
+    """ A device with a history ring of SLOTS readings. """
+    monkeypatch.setattr(status, "SHEMS_STATUS_HISTORY", SLOTS)
+    handle_listener_dev(("dev-0", "10.0.0.1", "Device", "100"))
+
+
+def _times(after: float = None) -> list[float]:
+    with db.get_reader() as con:
+        return [reading.reading_time
+                for reading in status.status_history(con, "dev-0", after)]
+
+
+def test_ring_keeps_newest_readings(ring):
+    for i in range(1, 12):
+        status.record_status("dev-0", 100 + i, 1, i / 10)
+    assert _times() == [107, 108, 109, 110, 111]
+    with db.get_reader() as con:
+        assert con.execute(
+            "SELECT COUNT(*) FROM status_history"
+        ).fetchone() == (SLOTS,)
+        assert con.execute(
+            "SELECT reading_time, charge_state FROM status"
+        ).fetchone() == (111, 1.1)
+
+
+def test_older_reading_is_history_only(ring):
+    assert status.record_status("dev-0", 300, 1)
+    assert not status.record_status("dev-0", 200, 0)
+    assert _times() == [100, 200, 300]
+    assert _times(after=100) == [200, 300]
+
+
+def test_trim_after_ring_shrinks(monkeypatch, ring):
+    for i in range(1, SLOTS):
+        status.record_status("dev-0", 100 + i, 1)
+    monkeypatch.setattr(status, "SHEMS_STATUS_HISTORY", 3)
+    status.trim_status_history()
+    assert _times() == [102, 103, 104]
+
+    # The ring carries on after its newest reading
+    status.record_status("dev-0", 105, 1)
+    assert _times() == [103, 104, 105]
+
+
+def test_status_history_response(ring):
+    status.record_status("dev-0", 200, 0, 0.5)
+    body = response.handle_read_status_history("dev-0", ListParams(), {}).body
+    root = ET.fromstring(body)
+    assert root.get('href').endswith("/shem/dev/id/dev-0/status/")
+    assert [[child.text for child in reading] for reading in root] == [
+        ["100", "1"],
+        ["200", "0", "0.5"],
+    ]
+
+    body = response.handle_read_status_history(
+        "dev-0", ListParams(after=100), {}
+    ).body
+    assert ET.fromstring(body).get('results') == "1"
+
+
+def test_status_history_not_modified(ring):
+    etag = response.handle_read_status_history(
+        "dev-0", ListParams(), {}
+    ).headers['etag']
+    assert response.handle_read_status_history(
+        "dev-0", ListParams(), {'if-none-match': etag}
+    ).status_code == 304
+
+    status.record_status("dev-0", 200, 1)
+    assert response.handle_read_status_history(
+        "dev-0", ListParams(), {'if-none-match': etag}
+    ).status_code == 200
+
+
+def test_status_history_of_unknown_device(ring):
+    with pytest.raises(HTTPException) as e:
+        response.handle_read_status_history("dev-9", ListParams(), {})
+    assert e.value.status_code == 404